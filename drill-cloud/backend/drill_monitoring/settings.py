@@ -1,6 +1,6 @@
 import os
 from pathlib import Path
-from decouple import config
+from decouple import config, Choices, Csv
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -59,14 +59,30 @@ TEMPLATES = [
 WSGI_APPLICATION = 'drill_monitoring.wsgi.application'
 
 # Database
+# Пул соединений с БД в каждом процессе (Daphne, воркеры ingest):
+# запрос и вызов database_sync_to_async берут открытое соединение из пула
+DB_POOL_ENABLED = config('DB_POOL_ENABLED', default=True, cast=bool)
+# Соединений, открываемых сразу, и максимум на процесс
+DB_POOL_MIN_SIZE = config('DB_POOL_MIN_SIZE', default=2, cast=int)
+DB_POOL_MAX_SIZE = config('DB_POOL_MAX_SIZE', default=10, cast=int)
+# Сколько ждать свободное соединение, прежде чем вернуть ошибку (сек)
+DB_POOL_TIMEOUT = config('DB_POOL_TIMEOUT', default=5.0, cast=float)
+# Соединение, простоявшее в пуле дольше, проверяется перед выдачей (сек)
+DB_POOL_CHECK_INTERVAL = config('DB_POOL_CHECK_INTERVAL', default=10.0, cast=float)
+# Без пула: время жизни постоянного соединения (сек)
+DB_CONN_MAX_AGE = config('DB_CONN_MAX_AGE', default=60, cast=int)
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'monitoring.backends.postgresql_pool' if DB_POOL_ENABLED else 'django.db.backends.postgresql',
         'NAME': config('POSTGRES_DB', default='drill_monitoring'),
         'USER': config('POSTGRES_USER', default='drill_user'),
         'PASSWORD': config('POSTGRES_PASSWORD', default='drill_password'),
         'HOST': config('POSTGRES_HOST', default='postgres'),
         'PORT': config('POSTGRES_PORT', default='5432'),
+        # С пулом соединение возвращается в пул после каждого запроса
+        'CONN_MAX_AGE': 0 if DB_POOL_ENABLED else DB_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
@@ -125,7 +141,163 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Cache (Redis)
+CACHE_REDIS_URL = config('CACHE_REDIS_URL', default='redis://redis:6379/1')
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': CACHE_REDIS_URL,
+    }
+}
+
+# Кеш ответов REST API в Redis (ETag): TTL по эндпоинтам (сек). Запись
+# уставок и данных тега меняет версию, и ответ перестраивается сразу
+RESPONSE_CACHE_ENABLED = config('RESPONSE_CACHE_ENABLED', default=True, cast=bool)
+RESPONSE_CACHE_THRESHOLDS_TTL = config('RESPONSE_CACHE_THRESHOLDS_TTL', default=300, cast=int)
+RESPONSE_CACHE_TAGS_TTL = config('RESPONSE_CACHE_TAGS_TTL', default=30, cast=int)
+RESPONSE_CACHE_DATA_TTL = config('RESPONSE_CACHE_DATA_TTL', default=10, cast=int)
+
 # MQTT Configuration
 MQTT_BROKER = config('MQTT_BROKER', default='mosquitto')
 MQTT_PORT = config('MQTT_PORT', default=1883, cast=int)
-MQTT_CLIENT_ID = config('MQTT_CLIENT_ID', default='drill-backend') 
\ No newline at end of file
+MQTT_CLIENT_ID = config('MQTT_CLIENT_ID', default='drill-backend')
+# Группа общей подписки для воркеров ingest в режиме share
+MQTT_SHARE_GROUP = config('MQTT_SHARE_GROUP', default='drill-ingest') 
+
+# Пакетная запись телеметрии
+INGEST_BATCH_SIZE = config('INGEST_BATCH_SIZE', default=500, cast=int)
+INGEST_LINGER_MS = config('INGEST_LINGER_MS', default=200, cast=int)
+INGEST_QUEUE_SIZE = config('INGEST_QUEUE_SIZE', default=20000, cast=int)
+INGEST_PUT_TIMEOUT = config('INGEST_PUT_TIMEOUT', default=1.0, cast=float)
+INGEST_SHUTDOWN_TIMEOUT = config('INGEST_SHUTDOWN_TIMEOUT', default=30.0, cast=float)
+# Воркеры start_mqtt: количество процессов и способ распределения тегов
+INGEST_WORKERS = config('INGEST_WORKERS', default=1, cast=int)
+INGEST_PARTITION_MODE = config('INGEST_PARTITION_MODE', default='hash', cast=Choices(['hash', 'share']))
+INGEST_ENGINE = config('INGEST_ENGINE', default='thread', cast=Choices(['thread', 'asyncio']))
+INGEST_HEALTH_INTERVAL = config('INGEST_HEALTH_INTERVAL', default=10, cast=int)
+
+# Локальный журнал ingest (SQLite): пачки пишутся в него до Postgres и
+# дописываются в БД после сбоя
+INGEST_SPOOL_ENABLED = config('INGEST_SPOOL_ENABLED', default=True, cast=bool)
+INGEST_SPOOL_DIR = config('INGEST_SPOOL_DIR', default=str(BASE_DIR / 'spool'))
+INGEST_SPOOL_MAX_MB = config('INGEST_SPOOL_MAX_MB', default=1024, cast=int)
+# Сколько последних пачек держать в памяти, чтобы не читать их с диска
+INGEST_SPOOL_MEMORY_BATCHES = config('INGEST_SPOOL_MEMORY_BATCHES', default=20, cast=int)
+# Пауза между попытками записи в недоступную БД (сек)
+INGEST_SPOOL_RETRY_INTERVAL = config('INGEST_SPOOL_RETRY_INTERVAL', default=2.0, cast=float)
+# PRAGMA synchronous журнала: NORMAL - переживает падение процесса, FULL - и отключение питания
+INGEST_SPOOL_SYNCHRONOUS = config('INGEST_SPOOL_SYNCHRONOUS', default='NORMAL', cast=Choices(['NORMAL', 'FULL']))
+
+# Метрики Prometheus процесса ingest: порт HTTP сервера /metrics
+# (воркер N слушает METRICS_PORT + N, 0 - сервер не запускается)
+METRICS_PORT = config('METRICS_PORT', default=9100, cast=int)
+
+# Журнал ingest: уровень и формат (text или json - одна строка JSON на запись)
+INGEST_LOG_LEVEL = config('INGEST_LOG_LEVEL', default='INFO', cast=Choices(['DEBUG', 'INFO', 'WARNING', 'ERROR']))
+INGEST_LOG_FORMAT = config('INGEST_LOG_FORMAT', default='text', cast=Choices(['text', 'json']))
+# На уровне DEBUG в журнал попадает каждое N-е сообщение тега (0 - ни одного)
+INGEST_LOG_SAMPLE_RATE = config('INGEST_LOG_SAMPLE_RATE', default=1000, cast=int)
+# Повторяющаяся ошибка одного вида выводится не чаще раза в N секунд
+INGEST_LOG_ERROR_INTERVAL = config('INGEST_LOG_ERROR_INTERVAL', default=10.0, cast=float)
+# Интервал сводки ingest (сек)
+INGEST_LOG_SUMMARY_INTERVAL = config('INGEST_LOG_SUMMARY_INTERVAL', default=60.0, cast=float)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'text': {
+            'format': '%(asctime)s %(levelname)s %(name)s: %(message)s',
+        },
+        'json': {
+            '()': 'monitoring.ingest_log.JsonFormatter',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': INGEST_LOG_FORMAT,
+        },
+    },
+    'loggers': {
+        'monitoring': {
+            'handlers': ['console'],
+            'level': INGEST_LOG_LEVEL,
+            'propagate': False,
+        },
+    },
+}
+
+# Кеш уставок в процессе ingest
+THRESHOLD_CACHE_CHECK_INTERVAL = config('THRESHOLD_CACHE_CHECK_INTERVAL', default=1.0, cast=float)
+THRESHOLD_CACHE_MAX_AGE = config('THRESHOLD_CACHE_MAX_AGE', default=60.0, cast=float)
+
+# Кто рассылает WebSocket обновления: 'ingest' - MQTT клиент после записи
+# пачки, 'signal' - обработчики сигналов моделей
+BROADCAST_MODE = config('BROADCAST_MODE', default='ingest', cast=Choices(['ingest', 'signal']))
+
+# Объединение обновлений сенсоров: раз в интервал в группу sensor_<tag>
+# уходит одно сообщение sensor_batch. 0 - отправлять каждое значение.
+BROADCAST_BATCH_INTERVAL_MS = config('BROADCAST_BATCH_INTERVAL_MS', default=250, cast=int)
+# Интервалы для отдельных тегов: "tag1=1000,tag2=500"
+BROADCAST_TAG_INTERVALS = {
+    tag.strip(): int(ms)
+    for tag, ms in (
+        item.split('=', 1)
+        for item in config('BROADCAST_TAG_INTERVALS', default='', cast=Csv())
+    )
+}
+# Максимум точек в колоночном ответе WebSocket get_latest_data (limit)
+WS_LATEST_MAX_POINTS = config('WS_LATEST_MAX_POINTS', default=1000, cast=int)
+
+# Секционированное хранение sensor_data (manage.py sensor_partitions)
+SENSOR_PARTITION_INTERVAL = config('SENSOR_PARTITION_INTERVAL', default='day', cast=Choices(['day', 'week', 'month']))
+SENSOR_PARTITION_AHEAD_DAYS = config('SENSOR_PARTITION_AHEAD_DAYS', default=7, cast=int)
+
+# Агрегаты 1s/1m/1h, которые ingest обновляет после каждой пачки
+ROLLUPS_ENABLED = config('ROLLUPS_ENABLED', default=True, cast=bool)
+# Максимум сырых строк в ответе /api/data/?points=...
+DATA_MAX_RAW_ROWS = config('DATA_MAX_RAW_ROWS', default=10000, cast=int)
+# Максимум points и строк агрегатов на тег в ответе /api/data/?points=...
+DATA_MAX_POINTS = config('DATA_MAX_POINTS', default=5000, cast=int)
+
+# Выгрузка истории (/api/data/export/, manage.py export_sensor_data): строк
+# за одно чтение курсора, предел скорости чтения (0 - без предела) и
+# одновременных выгрузок через API в процессе
+EXPORT_CHUNK_SIZE = config('EXPORT_CHUNK_SIZE', default=5000, cast=int)
+EXPORT_ROWS_PER_SECOND = config('EXPORT_ROWS_PER_SECOND', default=100000, cast=int)
+EXPORT_MAX_CONCURRENT = config('EXPORT_MAX_CONCURRENT', default=2, cast=int)
+
+# Эпизоды инцидентов: одна запись на период нарушения вместо записи на каждое значение
+INCIDENT_EPISODES = config('INCIDENT_EPISODES', default=True, cast=bool)
+# Сколько значение должно продержаться в норме, чтобы эпизод закрылся (сек)
+INCIDENT_CLEAR_SECONDS = config('INCIDENT_CLEAR_SECONDS', default=5.0, cast=float)
+# Полоса гистерезиса в процентах от уставки
+INCIDENT_HYSTERESIS_PERCENT = config('INCIDENT_HYSTERESIS_PERCENT', default=0.0, cast=float)
+# Интервал сводок по открытому эпизоду (сек)
+INCIDENT_SUMMARY_INTERVAL = config('INCIDENT_SUMMARY_INTERVAL', default=60.0, cast=float)
+# Эпизод закрывается, если значения тега не поступали столько секунд (0 - не закрывать)
+INCIDENT_STALE_SECONDS = config('INCIDENT_STALE_SECONDS', default=300.0, cast=float)
+# Как часто ingest закрывает эпизоды и отправляет сводки без новых значений (сек)
+INCIDENT_SWEEP_INTERVAL = config('INCIDENT_SWEEP_INTERVAL', default=1.0, cast=float)
+
+# Сроки хранения данных (manage.py apply_retention). Удаление выключено,
+# пока не включено явно: apply_retention удаляет историю старше сроков
+RETENTION_ENABLED = config('RETENTION_ENABLED', default=False, cast=bool)
+RETENTION_RAW_DAYS = config('RETENTION_RAW_DAYS', default=30, cast=int)
+RETENTION_ROLLUP_MONTHS = config('RETENTION_ROLLUP_MONTHS', default=12, cast=int)
+RETENTION_INCIDENT_DAYS = config('RETENTION_INCIDENT_DAYS', default=365, cast=int)
+# Сроки для тегов и префиксов: "pressure_*=7:6,flow_rate_1=90:24"
+# (дней сырых данных : месяцев агрегатов)
+RETENTION_POLICIES = {
+    pattern.strip(): tuple(int(v) for v in days.split(':', 1))
+    for pattern, days in (
+        item.split('=', 1)
+        for item in config('RETENTION_POLICIES', default='', cast=Csv())
+    )
+}
+# Удаление пачками: строк за транзакцию и пауза между пачками (сек)
+RETENTION_BATCH_SIZE = config('RETENTION_BATCH_SIZE', default=10000, cast=int)
+RETENTION_BATCH_PAUSE = config('RETENTION_BATCH_PAUSE', default=0.1, cast=float)
+# Сколько ждать блокировку, прежде чем отложить удаление до следующего запуска
+RETENTION_LOCK_TIMEOUT = config('RETENTION_LOCK_TIMEOUT', default='5s')
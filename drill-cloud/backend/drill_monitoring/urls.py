@@ -1,7 +1,9 @@
 from django.contrib import admin
 from django.urls import path, include
+from monitoring.views import metrics
  
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('monitoring.urls')),
+    path('metrics', metrics),
 ] 
\ No newline at end of file
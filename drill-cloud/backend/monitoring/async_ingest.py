@@ -0,0 +1,403 @@
+import asyncio
+import logging
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+import aiomqtt
+from django.conf import settings
+from django.db import close_old_connections, connection
+from .models import SensorData
+from .mqtt_client import (
+    TELEMETRY_TOPICS, PARTITION_HASH, PARTITION_SHARE,
+    tag_partition, worker_client_id, extract_tag_from_topic, topic_pattern,
+    evaluate_batch_thresholds, evaluate_rules, sweep_incidents
+)
+from .payloads import PayloadError, extract_frame_prefix, parse_sensor_samples
+from .episodes import incident_engine
+from .thresholds import threshold_cache
+from .health import report_worker_health
+from .db_pool import pool_stats
+from .ingest_log import ingest_log
+from .rollups import update_rollups
+from .catalog import update_catalog
+from .latest import update_latest
+from .response_cache import bump_data_versions
+from .spool import SpoolForwarder, open_spool
+from .metrics import (
+    MESSAGES_RECEIVED, MESSAGES_PARSED, MESSAGES_DROPPED, SAMPLES_PARSED, SAMPLES_DROPPED,
+    SAMPLES_WRITTEN, PARSE_SECONDS, DB_INSERT_SECONDS, DB_INSERT_ERRORS,
+    BATCH_SIZE, register_ingest_metrics
+)
+from .broadcast import (
+    BroadcastScheduler, broadcast_stats, signal_mode, sensor_data_bulk_saved,
+    agroup_send, sensor_update_message, sensor_batch_message,
+    incident_alert_message
+)
+
+logger = logging.getLogger(__name__)
+
+# Пауза перед повторным подключением к брокеру (сек)
+RECONNECT_INTERVAL = 5
+
+# Маркер остановки для очереди записи
+_STOP = object()
+
+
+class AsyncIngestService:
+    """Asyncio-движок приема телеметрии
+
+    Альтернатива MQTTClient: сообщения читает асинхронный MQTT клиент
+    (aiomqtt) в event loop, пачки по INGEST_BATCH_SIZE / INGEST_LINGER_MS
+    пишутся в БД в отдельном потоке (один поток - записи идут по порядку),
+    а рассылка в channel layer выполняется через await, без async_to_sync.
+    Распределение тегов между воркерами такое же, как у MQTTClient.
+
+    С журналом spool пачки из event loop добавляются в локальный журнал, а в
+    БД их пишет поток пересылки (SpoolForwarder), как у SensorDataWriter.
+    """
+
+    def __init__(self, worker_index=0, workers=1, partition=PARTITION_HASH,
+                 batch_size=None, linger_ms=None, queue_size=None, spool_name=None):
+        self.worker_index = worker_index
+        self.workers = workers
+        self.partition = partition
+        self.client_id = worker_client_id(worker_index, workers)
+        # Журнал по умолчанию назван по client id воркера
+        self.spool_name = spool_name or self.client_id
+        self.batch_size = batch_size or settings.INGEST_BATCH_SIZE
+        if linger_ms is None:
+            linger_ms = settings.INGEST_LINGER_MS
+        self.linger = linger_ms / 1000
+        self.queue_size = queue_size or settings.INGEST_QUEUE_SIZE
+        self.scheduler = None
+        if settings.BROADCAST_BATCH_INTERVAL_MS > 0:
+            self.scheduler = BroadcastScheduler()
+        self.received = 0
+        self.written = 0
+        self.dropped = 0
+        self.connected = False
+        self.queue = None
+        self.spool = None
+        self.forwarder = None
+        self._loop = None
+        self._db_executor = None
+        self._spool_executor = None
+        self._tasks = []
+        self._stopping = None
+
+    def subscription_topics(self):
+        """Топики для подписки с учетом режима распределения"""
+        if self.workers > 1 and self.partition == PARTITION_SHARE:
+            return [f"$share/{settings.MQTT_SHARE_GROUP}/{t}" for t in TELEMETRY_TOPICS]
+        return TELEMETRY_TOPICS
+
+    def owns_tag(self, tag):
+        """Обрабатывает ли этот воркер данный тег"""
+        if self.workers <= 1 or self.partition != PARTITION_HASH:
+            return True
+        return tag_partition(tag, self.workers) == self.worker_index
+
+    async def run(self):
+        """Работа до вызова stop(): прием сообщений с переподключением"""
+        await self.start()
+        consumer = asyncio.create_task(self._consume())
+        await self._stopping.wait()
+        consumer.cancel()
+        try:
+            await consumer
+        except asyncio.CancelledError:
+            pass
+        await self.shutdown()
+
+    def stop(self):
+        """Запрос остановки (вызывается из event loop)"""
+        if self._stopping is not None:
+            self._stopping.set()
+
+    async def start(self):
+        """Запуск потока записи и фоновых задач без подключения к брокеру"""
+        loop = self._loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self._stopping = asyncio.Event()
+        self._db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ingest-db')
+        await loop.run_in_executor(self._db_executor, threshold_cache.refresh, True)
+        await loop.run_in_executor(self._db_executor, incident_engine.load_open, self.owns_tag)
+        self.spool = await loop.run_in_executor(self._db_executor, open_spool, self.spool_name)
+        if self.spool is not None:
+            self._spool_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ingest-spool')
+            self.forwarder = SpoolForwarder(
+                self.spool, self._store_batch, self._forwarded, batch_size=self.batch_size
+            )
+            self.forwarder.start()
+        register_ingest_metrics(self.queue.qsize, self.forwarder)
+        self._tasks = [asyncio.create_task(self._write_loop())]
+        if self.scheduler is not None:
+            self._tasks.append(asyncio.create_task(self._broadcast_loop()))
+        self._tasks.append(asyncio.create_task(self._health_loop()))
+        self._tasks.append(asyncio.create_task(self._sweep_loop()))
+
+    async def shutdown(self):
+        """Дозапись очереди, отправка накопленных пачек и остановка задач"""
+        writer, *background = self._tasks
+        await self.queue.put(_STOP)
+        try:
+            await asyncio.wait_for(writer, settings.INGEST_SHUTDOWN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.error(
+                f"Запись не завершилась, в очереди осталось {self.queue.qsize()} записей"
+            )
+        loop = asyncio.get_running_loop()
+        if self.forwarder is not None:
+            # Поток пересылки рассылает записанное через event loop - loop не блокируем
+            await loop.run_in_executor(
+                None, self.forwarder.stop, settings.INGEST_SHUTDOWN_TIMEOUT
+            )
+            self._spool_executor.shutdown()
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+        if self.scheduler is not None:
+            await self._send_batches(force=True)
+
+        await loop.run_in_executor(self._db_executor, incident_engine.flush)
+        await loop.run_in_executor(self._db_executor, self._close_connection)
+        self._db_executor.shutdown()
+        logger.info(
+            f"Ingest остановлен: записано {self.written}, отброшено {self.dropped}, "
+            f"рассылка: {broadcast_stats.snapshot()}"
+        )
+
+    async def _consume(self):
+        while True:
+            try:
+                async with aiomqtt.Client(
+                    settings.MQTT_BROKER, settings.MQTT_PORT,
+                    client_id=self.client_id, keepalive=60
+                ) as client:
+                    async with client.messages(queue_maxsize=self.queue_size) as messages:
+                        for topic in self.subscription_topics():
+                            await client.subscribe(topic)
+                        self.connected = True
+                        logger.info(f"Успешно подключен к MQTT брокеру ({self.client_id})")
+                        async for message in messages:
+                            await self.handle_message(message.topic.value, message.payload)
+            except aiomqtt.MqttError as e:
+                logger.warning(f"Отключен от MQTT брокера: {e}")
+            self.connected = False
+            await asyncio.sleep(RECONNECT_INTERVAL)
+
+    async def handle_message(self, topic, payload):
+        """Разбор сообщения и постановка в очередь записи"""
+        pattern = topic_pattern(topic)
+        try:
+            # Кадр с несколькими тегами или тег из топика
+            frame = extract_frame_prefix(topic) is not None
+            tag = None if frame else extract_tag_from_topic(topic)
+            if not frame and not tag:
+                MESSAGES_DROPPED.labels(pattern, 'no_tag').inc()
+                ingest_log.warning('no_tag', 'Не удалось извлечь тег из топика: %s', topic)
+                return
+
+            # Тег обрабатывает другой воркер
+            if tag and not self.owns_tag(tag):
+                return
+            self.received += 1
+            MESSAGES_RECEIVED.labels(pattern).inc()
+
+            with PARSE_SECONDS.time():
+                samples = parse_sensor_samples(topic, tag, payload)
+            if not samples:
+                MESSAGES_DROPPED.labels(pattern, 'no_value').inc()
+                return
+            if frame:
+                # Теги кадра распределены между воркерами
+                samples = [s for s in samples if self.owns_tag(s.tag)]
+                if not samples:
+                    return
+        except PayloadError:
+            MESSAGES_DROPPED.labels(pattern, 'invalid_payload').inc()
+            ingest_log.error('invalid_payload', 'Ошибка разбора payload: %s', payload)
+            return
+        except Exception as e:
+            MESSAGES_DROPPED.labels(pattern, 'error').inc()
+            ingest_log.error('error', 'Ошибка обработки сообщения: %s', e)
+            return
+        MESSAGES_PARSED.labels(pattern).inc()
+        SAMPLES_PARSED.labels(pattern).inc(len(samples))
+
+        for accepted, sensor_data in enumerate(samples):
+            try:
+                self.queue.put_nowait(sensor_data)
+            except asyncio.QueueFull:
+                # Очередь заполнена: ждем, не читая новые сообщения
+                try:
+                    await asyncio.wait_for(self.queue.put(sensor_data), settings.INGEST_PUT_TIMEOUT)
+                except asyncio.TimeoutError:
+                    # Остаток сообщения отбрасывается без ожидания на каждом значении
+                    self.dropped += len(samples) - accepted
+                    MESSAGES_DROPPED.labels(pattern, 'queue_full').inc()
+                    ingest_log.warning(
+                        'queue_full', 'Очередь записи переполнена, отброшено значений %s: %d (всего отброшено: %d)',
+                        sensor_data.tag, len(samples) - accepted, self.dropped
+                    )
+                    return
+
+    async def _write_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self.queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            stop = False
+            deadline = loop.time() + self.linger
+            while len(batch) < self.batch_size:
+                try:
+                    item = self.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self.queue.get(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+
+            await self._flush(batch)
+            if stop:
+                return
+
+    async def _flush(self, batch):
+        """Запись пачки в потоке БД (или в журнал) и рассылка"""
+        loop = asyncio.get_running_loop()
+        if self.forwarder is not None:
+            try:
+                ids = await loop.run_in_executor(self._spool_executor, self.spool.append, batch)
+            except sqlite3.Error as e:
+                logger.error(f"Ошибка записи {len(batch)} записей в журнал ingest: {e}")
+                ids = None
+            if ids is None:
+                self.dropped += len(batch)
+                SAMPLES_DROPPED.labels('spool_full').inc(len(batch))
+            else:
+                self.forwarder.submit(*ids, batch)
+            return
+        try:
+            events = await loop.run_in_executor(self._db_executor, self._write_batch, batch)
+        except Exception as e:
+            logger.error(f"Ошибка пакетной записи {len(batch)} записей: {e}")
+            self.dropped += len(batch)
+            SAMPLES_DROPPED.labels('db_error').inc(len(batch))
+            return
+        self.written += len(batch)
+        await self._publish(batch, events)
+
+    async def _publish(self, batch, events):
+        """Рассылка записанной пачки и событий инцидентов"""
+        if signal_mode():
+            # Рассылку выполнили обработчики сигналов в потоке записи
+            return
+        for sensor_data in batch:
+            if self.scheduler is not None:
+                self.scheduler.add(sensor_data)
+            else:
+                await agroup_send(f"sensor_{sensor_data.tag}", sensor_update_message(sensor_data))
+        for event, incident in events:
+            await agroup_send('incidents', incident_alert_message(incident, event))
+
+    def _write_batch(self, batch):
+        """Запись пачки и проверка уставок (выполняется в потоке БД)"""
+        self._store_batch(batch)
+        return self._process_batch(batch)
+
+    def _store_batch(self, batch):
+        # Оборванное после перезапуска БД соединение заменяется новым
+        close_old_connections()
+        try:
+            with DB_INSERT_SECONDS.time():
+                SensorData.objects.bulk_create(batch, batch_size=self.batch_size)
+        except Exception:
+            DB_INSERT_ERRORS.inc()
+            close_old_connections()
+            raise
+        BATCH_SIZE.observe(len(batch))
+        SAMPLES_WRITTEN.inc(len(batch))
+
+    def _forwarded(self, batch):
+        """Обработка пачки, записанной потоком пересылки журнала"""
+        self.written += len(batch)
+        events = self._process_batch(batch)
+        # Ждем рассылку: порядок пачек сохраняется, а поток пересылки не
+        # обгоняет event loop
+        asyncio.run_coroutine_threadsafe(self._publish(batch, events), self._loop).result()
+
+    def _process_batch(self, batch):
+        broadcast_stats.add_samples(len(batch))
+        if settings.ROLLUPS_ENABLED:
+            update_rollups(batch)
+        update_catalog(batch)
+        update_latest(batch)
+        bump_data_versions(batch)
+        if signal_mode():
+            sensor_data_bulk_saved.send(sender=SensorData, batch=batch)
+        events = evaluate_batch_thresholds(batch)
+        events.extend(evaluate_rules(batch))
+        return events
+
+    def _close_connection(self):
+        # connection - прокси к соединению текущего потока, поэтому
+        # закрывать его нужно в потоке БД
+        connection.close()
+
+    async def _sweep_loop(self):
+        """Закрытие эпизодов и сводки по таймеру, а не только с новыми пачками"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(settings.INCIDENT_SWEEP_INTERVAL)
+            events = await loop.run_in_executor(self._db_executor, sweep_incidents)
+            if events:
+                await self._publish([], events)
+
+    async def _broadcast_loop(self):
+        while True:
+            await asyncio.sleep(self.scheduler.tick)
+            await self._send_batches()
+
+    async def _send_batches(self, force=False):
+        for tag, points in self.scheduler.take_due(force).items():
+            await agroup_send(f"sensor_{tag}", sensor_batch_message(tag, points))
+
+    def health(self):
+        """Состояние воркера для сводки supervisor"""
+        return {
+            'pid': os.getpid(),
+            'worker_index': self.worker_index,
+            'engine': 'asyncio',
+            'connected': self.connected,
+            'received': self.received,
+            'written': self.written,
+            'dropped': self.dropped,
+            'queue_depth': self.queue.qsize(),
+            'spool': self.forwarder.stats() if self.forwarder else None,
+            'db_pool': pool_stats(),
+            'broadcast': broadcast_stats.snapshot(),
+        }
+
+    def report_health(self):
+        health = self.health()
+        report_worker_health(self.client_id, health)
+        ingest_log.summary(
+            {name: health[name] for name in ('received', 'written', 'dropped')},
+            queue_depth=health['queue_depth']
+        )
+
+    async def _health_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # health() читает журнал SQLite - вне event loop
+            await loop.run_in_executor(None, self.report_health)
+            await asyncio.sleep(settings.INGEST_HEALTH_INTERVAL)
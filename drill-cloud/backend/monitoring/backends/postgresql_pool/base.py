@@ -0,0 +1,20 @@
+from django.db.backends.postgresql import base
+from monitoring.db_pool import get_pool
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """PostgreSQL с пулом соединений процесса (monitoring/db_pool.py)
+
+    Django "закрывает" соединение в конце запроса и вызова
+    database_sync_to_async (CONN_MAX_AGE=0) - соединение возвращается в
+    пул, и следующий запрос получает уже открытое.
+    """
+
+    def get_new_connection(self, conn_params):
+        return get_pool(self.alias).getconn(
+            lambda: super(DatabaseWrapper, self).get_new_connection(conn_params)
+        )
+
+    def _close(self):
+        with self.wrap_database_errors:
+            get_pool(self.alias).putconn(self.connection)
@@ -0,0 +1,258 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from django.conf import settings
+from django.dispatch import Signal
+from channels.layers import get_channel_layer
+from asgiref.sync import async_to_sync
+from .metrics import FunctionMetric, GROUP_SEND_SECONDS, GROUP_SEND_ERRORS
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_MODE_INGEST = 'ingest'
+BROADCAST_MODE_SIGNAL = 'signal'
+
+# Отправляется процессом ingest после пакетной записи (bulk_create не
+# вызывает post_save). Аргумент batch - список сохраненных SensorData.
+sensor_data_bulk_saved = Signal()
+
+
+def signal_mode():
+    """True, если рассылку выполняют обработчики сигналов"""
+    return settings.BROADCAST_MODE == BROADCAST_MODE_SIGNAL
+
+
+class BroadcastStats:
+    """Счетчики публикаций в channel layer"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = 0
+        self.publishes = 0
+        self.errors = 0
+
+    def add_samples(self, count):
+        with self._lock:
+            self.samples += count
+
+    def add_publish(self, ok=True):
+        with self._lock:
+            self.publishes += 1
+            if not ok:
+                self.errors += 1
+
+    @property
+    def publishes_per_sample(self):
+        """Сколько публикаций в channel layer приходится на одно значение"""
+        return self.publishes / self.samples if self.samples else 0.0
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'samples': self.samples,
+                'publishes': self.publishes,
+                'errors': self.errors,
+                'publishes_per_sample': round(self.publishes_per_sample, 3),
+            }
+
+
+broadcast_stats = BroadcastStats()
+
+FunctionMetric(
+    'broadcast_samples_total', 'Значения, переданные на рассылку',
+    lambda: broadcast_stats.samples, kind='counter'
+)
+FunctionMetric(
+    'broadcast_publishes_total', 'Публикации в channel layer',
+    lambda: broadcast_stats.publishes, kind='counter'
+)
+
+
+def sensor_update_message(sensor_data):
+    """Сообщение sensor_update для группы sensor_<tag>"""
+    return {
+        'type': 'sensor_update',
+        'tag': sensor_data.tag,
+        'data': {
+            'timestamp': sensor_data.timestamp.isoformat(),
+            'value': float(sensor_data.value),
+            'tag': sensor_data.tag
+        }
+    }
+
+
+def incident_alert_message(incident, event=None):
+    """Сообщение incident_alert для группы incidents
+
+    event - open, update или close; по умолчанию определяется по статусу.
+    """
+    if event is None:
+        event = 'close' if incident.ended_at is not None else 'open'
+    return {
+        'type': 'incident_alert',
+        'event': event,
+        'incident': {
+            'id': incident.id,
+            'tag': incident.tag,
+            'value': float(incident.value),
+            'threshold_min': float(incident.threshold_min) if incident.threshold_min is not None else None,
+            'threshold_max': float(incident.threshold_max) if incident.threshold_max is not None else None,
+            'violation_type': incident.violation_type,
+            'timestamp': incident.timestamp.isoformat(),
+            'status': incident.status,
+            'peak_value': float(incident.peak_value) if incident.peak_value is not None else None,
+            'sample_count': incident.sample_count,
+            'last_seen': incident.last_seen.isoformat() if incident.last_seen else None,
+            'ended_at': incident.ended_at.isoformat() if incident.ended_at else None
+        }
+    }
+
+
+async def agroup_send(group, message):
+    """Публикация сообщения в группу channel layer из event loop"""
+    try:
+        with GROUP_SEND_SECONDS.labels(message['type']).time():
+            await get_channel_layer().group_send(group, message)
+    except Exception as e:
+        broadcast_stats.add_publish(ok=False)
+        GROUP_SEND_ERRORS.labels(message['type']).inc()
+        logger.error(f"Ошибка отправки WebSocket сообщения в группу {group}: {e}")
+        return False
+    broadcast_stats.add_publish()
+    return True
+
+
+def group_send(group, message):
+    """Публикация сообщения в группу channel layer"""
+    try:
+        with GROUP_SEND_SECONDS.labels(message['type']).time():
+            async_to_sync(get_channel_layer().group_send)(group, message)
+    except Exception as e:
+        broadcast_stats.add_publish(ok=False)
+        GROUP_SEND_ERRORS.labels(message['type']).inc()
+        logger.error(f"Ошибка отправки WebSocket сообщения в группу {group}: {e}")
+        return False
+    broadcast_stats.add_publish()
+    return True
+
+
+def sensor_batch_message(tag, points):
+    """Сообщение sensor_batch со всеми точками тега за один такт"""
+    return {
+        'type': 'sensor_batch',
+        'tag': tag,
+        'points': points
+    }
+
+
+class BroadcastScheduler:
+    """Объединяет обновления сенсоров в пачки по тегу
+
+    Вместо публикации каждого значения копит точки по тегам и раз в
+    интервал (BROADCAST_BATCH_INTERVAL_MS или значение из
+    BROADCAST_TAG_INTERVALS для тега) отправляет в группу sensor_<tag>
+    одно сообщение sensor_batch со всеми новыми точками.
+    """
+
+    def __init__(self, interval_ms=None, tag_intervals=None):
+        if interval_ms is None:
+            interval_ms = settings.BROADCAST_BATCH_INTERVAL_MS
+        if tag_intervals is None:
+            tag_intervals = settings.BROADCAST_TAG_INTERVALS
+        self.interval = interval_ms / 1000
+        self.tag_intervals = {tag: ms / 1000 for tag, ms in tag_intervals.items()}
+        self.tick = max(0.01, min([self.interval, *self.tag_intervals.values()]))
+        self._pending = defaultdict(list)
+        self._last_sent = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Запуск потока рассылки"""
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target=self._run, name='broadcast-scheduler', daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Остановка с отправкой накопленных точек"""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join()
+        self._thread = None
+        self.flush(force=True)
+
+    def add(self, sensor_data):
+        """Добавляет значение в пачку его тега"""
+        point = {
+            'timestamp': sensor_data.timestamp.isoformat(),
+            'value': float(sensor_data.value)
+        }
+        with self._lock:
+            self._pending[sensor_data.tag].append(point)
+
+    def take_due(self, force=False):
+        """Забирает пачки тегов, у которых подошел интервал: tag -> points"""
+        now = time.monotonic()
+        due = {}
+        with self._lock:
+            for tag in list(self._pending):
+                interval = self.tag_intervals.get(tag, self.interval)
+                if force or now - self._last_sent.get(tag, 0.0) >= interval:
+                    due[tag] = self._pending.pop(tag)
+                    self._last_sent[tag] = now
+        return due
+
+    def flush(self, force=False):
+        """Отправляет пачки тегов, у которых подошел интервал"""
+        for tag, points in self.take_due(force).items():
+            group_send(f"sensor_{tag}", sensor_batch_message(tag, points))
+
+    def _run(self):
+        while not self._stopping.wait(self.tick):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка рассылки пачек обновлений: {e}")
+
+
+# Планировщик запускается процессом ingest; пока он не запущен,
+# обновления публикуются по одному
+sensor_scheduler = None
+
+
+def start_broadcast_scheduler():
+    """Включает объединение обновлений, если задан интервал"""
+    global sensor_scheduler
+    if sensor_scheduler is None and settings.BROADCAST_BATCH_INTERVAL_MS > 0:
+        sensor_scheduler = BroadcastScheduler()
+        sensor_scheduler.start()
+    return sensor_scheduler
+
+
+def stop_broadcast_scheduler():
+    """Останавливает объединение обновлений, отправив накопленное"""
+    global sensor_scheduler
+    if sensor_scheduler is not None:
+        sensor_scheduler.stop()
+        sensor_scheduler = None
+
+
+def broadcast_sensor_update(sensor_data):
+    """Отправляет обновление сенсора подписчикам тега"""
+    scheduler = sensor_scheduler
+    if scheduler is not None:
+        scheduler.add(sensor_data)
+        return True
+    return group_send(f"sensor_{sensor_data.tag}", sensor_update_message(sensor_data))
+
+
+def broadcast_incident_alert(incident, event=None):
+    """Отправляет уведомление об инциденте"""
+    return group_send('incidents', incident_alert_message(incident, event))
@@ -0,0 +1,118 @@
+import logging
+from datetime import timedelta
+from psycopg2.extras import execute_values
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.utils import timezone
+from .models import SensorRollup, SensorTag
+from .rollups import bucket_start
+
+logger = logging.getLogger(__name__)
+
+# Окно счетчика сообщений и скорости
+STATS_WINDOW = timedelta(hours=24)
+
+_UPSERT_SQL = """
+    INSERT INTO sensor_tags AS c (tag, first_seen, last_seen, last_value, message_count)
+    VALUES %s
+    ON CONFLICT (tag) DO UPDATE SET
+        first_seen = LEAST(c.first_seen, EXCLUDED.first_seen),
+        last_seen = GREATEST(c.last_seen, EXCLUDED.last_seen),
+        last_value = CASE WHEN EXCLUDED.last_seen >= c.last_seen
+                          THEN EXCLUDED.last_value ELSE c.last_value END,
+        message_count = c.message_count + EXCLUDED.message_count
+"""
+
+_REBUILD_SQL = """
+    INSERT INTO sensor_tags (tag, first_seen, last_seen, last_value, message_count)
+    SELECT tag, min(timestamp), max(timestamp),
+           (array_agg(value ORDER BY timestamp DESC))[1], count(*)
+    FROM sensor_data
+    GROUP BY tag
+    ON CONFLICT (tag) DO UPDATE SET
+        first_seen = EXCLUDED.first_seen,
+        last_seen = EXCLUDED.last_seen,
+        last_value = EXCLUDED.last_value,
+        message_count = EXCLUDED.message_count
+"""
+
+
+def update_catalog(batch):
+    """Обновляет каталог тегов по записанной пачке: одна строка на тег"""
+    tags = {}
+    for sensor_data in batch:
+        entry = tags.get(sensor_data.tag)
+        if entry is None:
+            tags[sensor_data.tag] = [
+                sensor_data.timestamp, sensor_data.timestamp, float(sensor_data.value), 1
+            ]
+            continue
+        if sensor_data.timestamp < entry[0]:
+            entry[0] = sensor_data.timestamp
+        if sensor_data.timestamp >= entry[1]:
+            entry[1] = sensor_data.timestamp
+            entry[2] = float(sensor_data.value)
+        entry[3] += 1
+    if not tags:
+        return
+    rows = [(tag, *entry) for tag, entry in sorted(tags.items())]
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            execute_values(cursor.cursor, _UPSERT_SQL, rows)
+    except Exception as e:
+        logger.error(f"Ошибка обновления каталога тегов: {e}")
+
+
+def rebuild_catalog():
+    """Заполняет каталог по сырым данным (полный проход по sensor_data)"""
+    with connection.cursor() as cursor:
+        cursor.execute(_REBUILD_SQL)
+        return cursor.rowcount
+
+
+def window_counts(now=None):
+    """Количество сообщений по тегам за STATS_WINDOW из часовых агрегатов
+
+    Точность - до часа: учитываются часовые интервалы, начавшиеся внутри окна.
+    При ROLLUPS_ENABLED=False агрегаты не ведутся, и возвращается None:
+    считать строки sensor_data за сутки по всем тегам на каждый запрос
+    слишком дорого.
+    """
+    if not settings.ROLLUPS_ENABLED:
+        return None
+    now = now or timezone.now()
+    rows = SensorRollup.objects.filter(
+        resolution='1h', bucket__gte=bucket_start(now - STATS_WINDOW, '1h') + timedelta(hours=1)
+    ).values('tag').annotate(total=Sum('count')).values_list('tag', 'total')
+    return dict(rows)
+
+
+def tag_stats(search=None, active_only=True, now=None):
+    """Записи каталога со статистикой за окно: список словарей"""
+    now = now or timezone.now()
+    queryset = SensorTag.objects.all()
+    if search:
+        queryset = queryset.filter(tag__icontains=search)
+    if active_only:
+        queryset = queryset.filter(last_seen__gte=now - STATS_WINDOW)
+    counts = window_counts(now)
+
+    stats = []
+    for entry in queryset:
+        count = counts.get(entry.tag, 0) if counts is not None else None
+        window = min(STATS_WINDOW, now - entry.first_seen).total_seconds()
+        if count is None:
+            rate = None
+        else:
+            rate = round(count / window, 3) if window > 0 else 0.0
+        stats.append({
+            'tag': entry.tag,
+            'first_seen': entry.first_seen,
+            'last_seen': entry.last_seen,
+            'last_value': entry.last_value,
+            'message_count': entry.message_count,
+            'count_24h': count,
+            'rate': rate,
+        })
+    return stats
@@ -1,7 +1,13 @@
+import asyncio
 import json
+import msgpack
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.conf import settings
 from .models import SensorData, Threshold, Incident
+from .renderers import COMPACT_FORMATS, epoch_ms, columnar
+from .latest import aget_latest
+from .metrics import WEBSOCKET_CONNECTIONS, WEBSOCKET_SUBSCRIPTIONS
 
 
 class MonitoringConsumer(AsyncWebsocketConsumer):
@@ -9,7 +15,16 @@ class MonitoringConsumer(AsyncWebsocketConsumer):
     
     async def connect(self):
         """Обработчик подключения WebSocket"""
+        # Теги, по которым клиент получает пачки sensor_batch:
+        # tag -> минимальный интервал между пачками (сек)
+        self.batch_tags = {}
+        self.pending_points = {}
+        self.batch_sent_at = {}
+        self.batch_flush_tasks = {}
+        # Подписки клиента: tag -> режим (batch/single) для метрик
+        self.subscriptions = {}
         await self.accept()
+        WEBSOCKET_CONNECTIONS.inc()
         
         # Подписываемся на группу инцидентов
         await self.channel_layer.group_add(
@@ -24,7 +39,12 @@ class MonitoringConsumer(AsyncWebsocketConsumer):
     
     async def disconnect(self, close_code):
         """Обработчик отключения WebSocket"""
-        pass
+        for task in self.batch_flush_tasks.values():
+            task.cancel()
+        if hasattr(self, 'subscriptions'):
+            WEBSOCKET_CONNECTIONS.dec()
+            for tag in list(self.subscriptions):
+                self.track_subscription(tag, None)
     
     async def receive(self, text_data):
         """Обработчик входящих WebSocket сообщений"""
@@ -34,21 +54,33 @@ class MonitoringConsumer(AsyncWebsocketConsumer):
             
             if message_type == 'subscribe_sensor':
                 # Подписка на обновления конкретного сенсора
+                # batch=true - получать пачки sensor_batch вместо
+                # отдельных sensor_update, interval_ms - не чаще чем раз в
+                # указанный интервал
                 tag = data.get('tag')
                 if tag:
+                    if data.get('batch'):
+                        interval_ms = max(0, int(data.get('interval_ms') or 0))
+                        self.batch_tags[tag] = interval_ms / 1000
+                    else:
+                        self.stop_batching(tag)
+                    self.track_subscription(tag, 'batch' if tag in self.batch_tags else 'single')
                     await self.channel_layer.group_add(
                         f"sensor_{tag}",
                         self.channel_name
                     )
                     await self.send(text_data=json.dumps({
                         'type': 'subscribed',
-                        'tag': tag
+                        'tag': tag,
+                        'batch': tag in self.batch_tags
                     }))
             
             elif message_type == 'unsubscribe_sensor':
                 # Отписка от обновлений сенсора
                 tag = data.get('tag')
                 if tag:
+                    self.stop_batching(tag)
+                    self.track_subscription(tag, None)
                     await self.channel_layer.group_discard(
                         f"sensor_{tag}",
                         self.channel_name
@@ -60,9 +92,31 @@ class MonitoringConsumer(AsyncWebsocketConsumer):
             
             elif message_type == 'get_latest_data':
                 # Получение последних данных
+                # format=columnar|msgpack - последние limit точек в колоночном
+                # виде {"tag", "t", "v"}, msgpack отправляется бинарным кадром.
+                # Ряд читается из БД (в кеше ingest только последняя точка),
+                # поэтому limit ограничен WS_LATEST_MAX_POINTS
                 tag = data.get('tag')
-                if tag:
-                    latest_data = await self.get_latest_sensor_data(tag)
+                data_format = data.get('format')
+                if tag and data_format in COMPACT_FORMATS:
+                    try:
+                        limit = int(data.get('limit') or 1)
+                    except (TypeError, ValueError):
+                        limit = 1
+                    limit = min(max(limit, 1), settings.WS_LATEST_MAX_POINTS)
+                    message = {
+                        'type': 'latest_data',
+                        'tag': tag,
+                        'format': data_format,
+                        'data': await self.get_latest_series(tag, limit)
+                    }
+                    if data_format == 'msgpack':
+                        await self.send(bytes_data=msgpack.packb(message, use_bin_type=True))
+                    else:
+                        await self.send(text_data=json.dumps(message))
+                elif tag:
+                    # Из кеша последних значений, который ведет ingest
+                    latest_data = await aget_latest(tag)
                     await self.send(text_data=json.dumps({
                         'type': 'latest_data',
                         'tag': tag,
@@ -90,12 +144,84 @@ class MonitoringConsumer(AsyncWebsocketConsumer):
     
     async def sensor_update(self, event):
         """Отправка обновлений сенсора клиенту"""
+        if event['tag'] in self.batch_tags:
+            data = event['data']
+            await self.queue_points(event['tag'], [
+                {'timestamp': data['timestamp'], 'value': data['value']}
+            ])
+            return
         await self.send(text_data=json.dumps({
             'type': 'sensor_update',
             'tag': event['tag'],
             'data': event['data']
         }))
     
+    async def sensor_batch(self, event):
+        """Отправка пачки обновлений сенсора клиенту"""
+        tag = event['tag']
+        if tag in self.batch_tags:
+            await self.queue_points(tag, event['points'])
+            return
+        
+        # Клиент не подписан на пачки - разворачиваем в отдельные sensor_update
+        for point in event['points']:
+            await self.send(text_data=json.dumps({
+                'type': 'sensor_update',
+                'tag': tag,
+                'data': {**point, 'tag': tag}
+            }))
+    
+    async def queue_points(self, tag, points):
+        """Копит точки тега и отправляет их с интервалом клиента"""
+        self.pending_points.setdefault(tag, []).extend(points)
+        if tag in self.batch_flush_tasks:
+            return
+        
+        interval = self.batch_tags[tag]
+        loop = asyncio.get_running_loop()
+        wait = interval - (loop.time() - self.batch_sent_at.get(tag, 0.0))
+        if wait <= 0:
+            await self.flush_points(tag)
+        else:
+            self.batch_flush_tasks[tag] = asyncio.create_task(
+                self.flush_points_later(tag, wait)
+            )
+    
+    async def flush_points_later(self, tag, delay):
+        await asyncio.sleep(delay)
+        self.batch_flush_tasks.pop(tag, None)
+        await self.flush_points(tag)
+    
+    async def flush_points(self, tag):
+        """Отправка накопленных точек тега одной пачкой"""
+        points = self.pending_points.pop(tag, None)
+        if not points:
+            return
+        self.batch_sent_at[tag] = asyncio.get_running_loop().time()
+        await self.send(text_data=json.dumps({
+            'type': 'sensor_batch',
+            'tag': tag,
+            'points': points
+        }))
+    
+    def stop_batching(self, tag):
+        """Отключает пачки для тега и сбрасывает накопленное"""
+        self.batch_tags.pop(tag, None)
+        self.pending_points.pop(tag, None)
+        self.batch_sent_at.pop(tag, None)
+        task = self.batch_flush_tasks.pop(tag, None)
+        if task:
+            task.cancel()
+    
+    def track_subscription(self, tag, mode):
+        """Учет подписки тега в метриках (mode=None - отписка)"""
+        previous = self.subscriptions.pop(tag, None)
+        if previous:
+            WEBSOCKET_SUBSCRIPTIONS.labels(previous).dec()
+        if mode:
+            self.subscriptions[tag] = mode
+            WEBSOCKET_SUBSCRIPTIONS.labels(mode).inc()
+    
     async def incident_alert(self, event):
         """Отправка уведомления об инциденте"""
         await self.send(text_data=json.dumps({
@@ -104,19 +230,15 @@ class MonitoringConsumer(AsyncWebsocketConsumer):
         }))
     
     @database_sync_to_async
-    def get_latest_sensor_data(self, tag):
-        """Получение последних данных сенсора"""
-        try:
-            latest = SensorData.objects.filter(tag=tag).order_by('-timestamp').first()
-            if latest:
-                return {
-                    'timestamp': latest.timestamp.isoformat(),
-                    'value': float(latest.value),
-                    'tag': latest.tag
-                }
-            return None
-        except Exception:
-            return None
+    def get_latest_series(self, tag, limit):
+        """Последние точки сенсора в колоночном виде (запрос к sensor_data)"""
+        rows = list(
+            SensorData.objects.filter(tag=tag)
+            .order_by('-timestamp')
+            .values_list('timestamp', 'value')[:limit]
+        )
+        rows.reverse()
+        return columnar(tag, [epoch_ms(t) for t, _ in rows], [float(v) for _, v in rows])
     
     @database_sync_to_async
     def get_thresholds(self):
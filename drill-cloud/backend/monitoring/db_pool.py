@@ -0,0 +1,186 @@
+import collections
+import logging
+import threading
+import time
+import psycopg2
+from psycopg2 import extensions
+from django.conf import settings
+from .metrics import DB_POOL_WAIT_SECONDS, register_pool_metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionPool:
+    """Пул соединений psycopg2 одного процесса
+
+    При первой выдаче пул открывает min_size соединений. Свободные
+    соединения выдаются в порядке LIFO (самые "горячие"), новое открывается,
+    пока открытых меньше max_size, иначе вызывающий поток ждет освобождения
+    до timeout секунд и получает OperationalError. Соединение, простоявшее
+    в пуле дольше check_interval секунд, перед выдачей проверяется SELECT 1:
+    после перезапуска БД мертвые соединения закрываются и заменяются
+    новыми. Возвращенное соединение с незавершенной транзакцией
+    откатывается, оборванное - закрывается.
+    """
+
+    def __init__(self, min_size, max_size, timeout, check_interval):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self._idle = collections.deque()
+        self._cond = threading.Condition()
+        self.size = 0
+        self.in_use = 0
+        self.opened = 0
+        self.discarded = 0
+        self.waits = 0
+        self.timeouts = 0
+        self._filled = False
+
+    def getconn(self, connect):
+        """Соединение из пула; connect() открывает новое"""
+        started = time.monotonic()
+        connection = None
+        waited = False
+        with self._cond:
+            while True:
+                if self._idle:
+                    connection, returned_at = self._idle.pop()
+                    break
+                if self.size < self.max_size:
+                    self.size += 1
+                    break
+                remaining = started + self.timeout - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise psycopg2.OperationalError(
+                        f"Пул соединений с БД исчерпан: {self.max_size} соединений заняты "
+                        f"дольше {self.timeout} с"
+                    )
+                if not waited:
+                    self.waits += 1
+                    waited = True
+                self._cond.wait(remaining)
+            self.in_use += 1
+        DB_POOL_WAIT_SECONDS.observe(time.monotonic() - started)
+
+        try:
+            if connection is not None and (
+                time.monotonic() - returned_at >= self.check_interval and not self._ping(connection)
+            ):
+                logger.warning("Соединение с БД из пула недоступно, открывается новое")
+                self._close(connection)
+                self.discarded += 1
+                connection = None
+            if connection is None:
+                connection = connect()
+                self.opened += 1
+        except Exception:
+            with self._cond:
+                self.size -= 1
+                self.in_use -= 1
+                self._cond.notify()
+            raise
+        if not self._filled:
+            self._filled = True
+            self.fill(connect)
+        return connection
+
+    def putconn(self, connection):
+        """Возврат соединения в пул (или закрытие, если оно оборвано)"""
+        discard = bool(connection.closed)
+        if not discard:
+            status = connection.info.transaction_status
+            if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                discard = True
+            elif status != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    connection.rollback()
+                except psycopg2.Error:
+                    discard = True
+        if discard:
+            self._close(connection)
+        with self._cond:
+            self.in_use -= 1
+            if discard:
+                self.size -= 1
+                self.discarded += 1
+            else:
+                self._idle.append((connection, time.monotonic()))
+            self._cond.notify()
+
+    def fill(self, connect):
+        """Открывает соединения до min_size, чтобы первые запросы не ждали подключения"""
+        while True:
+            with self._cond:
+                if self.size >= self.min_size:
+                    return
+                self.size += 1
+            try:
+                connection = connect()
+            except Exception as e:
+                with self._cond:
+                    self.size -= 1
+                logger.warning(f"Не удалось заполнить пул соединений с БД: {e}")
+                return
+            self.opened += 1
+            with self._cond:
+                self._idle.append((connection, time.monotonic()))
+                self._cond.notify()
+
+    def _ping(self, connection):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            if not connection.autocommit:
+                connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _close(self, connection):
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+
+    def stats(self):
+        """Заполненность пула для состояния воркера и метрик"""
+        return {
+            'size': self.size,
+            'in_use': self.in_use,
+            'idle': len(self._idle),
+            'max_size': self.max_size,
+            'saturation': round(self.in_use / self.max_size, 3) if self.max_size else 0,
+            'opened': self.opened,
+            'discarded': self.discarded,
+            'waits': self.waits,
+            'timeouts': self.timeouts,
+        }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias):
+    """Пул соединений процесса для базы alias"""
+    pool = _pools.get(alias)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(alias)
+            if pool is None:
+                pool = ConnectionPool(
+                    settings.DB_POOL_MIN_SIZE, settings.DB_POOL_MAX_SIZE,
+                    settings.DB_POOL_TIMEOUT, settings.DB_POOL_CHECK_INTERVAL
+                )
+                _pools[alias] = pool
+                register_pool_metrics(pool)
+    return pool
+
+
+def pool_stats(alias='default'):
+    """Состояние пула или None, если пул не используется"""
+    pool = _pools.get(alias)
+    return pool.stats() if pool is not None else None
@@ -0,0 +1,162 @@
+import struct
+from io import BytesIO
+import numpy as np
+from django.db import connection
+
+METHOD_LTTB = 'lttb'
+METHOD_MINMAX = 'minmax'
+METHOD_AVG = 'avg'
+METHODS = (METHOD_LTTB, METHOD_MINMAX, METHOD_AVG)
+
+# Строка бинарного COPY из двух столбцов float8:
+# число полей, длина и значение для каждого столбца (big-endian)
+_COPY_ROW = np.dtype([
+    ('fields', '>i2'), ('x_len', '>i4'), ('x', '>f8'), ('y_len', '>i4'), ('y', '>f8')
+])
+_COPY_SIGNATURE = b'PGCOPY\n\xff\r\n\x00'
+
+_SERIES_SQL = """
+    COPY (
+        SELECT extract(epoch FROM timestamp)::float8, value::float8
+        FROM sensor_data
+        WHERE tag = {tag} AND timestamp >= {start} AND timestamp < {end}
+        ORDER BY timestamp
+    ) TO STDOUT WITH (FORMAT binary)
+"""
+
+
+def fetch_series(tag, start, end):
+    """Ряд тега за [start, end) в виде массивов (epoch-секунды, значения)
+
+    Строки читаются бинарным COPY и разбираются в NumPy одним вызовом,
+    без создания Python-объекта на каждую строку.
+    """
+    buffer = BytesIO()
+    with connection.cursor() as cursor:
+        pg_cursor = cursor.cursor
+        sql = _SERIES_SQL.format(
+            tag=pg_cursor.mogrify('%s', [tag]).decode(),
+            start=pg_cursor.mogrify('%s', [start]).decode(),
+            end=pg_cursor.mogrify('%s', [end]).decode(),
+        )
+        pg_cursor.copy_expert(sql, buffer)
+    return parse_copy_binary(buffer.getvalue())
+
+
+def parse_copy_binary(data):
+    """Разбор вывода COPY ... WITH (FORMAT binary) из двух столбцов float8"""
+    if not data.startswith(_COPY_SIGNATURE):
+        raise ValueError('Неожиданный формат бинарного COPY')
+    # Заголовок: сигнатура, флаги, длина расширения и само расширение
+    extension_length = struct.unpack_from('>i', data, len(_COPY_SIGNATURE) + 4)[0]
+    offset = len(_COPY_SIGNATURE) + 8 + extension_length
+    # В конце - маркер -1 (2 байта)
+    rows = np.frombuffer(data, dtype=_COPY_ROW, count=(len(data) - offset - 2) // _COPY_ROW.itemsize,
+                         offset=offset)
+    return rows['x'].astype(np.float64), rows['y'].astype(np.float64)
+
+
+def _bucket_view(values, buckets, fill):
+    """Массив, разбитый на buckets равных корзин: (buckets, size), хвост дополнен fill"""
+    size = -(-len(values) // buckets)
+    padded = np.full(buckets * size, fill, dtype=np.float64)
+    padded[:len(values)] = values
+    return padded.reshape(buckets, size), size
+
+
+def lttb_indices(x, y, points):
+    """Индексы точек по алгоритму Largest-Triangle-Three-Buckets"""
+    n = len(x)
+    if points >= n:
+        return np.arange(n)
+    if points < 3:
+        # Корзин между крайними точками нет: первая и последняя (или одна первая)
+        return np.array([0, n - 1][:points], dtype=np.int64)
+    # Границы корзин без первой и последней точки
+    edges = (np.arange(points - 1) * ((n - 2) / (points - 2))).astype(np.int64) + 1
+    edges[-1] = n - 1
+    # Средние точки корзин считаются заранее, векторно
+    counts = np.diff(edges)
+    avg_x = np.add.reduceat(x[:-1], edges[:-1]) / counts
+    avg_y = np.add.reduceat(y[:-1], edges[:-1]) / counts
+    avg_x = np.append(avg_x[1:], x[-1])
+    avg_y = np.append(avg_y[1:], y[-1])
+
+    selected = np.empty(points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(points - 2):
+        lo, hi = edges[i], edges[i + 1]
+        bx, by = x[lo:hi], y[lo:hi]
+        area = np.abs((x[a] - avg_x[i]) * (by - y[a]) - (x[a] - bx) * (avg_y[i] - y[a]))
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def minmax_indices(y, points):
+    """Индексы минимума и максимума в каждой из points / 2 корзин"""
+    n = len(y)
+    if points >= n:
+        return np.arange(n)
+    buckets = max(points // 2, 1)
+    low, size = _bucket_view(y, buckets, np.inf)
+    high, _ = _bucket_view(y, buckets, -np.inf)
+    offsets = np.arange(buckets) * size
+    indices = np.concatenate([offsets + low.argmin(axis=1), offsets + high.argmax(axis=1)])
+    return np.unique(indices[indices < n])
+
+
+def average(x, y, points):
+    """Среднее по каждой из points корзин: (x, y)"""
+    n = len(y)
+    if points >= n:
+        return x, y
+    xs, _ = _bucket_view(x, points, np.nan)
+    ys, _ = _bucket_view(y, points, np.nan)
+    valid = ~np.isnan(xs[:, 0])
+    return np.nanmean(xs[valid], axis=1), np.nanmean(ys[valid], axis=1)
+
+
+def spike_indices(y, points, min_value=None, max_value=None):
+    """Индексы выходов за уставки, не более одного (самого сильного) на корзину"""
+    deviation = np.full(len(y), -np.inf)
+    if max_value is not None:
+        deviation = np.maximum(deviation, np.where(y > max_value, y - max_value, -np.inf))
+    if min_value is not None:
+        deviation = np.maximum(deviation, np.where(y < min_value, min_value - y, -np.inf))
+    if not np.isfinite(deviation).any():
+        return np.empty(0, dtype=np.int64)
+    buckets = min(points, len(y))
+    grouped, size = _bucket_view(deviation, buckets, -np.inf)
+    strongest = grouped.argmax(axis=1)
+    keep = np.isfinite(grouped[np.arange(buckets), strongest])
+    return np.arange(buckets)[keep] * size + strongest[keep]
+
+
+def downsample(x, y, points, method=METHOD_LTTB, min_value=None, max_value=None):
+    """Прореживание ряда до ~points точек с сохранением выходов за уставки
+
+    Точки, нарушающие min_value / max_value, всегда попадают в результат
+    (по одной на корзину), даже если сам метод их бы отбросил.
+    """
+    if len(x) <= points:
+        return x, y
+    spikes = spike_indices(y, points, min_value, max_value)
+    if method == METHOD_AVG:
+        out_x, out_y = average(x, y, points)
+        if len(spikes):
+            out_x = np.concatenate([out_x, x[spikes]])
+            out_y = np.concatenate([out_y, y[spikes]])
+            order = np.argsort(out_x, kind='stable')
+            out_x, out_y = out_x[order], out_y[order]
+        return out_x, out_y
+
+    if method == METHOD_MINMAX:
+        indices = minmax_indices(y, points)
+    else:
+        indices = lttb_indices(x, y, points)
+    if len(spikes):
+        indices = np.union1d(indices, spikes)
+    return x[indices], y[indices]
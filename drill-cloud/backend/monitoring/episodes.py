@@ -0,0 +1,300 @@
+import logging
+import threading
+import time
+from datetime import timedelta
+import numpy as np
+from django.conf import settings
+from .models import Incident
+from .thresholds import threshold_cache
+
+logger = logging.getLogger(__name__)
+
+EVENT_OPEN = 'open'
+EVENT_UPDATE = 'update'
+EVENT_CLOSE = 'close'
+
+THRESHOLD_VIOLATIONS = ('min_violation', 'max_violation')
+
+
+def episode_key(tag, violation_type):
+    """Ключ эпизода: по уставке у тега один эпизод, по правилу - свой на каждое"""
+    if violation_type in THRESHOLD_VIOLATIONS:
+        return tag
+    return tag, violation_type
+
+
+class Episode:
+    """Состояние открытого инцидента в памяти"""
+
+    def __init__(self, incident):
+        self.incident = incident
+        self.key = episode_key(incident.tag, incident.violation_type)
+        self.cleared_at = None
+        # Время последнего значения тега (любого, не только нарушения)
+        self.sample_at = incident.last_seen or incident.timestamp
+        # Прием последнего значения и последняя сводка по часам процесса
+        # (time.monotonic): повтор журнала и расхождение часов устройства
+        # не влияют на закрытие без новых значений и частоту сводок
+        self.seen = self.summarized = time.monotonic()
+        self.dirty = False
+
+    def touch(self, timestamp):
+        """Отмечает прием значения тега"""
+        self.sample_at = max(self.sample_at, timestamp)
+        self.seen = time.monotonic()
+
+
+class IncidentEpisodeEngine:
+    """Движок эпизодов нарушений уставок
+
+    Первое нарушение открывает эпизод (одна запись Incident со статусом
+    open), дальнейшие нарушения того же типа только обновляют пик, счетчик
+    и время последнего нарушения в памяти. Эпизод закрывается, когда
+    значение вернулось внутрь уставки с учетом гистерезиса и продержалось
+    там INCIDENT_CLEAR_SECONDS. Если значения тега перестали поступать
+    (датчик отключен, воркер перезапущен), эпизод закрывается через
+    INCIDENT_STALE_SECONDS после приема последнего значения. В БД и channel
+    layer попадают только открытие, закрытие и сводка раз в
+    INCIDENT_SUMMARY_INTERVAL секунд.
+
+    Эпизоды тега должен вести один воркер: в режиме share (общая
+    подписка) start_mqtt с эпизодами не запускается.
+
+    Значения проверяет поток записи ingest, а sweep() вызывается по
+    таймеру из другого потока, поэтому состояние меняется под блокировкой.
+    """
+
+    def __init__(self, clear_seconds=None, hysteresis_percent=None, summary_interval=None,
+                 stale_seconds=None):
+        if clear_seconds is None:
+            clear_seconds = settings.INCIDENT_CLEAR_SECONDS
+        if hysteresis_percent is None:
+            hysteresis_percent = settings.INCIDENT_HYSTERESIS_PERCENT
+        if summary_interval is None:
+            summary_interval = settings.INCIDENT_SUMMARY_INTERVAL
+        if stale_seconds is None:
+            stale_seconds = settings.INCIDENT_STALE_SECONDS
+        self.clear_time = timedelta(seconds=clear_seconds)
+        self.hysteresis = hysteresis_percent / 100
+        self.summary_interval = summary_interval
+        self.stale_seconds = stale_seconds
+        self.episodes = {}
+        self._lock = threading.RLock()
+
+    def load_open(self, owns_tag=None):
+        """Восстанавливает открытые эпизоды из БД после перезапуска
+
+        owns_tag(tag) - только теги этого воркера: эпизоды остальных тегов
+        ведут другие воркеры.
+        """
+        episodes = {}
+        for incident in Incident.objects.filter(status=Incident.STATUS_OPEN):
+            if owns_tag is not None and not owns_tag(incident.tag):
+                continue
+            episode = Episode(incident)
+            episodes[episode.key] = episode
+        with self._lock:
+            self.episodes = episodes
+        if self.episodes:
+            logger.info(f"Восстановлено открытых инцидентов: {len(self.episodes)}")
+
+    def process(self, sensor_data):
+        """Проверка значения: список событий [(event, incident)]"""
+        try:
+            with self._lock:
+                return self._process(sensor_data)
+        except Exception as e:
+            logger.error(f"Ошибка проверки уставок: {e}")
+            return []
+
+    def _process(self, sensor_data):
+        tag = sensor_data.tag
+        episode = self.episodes.get(tag)
+        threshold = threshold_cache.get(tag)
+        if threshold is None:
+            # Уставку удалили - открытый эпизод больше нечем закрыть по значению
+            return [self._close(episode, sensor_data.timestamp)] if episode else []
+
+        is_violated, violation_type = threshold.is_violated(sensor_data.value)
+        events = []
+        if episode is not None:
+            episode.touch(sensor_data.timestamp)
+            if is_violated and violation_type == episode.incident.violation_type:
+                self._update(episode, sensor_data)
+                return self._summary(episode)
+            if is_violated:
+                # Нарушение сменилось на противоположное
+                events.append(self._close(episode, sensor_data.timestamp))
+            elif self._cleared(episode.incident, threshold, sensor_data.value):
+                if episode.cleared_at is None:
+                    episode.cleared_at = sensor_data.timestamp
+                if sensor_data.timestamp - episode.cleared_at >= self.clear_time:
+                    return [self._close(episode, sensor_data.timestamp)]
+                return []
+            else:
+                # Внутри полосы гистерезиса - эпизод продолжается
+                episode.cleared_at = None
+                return []
+
+        if is_violated:
+            events.append(self._open(sensor_data, violation_type, threshold))
+        return events
+
+    def process_rule(self, rule, samples, violated):
+        """События эпизода правила по результату проверки пачки
+
+        samples - значения тега из пачки, violated - булев массив нарушений.
+        """
+        with self._lock:
+            return self._process_rule(rule, samples, violated)
+
+    def _process_rule(self, rule, samples, violated):
+        key = episode_key(rule.tag, rule.rule_type)
+        episode = self.episodes.get(key)
+        if episode is None and not violated.any():
+            return []
+        hits = np.flatnonzero(violated)
+        events = []
+        if len(hits):
+            if episode is None:
+                first = samples[hits[0]]
+                events.append(self._open(first, rule.rule_type))
+                episode = self.episodes[key]
+                hits = hits[1:]
+            if len(hits):
+                self._update_rule(episode, [samples[i] for i in hits])
+            last_hit = np.flatnonzero(violated)[-1]
+            # Значения после последнего нарушения уже в норме
+            episode.cleared_at = (
+                samples[last_hit + 1].timestamp if last_hit + 1 < len(samples) else None
+            )
+        elif episode is None:
+            return events
+        elif episode.cleared_at is None:
+            episode.cleared_at = samples[0].timestamp
+
+        now = samples[-1].timestamp
+        episode.touch(now)
+        if episode.cleared_at is not None and now - episode.cleared_at >= self.clear_time:
+            events.append(self._close(episode, now))
+        else:
+            events.extend(self._summary(episode))
+        return events
+
+    def sweep(self, now=None):
+        """Закрывает эпизоды, по которым значения вернулись в норму или
+        перестали поступать, и отправляет просроченные сводки
+
+        Вызывается по таймеру. Время без значений считается по часам
+        процесса (now - time.monotonic()) от приема последнего значения,
+        а не по времени устройства.
+        """
+        now = time.monotonic() if now is None else now
+        clear_seconds = self.clear_time.total_seconds()
+        events = []
+        with self._lock:
+            for episode in list(self.episodes.values()):
+                idle = now - episode.seen
+                if episode.cleared_at is not None and idle >= clear_seconds:
+                    # Последнее значение было в норме, новых нет
+                    events.append(self._close(episode, episode.cleared_at))
+                elif self.stale_seconds and idle >= self.stale_seconds:
+                    logger.warning(
+                        f"Нет значений {episode.incident.tag} с {episode.sample_at}, инцидент закрывается"
+                    )
+                    events.append(self._close(episode, episode.sample_at))
+                else:
+                    events.extend(self._summary(episode, now))
+        return events
+
+    def flush(self):
+        """Сохраняет несохраненные счетчики открытых эпизодов (при остановке)"""
+        with self._lock:
+            for episode in self.episodes.values():
+                if episode.dirty:
+                    try:
+                        self._save(episode)
+                    except Exception as e:
+                        logger.error(f"Ошибка сохранения инцидента {episode.incident.tag}: {e}")
+
+    def _cleared(self, incident, threshold, value):
+        """Значение вернулось внутрь уставки с запасом гистерезиса"""
+        value = float(value)
+        if incident.violation_type == 'max_violation':
+            if threshold.max_value is None:
+                return True
+            limit = float(threshold.max_value)
+            return value <= limit - abs(limit) * self.hysteresis
+        if threshold.min_value is None:
+            return True
+        limit = float(threshold.min_value)
+        return value >= limit + abs(limit) * self.hysteresis
+
+    def _open(self, sensor_data, violation_type, threshold=None):
+        incident = Incident.objects.create(
+            tag=sensor_data.tag,
+            value=sensor_data.value,
+            peak_value=sensor_data.value,
+            threshold_min=threshold.min_value if threshold else None,
+            threshold_max=threshold.max_value if threshold else None,
+            violation_type=violation_type,
+            timestamp=sensor_data.timestamp,
+            last_seen=sensor_data.timestamp,
+            sample_count=1,
+            status=Incident.STATUS_OPEN
+        )
+        episode = Episode(incident)
+        self.episodes[episode.key] = episode
+        logger.warning(f"Открыт инцидент: {incident}")
+        return EVENT_OPEN, incident
+
+    def _update(self, episode, sensor_data):
+        incident = episode.incident
+        value = sensor_data.value
+        if incident.violation_type == 'max_violation':
+            incident.peak_value = max(incident.peak_value, value)
+        else:
+            incident.peak_value = min(incident.peak_value, value)
+        incident.sample_count += 1
+        incident.last_seen = max(incident.last_seen, sensor_data.timestamp)
+        episode.cleared_at = None
+        episode.dirty = True
+
+    def _update_rule(self, episode, samples):
+        incident = episode.incident
+        # Пик по правилу - самое далекое от нуля значение
+        incident.peak_value = max([incident.peak_value] + [s.value for s in samples], key=abs)
+        incident.sample_count += len(samples)
+        incident.last_seen = max(incident.last_seen, samples[-1].timestamp)
+        episode.dirty = True
+
+    def _summary(self, episode, now=None):
+        now = time.monotonic() if now is None else now
+        if not episode.dirty or now - episode.summarized < self.summary_interval:
+            return []
+        self._save(episode)
+        episode.summarized = now
+        return [(EVENT_UPDATE, episode.incident)]
+
+    def _close(self, episode, now):
+        incident = episode.incident
+        incident.status = Incident.STATUS_CLOSED
+        # Время возврата в норму, если эпизод закрыт по нему
+        incident.ended_at = episode.cleared_at or now
+        self._save(episode)
+        del self.episodes[episode.key]
+        logger.warning(
+            f"Закрыт инцидент: {incident.tag} {incident.violation_type}, "
+            f"пик {incident.peak_value}, нарушений {incident.sample_count}"
+        )
+        return EVENT_CLOSE, incident
+
+    def _save(self, episode):
+        episode.incident.save(update_fields=[
+            'peak_value', 'sample_count', 'last_seen', 'status', 'ended_at'
+        ])
+        episode.dirty = False
+
+
+# Глобальный движок эпизодов процесса ingest
+incident_engine = IncidentEpisodeEngine()
@@ -0,0 +1,233 @@
+import asyncio
+import csv
+import io
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from .models import SensorData
+
+try:
+    import pyarrow
+    import pyarrow.parquet as parquet
+except ImportError:
+    pyarrow = None
+
+FORMATS = ('csv', 'parquet')
+
+# Строк в группе строк Parquet (столько строк держится в памяти)
+PARQUET_ROW_GROUP_SIZE = 100000
+
+CSV_HEADER = ('timestamp', 'tag', 'value')
+
+# Одновременные выгрузки через API в процессе
+export_slots = threading.BoundedSemaphore(settings.EXPORT_MAX_CONCURRENT)
+
+
+class ExportThrottle:
+    """Ограничение скорости чтения: не больше rows_per_second строк в секунду
+
+    Выгрузка читает sensor_data по индексу (tag, timestamp) и без
+    ограничения отнимает у записи ingest диск и CPU Postgres. 0 - без
+    ограничения.
+    """
+
+    def __init__(self, rows_per_second):
+        self.rows_per_second = rows_per_second
+        self.rows = 0
+        self.started = time.monotonic()
+
+    def wait(self, rows):
+        self.rows += rows
+        if not self.rows_per_second:
+            return
+        delay = self.started + self.rows / self.rows_per_second - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def export_rows(tags, start, end, chunk_size=None, throttle=None):
+    """Строки (tag, timestamp, value) пачками по chunk_size: по тегам, по времени
+
+    Каждая пачка - отдельный короткий запрос по индексу (tag, timestamp)
+    с продолжением после ключа (timestamp, id) предыдущей пачки. Между
+    запросами транзакция не открыта, поэтому медленный клиент и пауза
+    ExportThrottle не держат соединение в состоянии "idle in transaction"
+    и не удерживают снимок, а память не зависит от объема выгрузки.
+    """
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    for tag in tags:
+        rows = SensorData.objects.filter(tag=tag, timestamp__gte=start, timestamp__lt=end)
+        after = None
+        while True:
+            page = rows
+            if after is not None:
+                page = rows.filter(Q(timestamp__gt=after[0]) | Q(timestamp=after[0], id__gt=after[1]))
+            chunk = list(
+                page.order_by('timestamp', 'id').values_list('tag', 'timestamp', 'value', 'id')[:chunk_size]
+            )
+            if not chunk:
+                break
+            after = chunk[-1][1], chunk[-1][3]
+            yield [row[:3] for row in chunk]
+            if throttle is not None:
+                throttle.wait(len(chunk))
+            if len(chunk) < chunk_size:
+                break
+
+
+def csv_chunks(chunks):
+    """CSV timestamp,tag,value: одна порция байт на пачку строк"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(CSV_HEADER)
+    for chunk in chunks:
+        writer.writerows((timestamp.isoformat(), tag, value) for tag, timestamp, value in chunk)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def gzip_chunks(chunks, level=6):
+    """Сжатие потока в формат gzip без буферизации всего файла"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class _ParquetSink:
+    """Файл для ParquetWriter: записанное забирается после каждой группы строк"""
+
+    def __init__(self):
+        self.closed = False
+        self._parts = []
+        self._position = 0
+
+    def write(self, data):
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+def parquet_chunks(chunks, compression='snappy'):
+    """Parquet: группа строк на PARQUET_ROW_GROUP_SIZE строк"""
+    schema = pyarrow.schema([
+        ('timestamp', pyarrow.timestamp('us', tz='UTC')),
+        ('tag', pyarrow.string()),
+        ('value', pyarrow.float64()),
+    ])
+    sink = _ParquetSink()
+    writer = parquet.ParquetWriter(pyarrow.PythonFile(sink, mode='w'), schema, compression=compression)
+
+    def write(rows):
+        writer.write_table(pyarrow.Table.from_pydict({
+            'timestamp': [row[1] for row in rows],
+            'tag': [row[0] for row in rows],
+            'value': [float(row[2]) for row in rows],
+        }, schema=schema))
+
+    rows = []
+    for chunk in chunks:
+        rows.extend(chunk)
+        if len(rows) >= PARQUET_ROW_GROUP_SIZE:
+            write(rows)
+            rows = []
+            yield sink.take()
+    if rows:
+        write(rows)
+    writer.close()
+    yield sink.take()
+
+
+def export_stream(tags, start, end, file_format='csv', compress=False, rows_per_second=None):
+    """Выгрузка sensor_data потоком байт
+
+    compress для CSV - gzip всего файла, для Parquet - сжатие gzip страниц
+    внутри файла (вместо snappy).
+    """
+    if rows_per_second is None:
+        rows_per_second = settings.EXPORT_ROWS_PER_SECOND
+    chunks = export_rows(tags, start, end, throttle=ExportThrottle(rows_per_second))
+    if file_format == 'parquet':
+        return parquet_chunks(chunks, compression='gzip' if compress else 'snappy')
+    content = csv_chunks(chunks)
+    return gzip_chunks(content) if compress else content
+
+
+def export_filename(start, end, file_format, compress):
+    name = f'sensor_data_{start:%Y%m%dT%H%M%S}_{end:%Y%m%dT%H%M%S}.{file_format}'
+    return name + '.gz' if compress and file_format == 'csv' else name
+
+
+class SlotStream:
+    """Поток выгрузки API, занимающий слот export_slots до закрытия"""
+
+    def __init__(self, content):
+        self._content = content
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._content)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._content.close()
+        finally:
+            export_slots.release()
+
+
+def _close_connection():
+    # connection - прокси к соединению текущего потока, поэтому
+    # закрывать его нужно в потоке выгрузки
+    connection.close()
+
+
+async def iterate_in_thread(stream):
+    """Асинхронный итератор для ASGI поверх синхронного потока
+
+    Django 4.2 под ASGI читает синхронный StreamingHttpResponse целиком в
+    память. Здесь каждая порция читается в отдельном потоке выгрузки: в нем
+    же живет соединение, и там же оно возвращается в пул.
+    """
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='export')
+    done = object()
+    try:
+        while True:
+            chunk = await loop.run_in_executor(executor, next, stream, done)
+            if chunk is done:
+                break
+            yield chunk
+    finally:
+        await loop.run_in_executor(executor, stream.close)
+        await loop.run_in_executor(executor, _close_connection)
+        executor.shutdown(wait=False)
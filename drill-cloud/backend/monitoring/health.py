@@ -0,0 +1,35 @@
+import logging
+import time
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+INGEST_HEALTH_KEY_PREFIX = 'monitoring:ingest:health:'
+
+
+def report_worker_health(worker_id, status):
+    """Публикует состояние воркера ingest в общий кеш
+
+    Запись живет три интервала отчета, так что пропавший воркер исчезает
+    из сводки сам.
+    """
+    status = dict(status, worker_id=worker_id, updated_at=time.time())
+    try:
+        cache.set(
+            INGEST_HEALTH_KEY_PREFIX + worker_id,
+            status,
+            timeout=settings.INGEST_HEALTH_INTERVAL * 3
+        )
+    except Exception as e:
+        logger.error(f"Ошибка публикации состояния воркера {worker_id}: {e}")
+
+
+def get_workers_health(worker_ids):
+    """Последнее состояние воркеров: worker_id -> dict или None"""
+    try:
+        found = cache.get_many([INGEST_HEALTH_KEY_PREFIX + w for w in worker_ids])
+    except Exception as e:
+        logger.error(f"Ошибка чтения состояния воркеров: {e}")
+        found = {}
+    return {w: found.get(INGEST_HEALTH_KEY_PREFIX + w) for w in worker_ids}
@@ -0,0 +1,193 @@
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from django.conf import settings
+from django.db import close_old_connections, connection
+from .models import SensorData
+from .spool import SpoolForwarder
+from .ingest_log import ingest_log
+from .metrics import (
+    BATCH_SIZE, DB_INSERT_SECONDS, DB_INSERT_ERRORS, SAMPLES_DROPPED, SAMPLES_WRITTEN
+)
+
+logger = logging.getLogger(__name__)
+
+# Как часто простаивающий поток записи проверяет флаг остановки (сек)
+IDLE_POLL_INTERVAL = 0.5
+
+
+class SensorDataWriter:
+    """Пакетная запись данных сенсоров в БД через ограниченную очередь
+
+    MQTT callback только кладет несохраненные объекты SensorData в очередь,
+    а отдельный поток собирает их в пачки и пишет через bulk_create, когда
+    набирается INGEST_BATCH_SIZE записей или проходит INGEST_LINGER_MS.
+
+    С журналом spool (monitoring/spool.py) пачка сначала добавляется в
+    локальный журнал, а в БД ее пишет поток пересылки: сбой или задержка
+    Postgres не останавливают прием и не теряют данные.
+    """
+
+    def __init__(self, on_flush=None, batch_size=None, linger_ms=None,
+                 queue_size=None, put_timeout=None, spool=None):
+        self.on_flush = on_flush
+        self.batch_size = batch_size or settings.INGEST_BATCH_SIZE
+        if linger_ms is None:
+            linger_ms = settings.INGEST_LINGER_MS
+        self.linger = linger_ms / 1000
+        if put_timeout is None:
+            put_timeout = settings.INGEST_PUT_TIMEOUT
+        self.put_timeout = put_timeout
+        self.queue = queue.Queue(maxsize=queue_size or settings.INGEST_QUEUE_SIZE)
+        self.written = 0
+        self.dropped = 0
+        self._stopping = threading.Event()
+        self._thread = None
+        self.spool = spool
+        self.forwarder = None
+        if spool is not None:
+            self.forwarder = SpoolForwarder(
+                spool, self._write, self._process, batch_size=self.batch_size
+            )
+
+    def start(self):
+        """Запуск потока записи"""
+        if self._thread is not None:
+            return
+        if self.forwarder is not None:
+            self.forwarder.start()
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target=self._run, name='sensor-data-writer', daemon=True
+        )
+        self._thread.start()
+
+    def put(self, sensor_data):
+        """Ставит запись в очередь на сохранение
+
+        Если очередь заполнена, вызывающий поток ждет до INGEST_PUT_TIMEOUT
+        секунд (обратное давление на MQTT цикл), после чего запись
+        отбрасывается. Возвращает True, если запись принята.
+        """
+        try:
+            self.queue.put(sensor_data, timeout=self.put_timeout)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            ingest_log.warning(
+                'queue_full', 'Очередь записи переполнена, отброшена запись %s (всего отброшено: %d)',
+                sensor_data.tag, self.dropped
+            )
+            return False
+
+    def put_many(self, samples):
+        """Ставит в очередь значения одного сообщения
+
+        Если очередь так и не освободилась, остаток сообщения отбрасывается
+        без ожидания на каждом значении. Возвращает число принятых.
+        """
+        for accepted, sensor_data in enumerate(samples):
+            if not self.put(sensor_data):
+                self.dropped += len(samples) - accepted - 1
+                return accepted
+        return len(samples)
+
+    def stop(self, timeout=None):
+        """Остановка потока записи с дозаписью оставшейся очереди"""
+        if self._thread is None:
+            return
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        self._stopping.set()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.error(
+                f"Поток записи не завершился, в очереди осталось {self.queue.qsize()} записей"
+            )
+        self._thread = None
+        if self.forwarder is not None:
+            self.forwarder.stop(
+                max(deadline - time.monotonic(), 0) if deadline is not None else None
+            )
+
+    def _run(self):
+        try:
+            while not (self._stopping.is_set() and self.queue.empty()):
+                batch = self._collect_batch()
+                if batch:
+                    self._flush(batch)
+        finally:
+            connection.close()
+
+    def _collect_batch(self):
+        """Собирает пачку до batch_size записей или до истечения linger"""
+        batch = []
+        try:
+            if self._stopping.is_set():
+                batch.append(self.queue.get_nowait())
+            else:
+                batch.append(self.queue.get(timeout=IDLE_POLL_INTERVAL))
+        except queue.Empty:
+            return batch
+
+        deadline = time.monotonic() + self.linger
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0 and not self._stopping.is_set():
+                    batch.append(self.queue.get(timeout=remaining))
+                else:
+                    # Время ожидания вышло - забираем только то, что уже в очереди
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, batch):
+        """Записывает пачку в БД (или журнал) и передает ее дальнейшей обработке"""
+        if self.spool is not None:
+            self._spool(batch)
+            return
+        try:
+            self._write(batch)
+        except Exception as e:
+            logger.error(f"Ошибка пакетной записи {len(batch)} записей: {e}")
+            self.dropped += len(batch)
+            SAMPLES_DROPPED.labels('db_error').inc(len(batch))
+            close_old_connections()
+            return
+        self._process(batch)
+
+    def _spool(self, batch):
+        try:
+            ids = self.spool.append(batch)
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка записи {len(batch)} записей в журнал ingest: {e}")
+            ids = None
+        if ids is None:
+            self.dropped += len(batch)
+            SAMPLES_DROPPED.labels('spool_full').inc(len(batch))
+            return
+        self.forwarder.submit(*ids, batch)
+
+    def _write(self, batch):
+        # Как в начале запроса Django: оборванное или устаревшее соединение
+        # закрывается (с пулом - возвращается в пул) и открывается заново
+        close_old_connections()
+        try:
+            with DB_INSERT_SECONDS.time():
+                SensorData.objects.bulk_create(batch, batch_size=self.batch_size)
+        except Exception:
+            DB_INSERT_ERRORS.inc()
+            raise
+        self.written += len(batch)
+        BATCH_SIZE.observe(len(batch))
+        SAMPLES_WRITTEN.inc(len(batch))
+
+    def _process(self, batch):
+        if self.on_flush:
+            try:
+                self.on_flush(batch)
+            except Exception as e:
+                logger.error(f"Ошибка обработки записанной пачки: {e}")
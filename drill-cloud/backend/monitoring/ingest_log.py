@@ -0,0 +1,138 @@
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Атрибуты LogRecord; все остальное - поля, переданные через extra
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна строка JSON на запись: время, уровень, логгер, текст и поля extra"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, dt_timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class IngestLog:
+    """Журнал горячего пути ingest
+
+    Сообщения и рассылки пишутся на уровне DEBUG и только каждое
+    sample_rate-е по тегу (0 - не пишутся); аргументы форматируются, только
+    если запись действительно выводится. Повторяющиеся ошибки одного вида
+    (битый JSON, нет значения, переполнение очереди) выводятся не чаще раза
+    в error_interval секунд с числом подавленных повторов. Общая картина -
+    сводка раз в summary_interval секунд.
+
+    Счетчики выборки не защищены блокировкой: гонка между потоками
+    влияет только на то, какое из сообщений попадет в журнал.
+    """
+
+    def __init__(self, sample_rate=None, error_interval=None, summary_interval=None, log=None):
+        self.sample_rate = settings.INGEST_LOG_SAMPLE_RATE if sample_rate is None else sample_rate
+        if error_interval is None:
+            error_interval = settings.INGEST_LOG_ERROR_INTERVAL
+        if summary_interval is None:
+            summary_interval = settings.INGEST_LOG_SUMMARY_INTERVAL
+        self.error_interval = error_interval
+        self.summary_interval = summary_interval
+        self.log = log or logger
+        self._messages = {}
+        self._broadcasts = {}
+        # kind -> [время последнего вывода, подавлено с тех пор, всего]
+        self._errors = {}
+        self._lock = threading.Lock()
+        self._summary_at = time.monotonic()
+        self._last_counters = {}
+        self._last_errors = {}
+
+    def _sampled(self, seen, tag):
+        count = seen.get(tag, 0)
+        seen[tag] = count + 1
+        return count % self.sample_rate == 0
+
+    def message(self, topic, tag, payload):
+        """Принятое сообщение (DEBUG, выборочно по тегу)"""
+        if not self.sample_rate or not self.log.isEnabledFor(logging.DEBUG):
+            return
+        if self._sampled(self._messages, tag):
+            self.log.debug(
+                'Сообщение %s из %s: %s', tag, topic, payload,
+                extra={'event': 'message', 'tag': tag, 'topic': topic}
+            )
+
+    def broadcast(self, tag):
+        """Отправленное WebSocket обновление (DEBUG, выборочно по тегу)"""
+        if not self.sample_rate or not self.log.isEnabledFor(logging.DEBUG):
+            return
+        if self._sampled(self._broadcasts, tag):
+            self.log.debug(
+                'Отправлено WebSocket обновление для %s', tag,
+                extra={'event': 'broadcast', 'tag': tag}
+            )
+
+    def error(self, kind, msg, *args, level=logging.ERROR):
+        """Ошибка вида kind с ограничением частоты вывода"""
+        now = time.monotonic()
+        with self._lock:
+            state = self._errors.setdefault(kind, [None, 0, 0])
+            state[2] += 1
+            if state[0] is not None and now - state[0] < self.error_interval:
+                state[1] += 1
+                return
+            suppressed = state[1]
+            state[0], state[1] = now, 0
+        if suppressed:
+            msg += ' (подавлено повторов: %d)'
+            args += (suppressed,)
+        self.log.log(level, msg, *args, extra={'event': 'error', 'kind': kind, 'suppressed': suppressed})
+
+    def warning(self, kind, msg, *args):
+        self.error(kind, msg, *args, level=logging.WARNING)
+
+    def summary(self, counters, force=False, **fields):
+        """Сводка раз в summary_interval: приращения counters за период,
+        ошибки по видам и текущие значения fields"""
+        now = time.monotonic()
+        elapsed = now - self._summary_at
+        if not force and elapsed < self.summary_interval:
+            return
+        with self._lock:
+            errors = {kind: state[2] for kind, state in self._errors.items()}
+        deltas = {name: value - self._last_counters.get(name, 0) for name, value in counters.items()}
+        new_errors = {
+            kind: count - self._last_errors.get(kind, 0)
+            for kind, count in errors.items() if count > self._last_errors.get(kind, 0)
+        }
+        self._summary_at = now
+        self._last_counters = dict(counters)
+        self._last_errors = errors
+        rate = deltas.get('received', 0) / elapsed if elapsed > 0 else 0.0
+        self.log.info(
+            'Ingest за %.0f с: %s, %.0f сообщ./с, ошибки: %s', elapsed,
+            ' '.join(f'{name}={value}' for name, value in deltas.items()), rate,
+            ' '.join(f'{kind}={count}' for kind, count in new_errors.items()) or 'нет',
+            extra={
+                'event': 'summary', 'interval': round(elapsed, 1), 'rate': round(rate, 1),
+                **deltas, 'errors': new_errors, **fields
+            }
+        )
+
+
+# Журнал ingest процесса
+ingest_log = IngestLog()
@@ -0,0 +1,142 @@
+import asyncio
+import json
+import logging
+import weakref
+import redis
+import redis.asyncio as aioredis
+from channels.db import database_sync_to_async
+from datetime import datetime, timezone as dt_timezone
+from django.conf import settings
+from .broadcast import sensor_update_message
+from .models import SensorTag
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+# Hash Redis: tag -> JSON последней точки (как data в sensor_update)
+LATEST_VALUES_KEY = 'sensor_latest'
+# Hash Redis: tag -> время последней точки в микросекундах от эпохи
+LATEST_TIMESTAMPS_KEY = 'sensor_latest_ts'
+
+# Значение тега заменяется, только если точка не старше сохраненной:
+# повтор журнала ingest и запоздавшие сообщения не затирают новые значения.
+# ARGV - тройки tag, время (мкс), JSON
+_UPDATE_LATEST_LUA = """
+local updated = 0
+for i = 1, #ARGV, 3 do
+    local current = redis.call('HGET', KEYS[2], ARGV[i])
+    if not current or tonumber(current) <= tonumber(ARGV[i + 1]) then
+        redis.call('HSET', KEYS[2], ARGV[i], ARGV[i + 1])
+        redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 2])
+        updated = updated + 1
+    end
+end
+return updated
+"""
+
+_client = None
+_update_script = None
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_redis():
+    """Синхронный клиент Redis для последних значений"""
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.CACHE_REDIS_URL)
+    return _client
+
+
+def get_async_redis():
+    """Асинхронный клиент Redis для текущего event loop"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = aioredis.Redis.from_url(settings.CACHE_REDIS_URL)
+    return client
+
+
+def epoch_us(timestamp):
+    """Время в микросекундах Unix epoch (точно, без float)"""
+    delta = timestamp - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def update_latest(batch):
+    """Сохраняет последнюю точку каждого тега пачки одним вызовом скрипта Lua"""
+    global _update_script
+    latest = {}
+    for sensor_data in batch:
+        current = latest.get(sensor_data.tag)
+        if current is None or sensor_data.timestamp >= current.timestamp:
+            latest[sensor_data.tag] = sensor_data
+    if not latest:
+        return
+    args = []
+    for tag, sensor_data in latest.items():
+        args += [
+            tag, epoch_us(sensor_data.timestamp),
+            json.dumps(sensor_update_message(sensor_data)['data'])
+        ]
+    try:
+        if _update_script is None:
+            _update_script = get_redis().register_script(_UPDATE_LATEST_LUA)
+        _update_script(keys=[LATEST_VALUES_KEY, LATEST_TIMESTAMPS_KEY], args=args)
+    except redis.RedisError as e:
+        logger.error(f"Ошибка обновления последних значений: {e}")
+
+
+def _decode(tags, values):
+    return {
+        tag: json.loads(value) if value is not None else None
+        for tag, value in zip(tags, values)
+    }
+
+
+def get_latest(tags=None):
+    """Последние значения тегов (все, если tags не указаны): tag -> data или None
+
+    Если Redis недоступен, значения берутся из каталога sensor_tags.
+    """
+    try:
+        client = get_redis()
+        if tags:
+            return _decode(tags, client.hmget(LATEST_VALUES_KEY, tags))
+        values = client.hgetall(LATEST_VALUES_KEY)
+        return _decode([tag.decode() for tag in values], values.values())
+    except redis.RedisError as e:
+        logger.error(f"Ошибка чтения последних значений: {e}")
+        return get_latest_from_catalog(tags)
+
+
+def get_latest_from_catalog(tags=None):
+    """Последние значения из каталога sensor_tags в формате кеша"""
+    catalog = SensorTag.objects.all()
+    if tags:
+        catalog = catalog.filter(tag__in=tags)
+    latest = {
+        entry.tag: {
+            'timestamp': entry.last_seen.isoformat(),
+            'value': entry.last_value,
+            'tag': entry.tag
+        }
+        for entry in catalog
+    }
+    if tags:
+        return {tag: latest.get(tag) for tag in tags}
+    return latest
+
+
+async def aget_latest(tag):
+    """Последнее значение тега без обращения к БД и пулу потоков
+
+    Если Redis недоступен, значение берется из каталога sensor_tags.
+    """
+    try:
+        value = await get_async_redis().hget(LATEST_VALUES_KEY, tag)
+    except redis.RedisError as e:
+        logger.error(f"Ошибка чтения последних значений: {e}")
+        latest = await database_sync_to_async(get_latest_from_catalog)([tag])
+        return latest[tag]
+    return json.loads(value) if value is not None else None
@@ -0,0 +1,52 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from monitoring.retention import RetentionManager
+
+
+class Command(BaseCommand):
+    help = 'Удаление устаревших данных по срокам хранения (RETENTION_*)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Только подсчитать, ничего не удалять')
+        parser.add_argument('--batch-size', type=int, help='Строк за транзакцию (RETENTION_BATCH_SIZE)')
+        parser.add_argument('--vacuum', action='store_true', help='VACUUM ANALYZE таблиц после удаления')
+        parser.add_argument(
+            '--interval', type=int, default=0,
+            help='Повторять каждые N секунд (0 - выполнить один раз)'
+        )
+
+    def handle(self, *args, **options):
+        if not settings.RETENTION_ENABLED and not options['dry_run']:
+            if options['interval']:
+                # Периодический запуск из docker-compose: при выключенном
+                # удалении просто выходим, не роняя старт контейнера
+                self.stdout.write('Удаление по срокам хранения выключено (RETENTION_ENABLED=False)')
+                return
+            raise CommandError(
+                'Удаление по срокам хранения выключено: проверьте сроки (--dry-run) '
+                'и включите RETENTION_ENABLED=True'
+            )
+        manager = RetentionManager(batch_size=options['batch_size'], dry_run=options['dry_run'])
+        for policy in manager.policies + [manager.default]:
+            self.stdout.write(f'Политика {policy}')
+        while True:
+            close_old_connections()
+            self.run_once(manager, options)
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+    def run_once(self, manager, options):
+        started = time.monotonic()
+        report = manager.run()
+        verb = 'Будет удалено' if options['dry_run'] else 'Удалено'
+        for table, (rows, size) in report.tables.items():
+            self.stdout.write(f'{table}: {verb.lower()} строк {rows}, ~{size / 1024 / 1024:.1f} МБ')
+        if options['vacuum'] and not options['dry_run']:
+            manager.vacuum([table for table, (rows, size) in report.tables.items() if rows])
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} строк: {report.rows}, освобождено ~{report.size / 1024 / 1024:.1f} МБ '
+            f'за {time.monotonic() - started:.1f} с'
+        ))
@@ -0,0 +1,151 @@
+import asyncio
+import json
+import time
+import msgpack
+import redis
+from datetime import datetime
+from django.core.management.base import BaseCommand
+from monitoring.models import SensorData, SensorRollup, SensorTag, Incident
+from monitoring.latest import LATEST_VALUES_KEY, LATEST_TIMESTAMPS_KEY, get_redis
+from monitoring.episodes import incident_engine
+from monitoring.mqtt_client import MQTTClient
+from monitoring.broadcast import (
+    broadcast_stats, start_broadcast_scheduler, stop_broadcast_scheduler
+)
+
+BENCH_TAG_PREFIX = 'bench_'
+# Свой журнал: журнал воркера start_mqtt занят его процессом
+BENCH_SPOOL_NAME = 'benchmark'
+
+
+class FakeMessage:
+    """Сообщение в формате paho (topic, payload)"""
+
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+class Command(BaseCommand):
+    help = 'Сравнение пропускной способности движков приема телеметрии (thread и asyncio)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=20000, help='Количество сообщений')
+        parser.add_argument('--tags', type=int, default=20, help='Количество тегов')
+        parser.add_argument(
+            '--samples-per-message', type=int, default=1,
+            help='Значений тега в одном сообщении (больше 1 - пакетный payload)'
+        )
+        parser.add_argument(
+            '--format', choices=['json', 'msgpack'], default='json', help='Кодирование payload'
+        )
+        parser.add_argument(
+            '--engine', choices=['thread', 'asyncio', 'all'], default='all',
+            help='Какой движок измерять'
+        )
+        parser.add_argument(
+            '--in-memory-layer', action='store_true',
+            help='Использовать InMemoryChannelLayer вместо настроенного channel layer'
+        )
+        parser.add_argument(
+            '--keep', action='store_true',
+            help='Не удалять записанные тестовые данные'
+        )
+
+    def handle(self, *args, **options):
+        if options['in_memory_layer']:
+            from channels.layers import channel_layers, DEFAULT_CHANNEL_LAYER
+            from channels.layers import InMemoryChannelLayer
+            channel_layers.set(DEFAULT_CHANNEL_LAYER, InMemoryChannelLayer())
+
+        # Брокер заменяет заранее сгенерированный поток сообщений, который
+        # подается прямо в обработчики движков
+        messages = self.generate_messages(
+            options['messages'], options['tags'], options['samples_per_message'], options['format']
+        )
+        engines = ['thread', 'asyncio'] if options['engine'] == 'all' else [options['engine']]
+
+        try:
+            for engine in engines:
+                self.cleanup()
+                publishes_before = broadcast_stats.publishes
+                started = time.perf_counter()
+                written = getattr(self, f'run_{engine}')(messages)
+                elapsed = time.perf_counter() - started
+                publishes = broadcast_stats.publishes - publishes_before
+                self.stdout.write(self.style.SUCCESS(
+                    f'{engine:8s} {len(messages)} сообщений за {elapsed:.2f} с: '
+                    f'{len(messages) / elapsed:,.0f} msg/s, {written / elapsed:,.0f} значений/с, '
+                    f'записано {written}, публикаций в channel layer {publishes}'
+                ))
+        finally:
+            if not options['keep']:
+                self.cleanup()
+
+    def generate_messages(self, count, tags, per_message=1, data_format='json'):
+        """count сообщений; при per_message > 1 - массив значений тега в каждом"""
+        now = datetime.now().isoformat()
+        encode = (
+            (lambda payload: msgpack.packb(payload, use_bin_type=True)) if data_format == 'msgpack'
+            else (lambda payload: json.dumps(payload).encode('utf-8'))
+        )
+        messages = []
+        for i in range(count):
+            samples = [
+                {'value': round((i * per_message + j) * 0.001, 3), 'timestamp': now}
+                for j in range(per_message)
+            ]
+            messages.append((
+                f'telemetry/{BENCH_TAG_PREFIX}{i % tags}',
+                encode(samples[0] if per_message == 1 else samples)
+            ))
+        return messages
+
+    def cleanup(self):
+        SensorData.objects.filter(tag__startswith=BENCH_TAG_PREFIX).delete()
+        Incident.objects.filter(tag__startswith=BENCH_TAG_PREFIX).delete()
+        # Ключ эпизода уставки - тег, эпизода правила - (тег, тип правила)
+        for key in list(incident_engine.episodes):
+            tag = key[0] if isinstance(key, tuple) else key
+            if tag.startswith(BENCH_TAG_PREFIX):
+                del incident_engine.episodes[key]
+        SensorRollup.objects.filter(tag__startswith=BENCH_TAG_PREFIX).delete()
+        SensorTag.objects.filter(tag__startswith=BENCH_TAG_PREFIX).delete()
+        try:
+            client = get_redis()
+            bench_tags = [
+                tag for tag in client.hkeys(LATEST_VALUES_KEY)
+                if tag.startswith(BENCH_TAG_PREFIX.encode())
+            ]
+            if bench_tags:
+                client.hdel(LATEST_VALUES_KEY, *bench_tags)
+                client.hdel(LATEST_TIMESTAMPS_KEY, *bench_tags)
+        except redis.RedisError as e:
+            # Без Redis (--in-memory-layer) последние значения не записывались
+            self.stderr.write(f'Кеш последних значений не очищен: {e}')
+
+    def run_thread(self, messages):
+        """Текущий движок: MQTTClient.on_message + поток пакетной записи"""
+        client = MQTTClient(spool_name=BENCH_SPOOL_NAME)
+        start_broadcast_scheduler()
+        client.writer.start()
+        for topic, payload in messages:
+            client.on_message(None, None, FakeMessage(topic, payload))
+        client.writer.stop()
+        stop_broadcast_scheduler()
+        return client.writer.written
+
+    def run_asyncio(self, messages):
+        """Asyncio-движок: AsyncIngestService без подключения к брокеру"""
+        from monitoring.async_ingest import AsyncIngestService
+
+        service = AsyncIngestService(spool_name=BENCH_SPOOL_NAME)
+
+        async def main():
+            await service.start()
+            for topic, payload in messages:
+                await service.handle_message(topic, payload)
+            await service.shutdown()
+
+        asyncio.run(main())
+        return service.written
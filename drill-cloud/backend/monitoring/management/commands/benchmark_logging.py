@@ -0,0 +1,73 @@
+import logging
+import os
+import tempfile
+import time
+from django.core.management.base import BaseCommand
+from monitoring.ingest_log import IngestLog
+
+
+class Command(BaseCommand):
+    help = 'Затраты CPU на журнал горячего пути ingest: построчный INFO против выборочного'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=200000, help='Количество сообщений')
+        parser.add_argument('--tags', type=int, default=20, help='Количество тегов')
+        parser.add_argument('--sample-rate', type=int, default=1000, help='Каждое N-е сообщение тега')
+
+    def handle(self, *args, **options):
+        count = options['messages']
+        messages = [
+            (f'telemetry/bench_log_{i % options["tags"]}', f'bench_log_{i % options["tags"]}',
+             {'value': i % 1000 / 10, 'timestamp': '2024-01-01T00:00:00Z'})
+            for i in range(count)
+        ]
+        scenarios = [
+            ('f-string INFO, вывод в файл', logging.INFO, self.per_message),
+            ('f-string INFO, уровень WARNING', logging.WARNING, self.per_message),
+            (f'выборка 1/{options["sample_rate"]}, уровень DEBUG', logging.DEBUG, self.sampled),
+            ('выборка, уровень INFO', logging.INFO, self.sampled),
+        ]
+
+        with tempfile.TemporaryDirectory() as directory:
+            baseline = None
+            for name, level, run in scenarios:
+                path = os.path.join(directory, 'ingest.log')
+                log = self.make_logger(path, level)
+                ingest_log = IngestLog(sample_rate=options['sample_rate'], log=log)
+                started = time.process_time()
+                run(log, ingest_log, messages)
+                elapsed = time.process_time() - started
+                for handler in log.handlers:
+                    handler.close()
+                size = os.path.getsize(path)
+                os.remove(path)
+
+                per_million = elapsed / count * 1000000
+                if baseline is None:
+                    baseline = per_million
+                self.stdout.write(
+                    f'{name}: {per_million:.2f} с CPU на 1 млн сообщений, '
+                    f'журнал {size / count * 1000000 / 1024 / 1024:.0f} МБ на 1 млн'
+                    + (f', экономия {baseline - per_million:.2f} с' if per_million < baseline else '')
+                )
+
+    def make_logger(self, path, level):
+        log = logging.getLogger('monitoring.benchmark_logging')
+        log.handlers = []
+        log.propagate = False
+        log.setLevel(level)
+        handler = logging.FileHandler(path)
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+        log.addHandler(handler)
+        return log
+
+    def per_message(self, log, ingest_log, messages):
+        """Прежний журнал: строка на сообщение и на рассылку"""
+        for topic, tag, payload in messages:
+            log.info(f"Получено сообщение из топика {topic}: {payload}")
+            log.info(f"Отправлено WebSocket обновление для {tag}")
+
+    def sampled(self, log, ingest_log, messages):
+        for topic, tag, payload in messages:
+            ingest_log.message(topic, tag, payload)
+            ingest_log.broadcast(tag)
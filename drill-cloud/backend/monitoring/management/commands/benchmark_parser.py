@@ -0,0 +1,99 @@
+import json
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from monitoring.models import SensorData
+from monitoring import payloads
+from monitoring.mqtt_client import extract_tag_from_topic
+from monitoring.payloads import parse_sensor_samples
+
+
+def legacy_extract_tag(topic):
+    parts = topic.split('/')
+    if parts[0] == 'telemetry' and len(parts) == 2:
+        return parts[1]
+    if parts[0] == 'drill' and len(parts) == 4 and parts[2] == 'sensor':
+        return f"{parts[1]}_{parts[3]}"
+    return None
+
+
+def legacy_parse(topic, raw_payload):
+    """Прежний разбор: json + fromisoformat + make_aware без кеша топиков
+
+    Возвращает (SensorData, время потеряно) или (None, True), если
+    сообщение отброшено.
+    """
+    tag = legacy_extract_tag(topic)
+    payload = json.loads(raw_payload.decode('utf-8'))
+    timestamp_str = payload.get('timestamp')
+    lost = False
+    try:
+        timestamp = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
+        timestamp = timezone.make_aware(timestamp)
+    except ValueError:
+        timestamp, lost = timezone.now(), True
+    except AttributeError:
+        # epoch ms: прежний код падал и сообщение отбрасывалось
+        return None, True
+    return SensorData(tag=tag, value=Decimal(str(payload['value'])), timestamp=timestamp), lost
+
+
+class Command(BaseCommand):
+    help = 'Микробенчмарк разбора MQTT сообщений: прежний разбор против текущего'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=200000, help='Количество сообщений')
+        parser.add_argument('--tags', type=int, default=50, help='Количество тегов каждого формата топика')
+
+    def handle(self, *args, **options):
+        messages = self.generate_messages(options['messages'], options['tags'])
+        json_library = 'orjson' if payloads.orjson is not None else 'json'
+        self.stdout.write(f'{len(messages)} сообщений, JSON: {json_library}')
+
+        started = time.perf_counter()
+        lost = 0
+        for topic, payload in messages:
+            sensor_data, timestamp_lost = legacy_parse(topic, payload)
+            lost += timestamp_lost
+        self.report('прежний', started, len(messages), lost)
+
+        extract_tag_from_topic.cache_clear()
+        started = time.perf_counter()
+        lost = 0
+        for topic, payload in messages:
+            samples = parse_sensor_samples(topic, extract_tag_from_topic(topic), payload)
+            lost += len(samples) != 1
+        self.report('текущий', started, len(messages), lost)
+
+    def report(self, name, started, count, lost):
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'{name:8s} {elapsed / count * 1e6:.2f} мкс/сообщение, {count / elapsed:,.0f} msg/s, '
+            f'потеряно времени или сообщений: {lost}'
+        ))
+
+    def generate_messages(self, count, tags):
+        """Смесь telemetry/<tag> и drill/<equipment>/sensor/<type> и форматов времени"""
+        start = datetime.now(dt_timezone.utc)
+        messages = []
+        for i in range(count):
+            moment = start + timedelta(milliseconds=100 * i)
+            if i % 2:
+                topic = f'drill/rig{i % 5}/sensor/bench_{i % tags}'
+            else:
+                topic = f'telemetry/bench_parse_{i % tags}'
+            kind = i % 4
+            if kind == 0:
+                timestamp = moment.isoformat().replace('+00:00', 'Z')
+            elif kind == 1:
+                # drill-edge: время с зоной
+                timestamp = moment.isoformat()
+            elif kind == 2:
+                timestamp = moment.replace(tzinfo=None).isoformat()
+            else:
+                timestamp = int(moment.timestamp() * 1000)
+            payload = {'value': round(i % 1000 * 0.137, 3), 'timestamp': timestamp}
+            messages.append((topic, json.dumps(payload).encode('utf-8')))
+        return messages
@@ -0,0 +1,59 @@
+import time
+import numpy as np
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from monitoring.models import SensorData, Rule
+from monitoring.rules import RuleEngine
+
+
+class Command(BaseCommand):
+    help = 'Пропускная способность движка правил на синтетических пачках (без БД)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--samples', type=int, default=200000, help='Количество значений')
+        parser.add_argument('--tags', type=int, default=20, help='Количество тегов')
+        parser.add_argument('--batch-size', type=int, default=500, help='Размер пачки')
+        parser.add_argument('--window', type=int, default=50, help='Окно правил')
+
+    def handle(self, *args, **options):
+        tags = [f'bench_rule_{i}' for i in range(options['tags'])]
+        # На каждом теге все типы правил
+        rules = {
+            tag: [
+                Rule(tag=tag, rule_type=Rule.RATE_OF_CHANGE, window=1, limit=50.0),
+                Rule(tag=tag, rule_type=Rule.ROLLING_MEAN, window=options['window'], limit=3.0),
+                Rule(tag=tag, rule_type=Rule.STUCK, window=options['window'], limit=0.001),
+                Rule(tag=tag, rule_type=Rule.N_OF_M, window=options['window'], count=5, limit=9.0),
+            ]
+            for tag in tags
+        }
+        engine = RuleEngine()
+        engine.set_rules(rules)
+
+        batches = self.generate_batches(tags, options['samples'], options['batch_size'])
+        violations = 0
+        started = time.perf_counter()
+        for batch in batches:
+            for rule, samples, violated in engine.evaluate(batch):
+                violations += np.count_nonzero(violated)
+        elapsed = time.perf_counter() - started
+
+        total = sum(len(batch) for batch in batches)
+        rule_count = sum(len(r) for r in rules.values())
+        self.stdout.write(self.style.SUCCESS(
+            f'{total} значений, {rule_count} правил за {elapsed:.2f} с: '
+            f'{total / elapsed:,.0f} значений/с, нарушений {violations}'
+        ))
+
+    def generate_batches(self, tags, count, batch_size):
+        start = datetime.now(dt_timezone.utc)
+        samples = [
+            SensorData(
+                tag=tags[i % len(tags)],
+                value=Decimal(f'{(i * 7919) % 1000 / 100:.3f}'),
+                timestamp=start + timedelta(milliseconds=100 * (i // len(tags)))
+            )
+            for i in range(count)
+        ]
+        return [samples[i:i + batch_size] for i in range(0, count, batch_size)]
@@ -0,0 +1,32 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.core.management.base import BaseCommand
+from monitoring.rollups import RESOLUTIONS, bucket_start, rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Пересчет агрегатов sensor_rollups из сырых данных sensor_data'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24, help='За сколько последних часов')
+        parser.add_argument('--tag', action='append', help='Только указанные теги (можно несколько)')
+        parser.add_argument(
+            '--resolution', action='append', choices=list(RESOLUTIONS),
+            help='Только указанные разрешения (по умолчанию все)'
+        )
+
+    def handle(self, *args, **options):
+        # Границы выровнены по часу, чтобы каждый интервал агрегата
+        # пересчитывался целиком за один проход
+        end = bucket_start(datetime.now(dt_timezone.utc), '1h') + timedelta(hours=1)
+        start = end - timedelta(hours=options['hours'] + 1)
+        written = 0
+        # Пересчет по часу за раз - короткие транзакции, без длинных блокировок
+        chunk = start
+        while chunk < end:
+            written += rebuild_rollups(
+                chunk, chunk + timedelta(hours=1), options['resolution'], options['tag']
+            )
+            chunk += timedelta(hours=1)
+        self.stdout.write(self.style.SUCCESS(
+            f'Агрегаты пересчитаны за {start:%Y-%m-%d %H:%M} - {end:%Y-%m-%d %H:%M}, строк: {written}'
+        ))
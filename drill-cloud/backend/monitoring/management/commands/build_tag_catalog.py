@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from monitoring.catalog import rebuild_catalog
+
+
+class Command(BaseCommand):
+    help = 'Заполнение каталога тегов sensor_tags по сырым данным sensor_data'
+
+    def handle(self, *args, **options):
+        tags = rebuild_catalog()
+        self.stdout.write(self.style.SUCCESS(f'Каталог тегов пересчитан, тегов: {tags}'))
@@ -0,0 +1,63 @@
+import sys
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from monitoring.export import FORMATS, export_filename, export_stream, pyarrow
+from monitoring.views import get_time_bounds
+
+
+class Command(BaseCommand):
+    help = 'Выгрузка истории sensor_data в CSV или Parquet потоком (постоянная память)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tag', action='append', default=[], help='Тег (можно несколько)')
+        parser.add_argument('--tags', default='', help='Теги через запятую')
+        parser.add_argument('--from', dest='from', help='Начало в ISO 8601')
+        parser.add_argument('--to', help='Конец в ISO 8601 (по умолчанию - сейчас)')
+        parser.add_argument('--range', choices=['1h', '24h', '7d'], help='Диапазон вместо --from')
+        parser.add_argument('--format', dest='file_format', choices=FORMATS, default='csv')
+        parser.add_argument(
+            '--gzip', action='store_true',
+            help='CSV - файл gzip, Parquet - сжатие gzip внутри файла'
+        )
+        parser.add_argument(
+            '--output', '-o',
+            help='Файл (по умолчанию имя по диапазону, "-" - stdout)'
+        )
+        parser.add_argument(
+            '--rows-per-second', type=int, default=settings.EXPORT_ROWS_PER_SECOND,
+            help='Предел скорости чтения, 0 - без предела'
+        )
+
+    def handle(self, *args, **options):
+        tags = list(dict.fromkeys(t for t in options['tags'].split(',') + options['tag'] if t))
+        if not tags:
+            raise CommandError('Не указаны теги (--tag или --tags)')
+        if options['file_format'] == 'parquet' and pyarrow is None:
+            raise CommandError('Parquet недоступен: не установлен pyarrow')
+        params = {name: options[name] for name in ('from', 'to', 'range') if options[name]}
+        try:
+            start, end = get_time_bounds(params)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        content = export_stream(
+            tags, start, end, options['file_format'], options['gzip'], options['rows_per_second']
+        )
+        output = options['output'] or export_filename(start, end, options['file_format'], options['gzip'])
+        started = time.monotonic()
+        written = 0
+        if output == '-':
+            for chunk in content:
+                sys.stdout.buffer.write(chunk)
+                written += len(chunk)
+            sys.stdout.buffer.flush()
+        else:
+            with open(output, 'wb') as file:
+                for chunk in content:
+                    file.write(chunk)
+                    written += len(chunk)
+        self.stderr.write(self.style.SUCCESS(
+            f'Выгружено {written / 1024 / 1024:.1f} МБ за {time.monotonic() - started:.1f} с: '
+            f'{", ".join(tags)}, {start:%Y-%m-%d %H:%M:%S} - {end:%Y-%m-%d %H:%M:%S} -> {output}'
+        ))
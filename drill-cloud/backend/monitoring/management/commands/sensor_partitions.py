@@ -0,0 +1,122 @@
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from monitoring.partitions import (
+    INTERVALS, VALUE_TYPES, is_partitioned, list_partitions,
+    create_partitions, detach_partition, convert_to_partitioned, check_detach_concurrently
+)
+
+
+class Command(BaseCommand):
+    help = 'Управление секционированным по времени хранением sensor_data'
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest='action', required=True)
+
+        convert = subparsers.add_parser('convert', help='Перевести sensor_data в секционированную таблицу')
+        convert.add_argument('--interval', choices=INTERVALS, default=settings.SENSOR_PARTITION_INTERVAL)
+        convert.add_argument(
+            '--value-type', choices=['real', 'double'], default='real',
+            help='Тип столбца value: real (4 байта) или double (8 байт)'
+        )
+        convert.add_argument('--ahead', type=int, default=settings.SENSOR_PARTITION_AHEAD_DAYS)
+        convert.add_argument(
+            '--keep-legacy', action='store_true',
+            help='Оставить старую таблицу как sensor_data_legacy'
+        )
+        convert.add_argument(
+            '--no-default', action='store_true',
+            help='Без секции по умолчанию (нужно для detach --concurrently)'
+        )
+
+        create = subparsers.add_parser('create', help='Создать секции на ближайшие дни')
+        create.add_argument('--interval', choices=INTERVALS, default=settings.SENSOR_PARTITION_INTERVAL)
+        create.add_argument('--ahead', type=int, default=settings.SENSOR_PARTITION_AHEAD_DAYS)
+        create.add_argument(
+            '--every', type=int, default=0,
+            help='Повторять каждые N секунд (0 - один раз); пока sensor_data '
+                 'не секционирована, ничего не делать'
+        )
+
+        detach = subparsers.add_parser('detach', help='Отсоединить секции старше N дней')
+        detach.add_argument('--older-than', type=int, required=True, help='Возраст в днях')
+        detach.add_argument('--drop', action='store_true', help='Удалить отсоединенные секции')
+        detach.add_argument(
+            '--concurrently', action='store_true',
+            help='DETACH PARTITION CONCURRENTLY (без блокировки таблицы; '
+                 'только без секции по умолчанию)'
+        )
+        detach.add_argument('--dry-run', action='store_true')
+
+        subparsers.add_parser('list', help='Список секций')
+
+    def handle(self, *args, **options):
+        action = options['action']
+        if action == 'create' and options['every']:
+            self.create_periodically(options)
+            return
+        if action != 'convert' and not is_partitioned():
+            raise CommandError(
+                'sensor_data не секционирована, выполните: manage.py sensor_partitions convert'
+            )
+        getattr(self, f'handle_{action}')(options)
+
+    def handle_convert(self, options):
+        if is_partitioned():
+            raise CommandError('sensor_data уже секционирована')
+        value_type = VALUE_TYPES[0] if options['value_type'] == 'real' else VALUE_TYPES[1]
+        moved = convert_to_partitioned(
+            options['interval'], value_type, options['ahead'], options['keep_legacy'],
+            default=not options['no_default']
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'sensor_data секционирована ({options["interval"]}, value {value_type}), '
+            f'перенесено строк: {moved}'
+        ))
+
+    def handle_create(self, options):
+        now = datetime.now(dt_timezone.utc)
+        created = create_partitions(now, now + timedelta(days=options['ahead']), options['interval'])
+        for name in created:
+            self.stdout.write(f'Создана секция {name}')
+        self.stdout.write(self.style.SUCCESS(f'Создано секций: {len(created)}'))
+
+    def create_periodically(self, options):
+        """Фоновый режим create: секции заводятся заранее, до того как
+        строки начнут попадать в секцию по умолчанию"""
+        while True:
+            close_old_connections()
+            if is_partitioned():
+                self.handle_create(options)
+            time.sleep(options['every'])
+
+    def handle_detach(self, options):
+        if options['concurrently']:
+            try:
+                check_detach_concurrently()
+            except ValueError as e:
+                raise CommandError(str(e))
+        cutoff = datetime.now(dt_timezone.utc) - timedelta(days=options['older_than'])
+        reclaimed = 0
+        for name, start, end, size in list_partitions():
+            if end > cutoff:
+                continue
+            if options['dry_run']:
+                self.stdout.write(f'Будет отсоединена секция {name} ({start:%Y-%m-%d} - {end:%Y-%m-%d})')
+                continue
+            detach_partition(name, drop=options['drop'], concurrently=options['concurrently'])
+            reclaimed += size
+            self.stdout.write(
+                f'{"Удалена" if options["drop"] else "Отсоединена"} секция {name} '
+                f'({start:%Y-%m-%d} - {end:%Y-%m-%d}, {size / 1024 / 1024:.1f} МБ)'
+            )
+        if options['drop'] and not options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f'Освобождено {reclaimed / 1024 / 1024:.1f} МБ'))
+
+    def handle_list(self, options):
+        for name, start, end, size in list_partitions():
+            self.stdout.write(
+                f'{name}: {start:%Y-%m-%d %H:%M} - {end:%Y-%m-%d %H:%M}, {size / 1024 / 1024:.1f} МБ'
+            )
@@ -1,17 +1,75 @@
-from django.core.management.base import BaseCommand
-from monitoring.mqtt_client import start_mqtt_client, stop_mqtt_client
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from monitoring.mqtt_client import (
+    start_mqtt_client, stop_mqtt_client, report_mqtt_health,
+    worker_client_id, PARTITION_HASH, PARTITION_SHARE
+)
+from monitoring.health import get_workers_health
+from monitoring.metrics import start_metrics_server
+import asyncio
+import os
 import signal
+import subprocess
 import sys
+import time
 
 
 class Command(BaseCommand):
     help = 'Запуск MQTT клиента для подписки на топики телеметрии'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=settings.INGEST_WORKERS,
+            help='Количество процессов ingest (больше 1 - режим supervisor)'
+        )
+        parser.add_argument(
+            '--partition', choices=[PARTITION_HASH, PARTITION_SHARE],
+            default=settings.INGEST_PARTITION_MODE,
+            help='Распределение тегов: hash - по хешу тега, share - общая подписка MQTT'
+        )
+        parser.add_argument(
+            '--engine', choices=['thread', 'asyncio'], default=settings.INGEST_ENGINE,
+            help='Движок приема: thread - paho в фоновом потоке, asyncio - aiomqtt'
+        )
+        parser.add_argument(
+            '--worker-index', type=int, default=None,
+            help='Номер воркера (задается supervisor)'
+        )
+        parser.add_argument(
+            '--metrics-port', type=int, default=settings.METRICS_PORT,
+            help='Порт /metrics; воркер N слушает порт + N (0 - не запускать)'
+        )
+
     def handle(self, *args, **options):
+        workers = options['workers']
+        partition = options['partition']
+        engine = options['engine']
+        self.metrics_port = options['metrics_port']
+        if workers > 1 and partition == PARTITION_SHARE and settings.INCIDENT_EPISODES:
+            # Значения одного тега попадают в разные воркеры, и каждый вел бы
+            # свой эпизод: дубли инцидентов и перезапись пика и счетчика
+            raise CommandError(
+                'Режим share несовместим с INCIDENT_EPISODES: используйте --partition hash '
+                'или INCIDENT_EPISODES=False'
+            )
+        if workers > 1 and options['worker_index'] is None:
+            self.run_supervisor(workers, partition, engine)
+            return
+
+        worker_index = options['worker_index'] or 0
+        if self.metrics_port:
+            start_metrics_server(self.metrics_port + worker_index)
+        if engine == 'asyncio':
+            self.run_async_worker(worker_index, workers, partition)
+        else:
+            self.run_worker(worker_index, workers, partition)
+
+    def run_worker(self, worker_index, workers, partition):
+        """Запуск одного MQTT клиента в текущем процессе"""
         self.stdout.write(
             self.style.SUCCESS('Запуск MQTT клиента...')
         )
-        
+
         # Обработчик сигналов для корректного завершения
         def signal_handler(sig, frame):
             self.stdout.write(
@@ -19,22 +77,23 @@ class Command(BaseCommand):
             )
             stop_mqtt_client()
             sys.exit(0)
-        
+
         signal.signal(signal.SIGINT, signal_handler)
         signal.signal(signal.SIGTERM, signal_handler)
-        
+
         try:
             # Запуск MQTT клиента
-            start_mqtt_client()
-            
+            start_mqtt_client(worker_index, workers, partition)
+
             self.stdout.write(
                 self.style.SUCCESS('MQTT клиент запущен. Нажмите Ctrl+C для остановки.')
             )
-            
-            # Бесконечный цикл для поддержания работы клиента
+
+            # Поддерживаем работу клиента и периодически публикуем его состояние
             while True:
-                signal.pause()
-                
+                report_mqtt_health()
+                time.sleep(settings.INGEST_HEALTH_INTERVAL)
+
         except KeyboardInterrupt:
             self.stdout.write(
                 self.style.WARNING('\nОстановка MQTT клиента...')
@@ -44,4 +103,101 @@ class Command(BaseCommand):
             self.stdout.write(
                 self.style.ERROR(f'Ошибка: {e}')
             )
-            stop_mqtt_client() 
\ No newline at end of file
+            stop_mqtt_client()
+
+    def run_async_worker(self, worker_index, workers, partition):
+        """Запуск asyncio-движка приема в текущем процессе"""
+        from monitoring.async_ingest import AsyncIngestService
+
+        self.stdout.write(
+            self.style.SUCCESS('Запуск asyncio MQTT клиента...')
+        )
+        service = AsyncIngestService(worker_index, workers, partition)
+
+        async def main():
+            loop = asyncio.get_running_loop()
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(sig, service.stop)
+            await service.run()
+
+        asyncio.run(main())
+        self.stdout.write(
+            self.style.WARNING('MQTT клиент остановлен')
+        )
+
+    def run_supervisor(self, workers, partition, engine):
+        """Запуск и контроль нескольких процессов-воркеров"""
+        self.stdout.write(
+            self.style.SUCCESS(f'Запуск {workers} MQTT воркеров (распределение: {partition}, движок: {engine})...')
+        )
+        stopping = False
+
+        def signal_handler(sig, frame):
+            nonlocal stopping
+            stopping = True
+
+        signal.signal(signal.SIGINT, signal_handler)
+        signal.signal(signal.SIGTERM, signal_handler)
+
+        processes = {i: self.spawn_worker(i, workers, partition, engine) for i in range(workers)}
+        worker_ids = [worker_client_id(i, workers) for i in range(workers)]
+        next_report = time.monotonic() + settings.INGEST_HEALTH_INTERVAL
+
+        while not stopping:
+            time.sleep(1)
+            for index, process in processes.items():
+                if process.poll() is not None and not stopping:
+                    self.stdout.write(
+                        self.style.WARNING(
+                            f'Воркер {index} завершился с кодом {process.returncode}, перезапуск'
+                        )
+                    )
+                    processes[index] = self.spawn_worker(index, workers, partition, engine)
+
+            if time.monotonic() >= next_report:
+                next_report = time.monotonic() + settings.INGEST_HEALTH_INTERVAL
+                self.report_health(worker_ids)
+
+        self.stdout.write(
+            self.style.WARNING('\nОстановка MQTT воркеров...')
+        )
+        for process in processes.values():
+            if process.poll() is None:
+                process.send_signal(signal.SIGTERM)
+        for index, process in processes.items():
+            try:
+                process.wait(timeout=settings.INGEST_SHUTDOWN_TIMEOUT + 5)
+            except subprocess.TimeoutExpired:
+                self.stdout.write(
+                    self.style.ERROR(f'Воркер {index} не завершился вовремя, принудительная остановка')
+                )
+                process.kill()
+
+    def spawn_worker(self, worker_index, workers, partition, engine):
+        """Запуск процесса-воркера"""
+        return subprocess.Popen([
+            sys.executable, os.path.abspath(sys.argv[0]), 'start_mqtt',
+            '--workers', str(workers),
+            '--partition', partition,
+            '--engine', engine,
+            '--worker-index', str(worker_index),
+            '--metrics-port', str(self.metrics_port),
+        ])
+
+    def report_health(self, worker_ids):
+        """Вывод сводки состояния воркеров"""
+        for worker_id, status in get_workers_health(worker_ids).items():
+            if status is None:
+                self.stdout.write(
+                    self.style.WARNING(f'{worker_id}: нет данных о состоянии')
+                )
+                continue
+            spool = status.get('spool')
+            pool = status.get('db_pool')
+            self.stdout.write(
+                f"{worker_id}: pid={status['pid']} connected={status['connected']} "
+                f"received={status['received']} written={status['written']} "
+                f"dropped={status['dropped']} queue={status['queue_depth']}"
+                + (f" spool={spool['pending']} db={spool['db_available']}" if spool else '')
+                + (f" pool={pool['in_use']}/{pool['max_size']}" if pool else '')
+            )
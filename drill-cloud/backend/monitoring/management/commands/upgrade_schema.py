@@ -0,0 +1,70 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+# Таблицы и колонки, появившиеся после первой версии drill-infra/init-db.sql.
+# init-db.sql выполняется только при создании тома Postgres, миграций в
+# проекте нет, поэтому существующие базы обновляются этой командой.
+# Все команды идемпотентны: повторный запуск ничего не меняет.
+UPGRADE_SQL = [
+    # Агрегаты sensor_rollups
+    """
+    CREATE TABLE IF NOT EXISTS sensor_rollups (
+        id BIGSERIAL PRIMARY KEY,
+        tag VARCHAR(100) NOT NULL,
+        resolution VARCHAR(4) NOT NULL,
+        bucket TIMESTAMP WITH TIME ZONE NOT NULL,
+        min_value DOUBLE PRECISION NOT NULL,
+        max_value DOUBLE PRECISION NOT NULL,
+        sum_value DOUBLE PRECISION NOT NULL,
+        count INTEGER NOT NULL,
+        last_value DOUBLE PRECISION NOT NULL,
+        last_timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
+        CONSTRAINT sensor_rollups_tag_resolution_bucket_key UNIQUE (tag, resolution, bucket)
+    )
+    """,
+    # Каталог тегов
+    """
+    CREATE TABLE IF NOT EXISTS sensor_tags (
+        tag VARCHAR(100) PRIMARY KEY,
+        first_seen TIMESTAMP WITH TIME ZONE NOT NULL,
+        last_seen TIMESTAMP WITH TIME ZONE NOT NULL,
+        last_value DOUBLE PRECISION NOT NULL,
+        message_count BIGINT NOT NULL DEFAULT 0
+    )
+    """,
+    # Правила контроля
+    """
+    CREATE TABLE IF NOT EXISTS rules (
+        id SERIAL PRIMARY KEY,
+        tag VARCHAR(100) NOT NULL,
+        rule_type VARCHAR(20) NOT NULL,
+        "window" INTEGER NOT NULL DEFAULT 10,
+        count INTEGER NOT NULL DEFAULT 1,
+        "limit" DOUBLE PRECISION NOT NULL,
+        is_active BOOLEAN NOT NULL DEFAULT TRUE,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+        CONSTRAINT rules_tag_rule_type_key UNIQUE (tag, rule_type)
+    )
+    """,
+    # Эпизоды инцидентов: существующие записи считаются закрытыми
+    'ALTER TABLE incidents ADD COLUMN IF NOT EXISTS peak_value DECIMAL(10, 3)',
+    'ALTER TABLE incidents ADD COLUMN IF NOT EXISTS sample_count INTEGER NOT NULL DEFAULT 1',
+    'ALTER TABLE incidents ADD COLUMN IF NOT EXISTS last_seen TIMESTAMP WITH TIME ZONE',
+    'ALTER TABLE incidents ADD COLUMN IF NOT EXISTS ended_at TIMESTAMP WITH TIME ZONE',
+    "ALTER TABLE incidents ADD COLUMN IF NOT EXISTS status VARCHAR(10) NOT NULL DEFAULT 'closed'",
+    # Индекс по tag покрывается индексом tag+timestamp
+    'DROP INDEX IF EXISTS idx_sensor_data_tag',
+]
+
+
+class Command(BaseCommand):
+    help = 'Обновление схемы существующей БД до текущей версии (идемпотентно)'
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Схема ведется только для PostgreSQL')
+        with transaction.atomic(), connection.cursor() as cursor:
+            for sql in UPGRADE_SQL:
+                cursor.execute(sql)
+        self.stdout.write(self.style.SUCCESS('Схема БД обновлена'))
@@ -0,0 +1,369 @@
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Границы гистограмм длительности (сек) и размера пачки
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+BATCH_SIZE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Metric:
+    """Метрика с необязательными метками; значения по набору меток"""
+    kind = None
+
+    def __init__(self, name, help, labels=(), registry=None):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._children = {}
+        if not self.label_names:
+            self._children[()] = self._new_child()
+        (registry or REGISTRY).register(self)
+
+    def labels(self, *values, **kwargs):
+        """Значение для набора меток (по порядку или по имени)"""
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.label_names)
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _default(self):
+        return self._children[()]
+
+    def samples(self):
+        """[(suffix, label_values, extra_labels, value)] для вывода"""
+        with self._lock:
+            children = list(self._children.items())
+        result = []
+        for key, child in children:
+            for suffix, extra, value in child.samples():
+                result.append((suffix, key, extra, value))
+        return result
+
+
+class _Value:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self):
+        return [('', (), self.value)]
+
+
+class Counter(Metric):
+    """Монотонный счетчик (имя с суффиксом _total)"""
+    kind = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+
+class Gauge(Metric):
+    """Текущее значение"""
+    kind = 'gauge'
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+    def dec(self, amount=1):
+        self._default().dec(amount)
+
+    def set(self, value):
+        self._default().set(value)
+
+
+class _Timer:
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.started)
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        with self._lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+            self.sum += value
+            self.count += 1
+
+    def time(self):
+        """Контекстный менеджер: наблюдение длительности блока"""
+        return _Timer(self)
+
+    def samples(self):
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        result = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            result.append(('_bucket', (('le', _format_value(float(bound))),), cumulative))
+        result.append(('_bucket', (('le', '+Inf'),), count))
+        result.append(('_sum', (), total))
+        result.append(('_count', (), count))
+        return result
+
+
+class Histogram(Metric):
+    """Распределение значений по корзинам"""
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS, registry=None):
+        self.buckets = tuple(buckets)
+        super().__init__(name, help, labels, registry)
+
+    def _new_child(self):
+        return _Histogram(self.buckets)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+
+class FunctionMetric:
+    """Метрика, значение которой вычисляется при выводе
+
+    Для состояния, которое уже хранится в другом месте (глубина очереди,
+    счетчики рассылки). function возвращает число или None (метрика не
+    выводится), либо словарь {значение метки: число} при label.
+    """
+
+    def __init__(self, name, help, function, kind='gauge', label=None, registry=None):
+        self.name = name
+        self.help = help
+        self.function = function
+        self.kind = kind
+        self.label_names = (label,) if label else ()
+        (registry or REGISTRY).register(self)
+
+    def samples(self):
+        try:
+            value = self.function()
+        except Exception as e:
+            logger.error(f"Ошибка вычисления метрики {self.name}: {e}")
+            return []
+        if value is None:
+            return []
+        if self.label_names:
+            return [('', (str(k),), (), v) for k, v in value.items()]
+        return [('', (), (), value)]
+
+
+class Registry:
+    """Набор метрик процесса и вывод в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics[metric.name] = metric
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            samples = metric.samples()
+            if not samples and isinstance(metric, FunctionMetric):
+                continue
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for suffix, values, extra, value in samples:
+                labels = _format_labels(metric.label_names, values, extra)
+                lines.append(f'{metric.name}{suffix}{labels} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port, host='0.0.0.0'):
+    """HTTP сервер /metrics в фоновом потоке (для процессов без Django HTTP)"""
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        logger.error(f"Не удалось запустить сервер метрик на порту {port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return server
+
+
+# Метрики ingest и WebSocket
+
+MESSAGES_RECEIVED = Counter(
+    'ingest_messages_received_total', 'MQTT сообщения, полученные воркером', ['pattern']
+)
+MESSAGES_PARSED = Counter(
+    'ingest_messages_parsed_total', 'Сообщения, разобранные в значение', ['pattern']
+)
+MESSAGES_DROPPED = Counter(
+    'ingest_messages_dropped_total', 'Отброшенные сообщения по причинам', ['pattern', 'reason']
+)
+SAMPLES_PARSED = Counter(
+    'ingest_samples_parsed_total', 'Значения, разобранные из сообщений (пачки и кадры)', ['pattern']
+)
+SAMPLES_DROPPED = Counter(
+    'ingest_samples_dropped_total', 'Значения, отброшенные после очереди', ['reason']
+)
+PARSE_SECONDS = Histogram('ingest_parse_seconds', 'Разбор JSON payload')
+DB_INSERT_SECONDS = Histogram('ingest_db_insert_seconds', 'Запись пачки в БД (bulk_create)')
+DB_INSERT_ERRORS = Counter('ingest_db_insert_errors_total', 'Ошибки записи пачки в БД')
+BATCH_SIZE = Histogram('ingest_batch_size', 'Размер записанной пачки', buckets=BATCH_SIZE_BUCKETS)
+SAMPLES_WRITTEN = Counter('ingest_samples_written_total', 'Значения, записанные в БД')
+THRESHOLD_CHECK_SECONDS = Histogram(
+    'ingest_threshold_check_seconds', 'Проверка уставок и правил для пачки', ['check']
+)
+GROUP_SEND_SECONDS = Histogram(
+    'channel_group_send_seconds', 'Публикация в группу channel layer', ['message_type']
+)
+GROUP_SEND_ERRORS = Counter(
+    'channel_group_send_errors_total', 'Ошибки публикации в channel layer', ['message_type']
+)
+WEBSOCKET_CONNECTIONS = Gauge('websocket_connections', 'Открытые WebSocket соединения')
+WEBSOCKET_SUBSCRIPTIONS = Gauge(
+    'websocket_subscriptions', 'Подписки WebSocket клиентов на теги', ['mode']
+)
+RESPONSE_CACHE_REQUESTS = Counter(
+    'response_cache_requests_total', 'Запросы к кешируемым эндпоинтам REST API', ['endpoint', 'result']
+)
+
+
+DB_POOL_WAIT_SECONDS = Histogram('db_pool_wait_seconds', 'Ожидание соединения из пула БД')
+
+
+def register_ingest_metrics(queue_depth, forwarder=None):
+    """Метрики состояния движка приема: очередь записи и журнал spool"""
+    FunctionMetric('ingest_queue_depth', 'Значения в очереди записи', queue_depth)
+    if forwarder is None:
+        return
+    FunctionMetric(
+        'ingest_spool_pending', 'Значения в журнале, еще не записанные в БД',
+        lambda: forwarder.spool.pending()[0]
+    )
+    FunctionMetric(
+        'ingest_spool_oldest_age_seconds', 'Возраст самого старого значения в журнале',
+        lambda: forwarder.stats()['oldest_age']
+    )
+    FunctionMetric('ingest_spool_bytes', 'Занятое журналом место', forwarder.spool.used_bytes)
+    FunctionMetric(
+        'ingest_spool_replayed_total', 'Значения, дочитанные из журнала с диска',
+        lambda: forwarder.spool.replayed, kind='counter'
+    )
+    FunctionMetric(
+        'ingest_db_available', '1, если последняя запись в БД удалась',
+        lambda: int(forwarder.db_available)
+    )
+
+
+def register_pool_metrics(pool):
+    """Метрики заполненности пула соединений с БД"""
+    FunctionMetric(
+        'db_pool_connections', 'Соединения пула БД по состоянию',
+        lambda: {'in_use': pool.in_use, 'idle': len(pool._idle)}, label='state'
+    )
+    FunctionMetric('db_pool_max_connections', 'Максимум соединений пула БД', lambda: pool.max_size)
+    FunctionMetric(
+        'db_pool_saturation', 'Доля занятых соединений пула БД',
+        lambda: pool.stats()['saturation']
+    )
+    FunctionMetric(
+        'db_pool_waits_total', 'Выдачи соединения с ожиданием свободного',
+        lambda: pool.waits, kind='counter'
+    )
+    FunctionMetric(
+        'db_pool_timeouts_total', 'Отказы: нет свободного соединения за DB_POOL_TIMEOUT',
+        lambda: pool.timeouts, kind='counter'
+    )
+    FunctionMetric(
+        'db_pool_discarded_total', 'Закрытые оборванные соединения пула БД',
+        lambda: pool.discarded, kind='counter'
+    )
@@ -1,19 +1,34 @@
+from decimal import Decimal
 from django.db import models
 from django.utils import timezone
 
 
+class SensorValueField(models.DecimalField):
+    """DecimalField, совместимый с колонкой real/double precision
+
+    После manage.py sensor_partitions convert колонка value имеет тип real
+    или double precision, и драйвер возвращает float. Значение приводится к
+    Decimal с decimal_places знаками, как у колонки DECIMAL, так что код и
+    API получают одинаковый тип при любой схеме хранения.
+    """
+
+    def from_db_value(self, value, expression, connection):
+        if isinstance(value, float):
+            return Decimal(repr(value)).quantize(Decimal(1).scaleb(-self.decimal_places))
+        return value
+
+
 class SensorData(models.Model):
     """Модель для хранения данных сенсоров"""
     timestamp = models.DateTimeField('Время измерения')
     tag = models.CharField('Идентификатор параметра', max_length=100)
-    value = models.DecimalField('Значение', max_digits=10, decimal_places=3)
+    value = SensorValueField('Значение', max_digits=10, decimal_places=3)
     created_at = models.DateTimeField('Время создания', auto_now_add=True)
 
     class Meta:
         db_table = 'sensor_data'
         indexes = [
             models.Index(fields=['timestamp']),
-            models.Index(fields=['tag']),
             models.Index(fields=['tag', 'timestamp']),
         ]
         ordering = ['-timestamp']
@@ -22,6 +37,59 @@ class SensorData(models.Model):
         return f"{self.tag}: {self.value} at {self.timestamp}"
 
 
+class SensorRollup(models.Model):
+    """Модель для хранения агрегатов данных сенсоров за интервал"""
+    RESOLUTIONS = [
+        ('1s', '1 секунда'),
+        ('1m', '1 минута'),
+        ('1h', '1 час'),
+    ]
+
+    tag = models.CharField('Идентификатор параметра', max_length=100)
+    resolution = models.CharField('Разрешение', max_length=4, choices=RESOLUTIONS)
+    bucket = models.DateTimeField('Начало интервала')
+    min_value = models.FloatField('Минимум')
+    max_value = models.FloatField('Максимум')
+    sum_value = models.FloatField('Сумма')
+    count = models.IntegerField('Количество значений')
+    last_value = models.FloatField('Последнее значение')
+    last_timestamp = models.DateTimeField('Время последнего значения')
+
+    class Meta:
+        db_table = 'sensor_rollups'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['tag', 'resolution', 'bucket'],
+                name='sensor_rollups_tag_resolution_bucket_key'
+            ),
+        ]
+        ordering = ['bucket']
+
+    def __str__(self):
+        return f"{self.tag} [{self.resolution}] {self.bucket}: {self.avg_value}"
+
+    @property
+    def avg_value(self):
+        """Среднее значение за интервал"""
+        return self.sum_value / self.count if self.count else None
+
+
+class SensorTag(models.Model):
+    """Модель каталога тегов, который ведет ingest"""
+    tag = models.CharField('Идентификатор параметра', max_length=100, primary_key=True)
+    first_seen = models.DateTimeField('Первое значение')
+    last_seen = models.DateTimeField('Последнее значение')
+    last_value = models.FloatField('Последнее значение')
+    message_count = models.BigIntegerField('Всего сообщений', default=0)
+
+    class Meta:
+        db_table = 'sensor_tags'
+        ordering = ['tag']
+
+    def __str__(self):
+        return f"{self.tag}: {self.last_value} at {self.last_seen}"
+
+
 class Threshold(models.Model):
     """Модель для хранения уставок параметров"""
     tag = models.CharField('Идентификатор параметра', max_length=100, unique=True)
@@ -46,19 +114,63 @@ class Threshold(models.Model):
         return False, None
 
 
+class Rule(models.Model):
+    """Модель правил контроля параметра помимо уставок min/max"""
+    RATE_OF_CHANGE = 'rate_of_change'
+    ROLLING_MEAN = 'rolling_mean'
+    STUCK = 'stuck'
+    N_OF_M = 'n_of_m'
+    RULE_TYPES = [
+        (RATE_OF_CHANGE, 'Скорость изменения больше limit (ед./с)'),
+        (ROLLING_MEAN, 'Отклонение от среднего window значений больше limit'),
+        (STUCK, 'Размах window значений не больше limit (залипание)'),
+        (N_OF_M, 'Не меньше count из window значений больше limit'),
+    ]
+
+    tag = models.CharField('Идентификатор параметра', max_length=100)
+    rule_type = models.CharField('Тип правила', max_length=20, choices=RULE_TYPES)
+    window = models.PositiveIntegerField('Окно (значений)', default=10)
+    count = models.PositiveIntegerField('Количество нарушений в окне', default=1)
+    limit = models.FloatField('Порог')
+    is_active = models.BooleanField('Активно', default=True)
+    created_at = models.DateTimeField('Время создания', auto_now_add=True)
+    updated_at = models.DateTimeField('Время обновления', auto_now=True)
+
+    class Meta:
+        db_table = 'rules'
+        constraints = [
+            models.UniqueConstraint(fields=['tag', 'rule_type'], name='rules_tag_rule_type_key'),
+        ]
+        ordering = ['tag', 'rule_type']
+
+    def __str__(self):
+        return f"{self.tag} {self.rule_type}: {self.limit} (окно {self.window})"
+
+
 class Incident(models.Model):
     """Модель для хранения инцидентов нарушений уставок"""
     VIOLATION_TYPES = [
         ('min_violation', 'Нарушение минимума'),
         ('max_violation', 'Нарушение максимума'),
+    ] + Rule.RULE_TYPES
+    STATUS_OPEN = 'open'
+    STATUS_CLOSED = 'closed'
+    STATUSES = [
+        (STATUS_OPEN, 'Открыт'),
+        (STATUS_CLOSED, 'Закрыт'),
     ]
 
     tag = models.CharField('Идентификатор параметра', max_length=100)
     value = models.DecimalField('Значение', max_digits=10, decimal_places=3)
+    peak_value = models.DecimalField('Пиковое значение', max_digits=10, decimal_places=3, null=True, blank=True)
+    sample_count = models.IntegerField('Количество нарушений', default=1)
     threshold_min = models.DecimalField('Минимум уставки', max_digits=10, decimal_places=3, null=True, blank=True)
     threshold_max = models.DecimalField('Максимум уставки', max_digits=10, decimal_places=3, null=True, blank=True)
     violation_type = models.CharField('Тип нарушения', max_length=20, choices=VIOLATION_TYPES)
     timestamp = models.DateTimeField('Время нарушения')
+    last_seen = models.DateTimeField('Время последнего нарушения', null=True, blank=True)
+    ended_at = models.DateTimeField('Время закрытия', null=True, blank=True)
+    status = models.CharField('Статус', max_length=10, choices=STATUSES, default=STATUS_CLOSED)
     created_at = models.DateTimeField('Время создания', auto_now_add=True)
 
     class Meta:
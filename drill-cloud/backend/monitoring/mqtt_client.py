@@ -1,33 +1,205 @@
-import json
 import logging
-from datetime import datetime
-from decimal import Decimal
+import os
+import threading
+import zlib
+from functools import lru_cache
 from django.conf import settings
-from django.utils import timezone
+from django.db import close_old_connections, connection
 import paho.mqtt.client as mqtt
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
-from .models import SensorData, Threshold, Incident
+from .models import SensorData, Incident
+from .ingest import SensorDataWriter
+from .spool import open_spool
+from .metrics import (
+    MESSAGES_RECEIVED, MESSAGES_PARSED, MESSAGES_DROPPED, SAMPLES_PARSED, PARSE_SECONDS,
+    THRESHOLD_CHECK_SECONDS, register_ingest_metrics
+)
+from .thresholds import threshold_cache
+from .episodes import EVENT_OPEN, incident_engine
+from .rules import rule_engine
+from .health import report_worker_health
+from .db_pool import pool_stats
+from .ingest_log import ingest_log
+from .payloads import TOPIC_CACHE_SIZE, PayloadError, extract_frame_prefix, parse_sensor_samples
+from .rollups import update_rollups
+from .catalog import update_catalog
+from .latest import update_latest
+from .response_cache import bump_data_versions
+from .broadcast import (
+    broadcast_stats, signal_mode, sensor_data_bulk_saved,
+    broadcast_sensor_update, broadcast_incident_alert,
+    start_broadcast_scheduler, stop_broadcast_scheduler
+)
 
 logger = logging.getLogger(__name__)
 
+TELEMETRY_TOPICS = ["telemetry/#", "drill/+/sensor/+", "drill/+/frame"]
+
+# Способы распределения топиков между воркерами ingest
+PARTITION_HASH = 'hash'
+PARTITION_SHARE = 'share'
+
+
+def tag_partition(tag, workers):
+    """Номер воркера, обрабатывающего тег (стабилен между процессами)"""
+    return zlib.crc32(tag.encode('utf-8')) % workers
+
+
+def worker_client_id(worker_index, workers):
+    """Уникальный MQTT client id воркера"""
+    if workers <= 1:
+        return settings.MQTT_CLIENT_ID
+    return f"{settings.MQTT_CLIENT_ID}-{worker_index}"
+
+
+@lru_cache(maxsize=TOPIC_CACHE_SIZE)
+def extract_tag_from_topic(topic):
+    """Извлекает тег из MQTT топика"""
+    parts = topic.split('/')
+    
+    # Формат: telemetry/<tag>
+    if parts[0] == 'telemetry' and len(parts) == 2:
+        return parts[1]
+    
+    # Формат: drill/<equipment>/sensor/<sensor_type>
+    if parts[0] == 'drill' and len(parts) == 4 and parts[2] == 'sensor':
+        return f"{parts[1]}_{parts[3]}"
+    
+    return None
+
+
+@lru_cache(maxsize=TOPIC_CACHE_SIZE)
+def topic_pattern(topic):
+    """Шаблон топика из TELEMETRY_TOPICS для меток метрик"""
+    parts = topic.split('/')
+    if parts[0] == 'telemetry' and len(parts) == 2:
+        return 'telemetry/frame' if parts[1] == 'frame' else 'telemetry/+'
+    if parts[0] == 'drill' and len(parts) == 4 and parts[2] == 'sensor':
+        return 'drill/+/sensor/+'
+    if parts[0] == 'drill' and len(parts) == 3 and parts[2] == 'frame':
+        return 'drill/+/frame'
+    return 'other'
+
+
+def check_thresholds(sensor_data):
+    """Проверяет уставки для данных сенсора, возвращает созданный инцидент"""
+    try:
+        threshold = threshold_cache.get(sensor_data.tag)
+        if not threshold:
+            return None
+        
+        is_violated, violation_type = threshold.is_violated(sensor_data.value)
+        
+        if is_violated:
+            # Создаем инцидент
+            incident = Incident.objects.create(
+                tag=sensor_data.tag,
+                value=sensor_data.value,
+                threshold_min=threshold.min_value,
+                threshold_max=threshold.max_value,
+                violation_type=violation_type,
+                timestamp=sensor_data.timestamp
+            )
+            
+            logger.warning(f"Создан инцидент: {incident}")
+            return incident
+            
+    except Exception as e:
+        logger.error(f"Ошибка проверки уставок: {e}")
+    
+    return None
+
+
+def evaluate_thresholds(sensor_data):
+    """События инцидентов по значению: [(event, incident)]
+
+    С INCIDENT_EPISODES нарушения объединяются в эпизоды, иначе каждое
+    нарушение - отдельный инцидент.
+    """
+    if settings.INCIDENT_EPISODES:
+        return incident_engine.process(sensor_data)
+    incident = check_thresholds(sensor_data)
+    return [(EVENT_OPEN, incident)] if incident else []
+
+
+def evaluate_rules(batch):
+    """События инцидентов по правилам Rule для пачки (всегда эпизодами)"""
+    rule_engine.refresh()
+    events = []
+    with THRESHOLD_CHECK_SECONDS.labels('rules').time():
+        for rule, samples, violated in rule_engine.evaluate(batch):
+            events.extend(incident_engine.process_rule(rule, samples, violated))
+    return events
+
+
+def evaluate_batch_thresholds(batch):
+    """События инцидентов по уставкам для всех значений пачки"""
+    events = []
+    with THRESHOLD_CHECK_SECONDS.labels('thresholds').time():
+        for sensor_data in batch:
+            events.extend(evaluate_thresholds(sensor_data))
+    return events
+
+
+def sweep_incidents():
+    """Закрытие и сводки эпизодов по времени, без новых значений"""
+    if not incident_engine.episodes:
+        return []
+    # Вызывается по таймеру: соединение потока могло устареть
+    close_old_connections()
+    try:
+        return incident_engine.sweep()
+    except Exception as e:
+        logger.error(f"Ошибка проверки эпизодов по времени: {e}")
+        return []
+
 
 class MQTTClient:
-    """MQTT клиент для подписки на топики телеметрии"""
+    """MQTT клиент для подписки на топики телеметрии
+    
+    При запуске нескольких воркеров каждый обрабатывает свою часть тегов:
+    в режиме hash все воркеры подписаны на все топики и пропускают чужие
+    теги (порядок значений тега сохраняется, так как тег всегда попадает
+    в один воркер), в режиме share брокер сам раздает сообщения через
+    общую подписку $share/<MQTT_SHARE_GROUP>/..., порядок внутри тега при
+    этом гарантирован только в пределах одного воркера.
+    """
     
-    def __init__(self):
-        self.client = mqtt.Client(client_id=settings.MQTT_CLIENT_ID)
+    def __init__(self, worker_index=0, workers=1, partition=PARTITION_HASH, spool_name=None):
+        self.worker_index = worker_index
+        self.workers = workers
+        self.partition = partition
+        self.client_id = worker_client_id(worker_index, workers)
+        self.received = 0
+        self.client = mqtt.Client(client_id=self.client_id)
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
         self.client.on_disconnect = self.on_disconnect
+        self.writer = SensorDataWriter(
+            on_flush=self.process_batch, spool=open_spool(spool_name or self.client_id)
+        )
+        register_ingest_metrics(self.writer.queue.qsize, self.writer.forwarder)
+        self._sweeping = threading.Event()
+        self._sweeper = None
+    
+    def subscription_topics(self):
+        """Топики для подписки с учетом режима распределения"""
+        if self.workers > 1 and self.partition == PARTITION_SHARE:
+            return [f"$share/{settings.MQTT_SHARE_GROUP}/{t}" for t in TELEMETRY_TOPICS]
+        return TELEMETRY_TOPICS
+    
+    def owns_tag(self, tag):
+        """Обрабатывает ли этот воркер данный тег"""
+        if self.workers <= 1 or self.partition != PARTITION_HASH:
+            return True
+        return tag_partition(tag, self.workers) == self.worker_index
         
     def on_connect(self, client, userdata, flags, rc):
         """Обработчик подключения к MQTT брокеру"""
         if rc == 0:
-            logger.info("Успешно подключен к MQTT брокеру")
+            logger.info(f"Успешно подключен к MQTT брокеру ({self.client_id})")
             # Подписываемся на топики телеметрии
-            client.subscribe("telemetry/#")
-            client.subscribe("drill/+/sensor/+")
+            for topic in self.subscription_topics():
+                client.subscribe(topic)
         else:
             logger.error(f"Ошибка подключения к MQTT брокеру: {rc}")
     
@@ -37,165 +209,191 @@ class MQTTClient:
     
     def on_message(self, client, userdata, msg):
         """Обработчик входящих MQTT сообщений"""
+        pattern = topic_pattern(msg.topic)
         try:
-            topic = msg.topic
-            payload = json.loads(msg.payload.decode('utf-8'))
-            
-            logger.info(f"Получено сообщение из топика {topic}: {payload}")
-            
-            # Извлекаем тег из топика
-            tag = self.extract_tag_from_topic(topic)
-            if not tag:
-                logger.warning(f"Не удалось извлечь тег из топика: {topic}")
+            # Кадр с несколькими тегами или тег из топика
+            frame = extract_frame_prefix(msg.topic) is not None
+            tag = None if frame else self.extract_tag_from_topic(msg.topic)
+            if not frame and not tag:
+                MESSAGES_DROPPED.labels(pattern, 'no_tag').inc()
+                ingest_log.warning('no_tag', 'Не удалось извлечь тег из топика: %s', msg.topic)
                 return
             
-            # Извлекаем значение и время
-            value = payload.get('value')
-            timestamp_str = payload.get('timestamp')
-            
-            if value is None:
-                logger.warning(f"Отсутствует значение в payload: {payload}")
+            # Тег обрабатывает другой воркер
+            if tag and not self.owns_tag(tag):
                 return
+            self.received += 1
+            MESSAGES_RECEIVED.labels(pattern).inc()
             
-            # Парсим время
-            if timestamp_str:
-                try:
-                    timestamp = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
-                    timestamp = timezone.make_aware(timestamp)
-                except ValueError:
-                    logger.warning(f"Неверный формат времени: {timestamp_str}")
-                    timestamp = timezone.now()
-            else:
-                timestamp = timezone.now()
-            
-            # Сохраняем данные сенсора
-            sensor_data = SensorData.objects.create(
-                tag=tag,
-                value=Decimal(str(value)),
-                timestamp=timestamp
-            )
-            
-            # Отправляем данные через WebSocket
-            self.send_sensor_update(sensor_data)
-            
-            # Проверяем уставки
-            incident = self.check_thresholds(sensor_data)
-            if incident:
-                self.send_incident_alert(incident)
+            with PARSE_SECONDS.time():
+                samples = parse_sensor_samples(msg.topic, tag, msg.payload)
+            if not samples:
+                MESSAGES_DROPPED.labels(pattern, 'no_value').inc()
+                return
+            if frame:
+                # Теги кадра распределены между воркерами
+                samples = [s for s in samples if self.owns_tag(s.tag)]
+                if not samples:
+                    return
+            MESSAGES_PARSED.labels(pattern).inc()
+            SAMPLES_PARSED.labels(pattern).inc(len(samples))
+            # Ставим значения в очередь на пакетную запись
+            if self.writer.put_many(samples) < len(samples):
+                MESSAGES_DROPPED.labels(pattern, 'queue_full').inc()
             
-        except json.JSONDecodeError:
-            logger.error(f"Ошибка парсинга JSON: {msg.payload}")
+        except PayloadError:
+            MESSAGES_DROPPED.labels(pattern, 'invalid_payload').inc()
+            ingest_log.error('invalid_payload', 'Ошибка разбора payload: %s', msg.payload)
         except Exception as e:
-            logger.error(f"Ошибка обработки сообщения: {e}")
+            MESSAGES_DROPPED.labels(pattern, 'error').inc()
+            ingest_log.error('error', 'Ошибка обработки сообщения: %s', e)
     
-    def extract_tag_from_topic(self, topic):
-        """Извлекает тег из MQTT топика"""
-        parts = topic.split('/')
+    def process_batch(self, batch):
+        """Обработка пачки данных сенсоров после записи в БД"""
+        broadcast_stats.add_samples(len(batch))
+        if settings.ROLLUPS_ENABLED:
+            update_rollups(batch)
+        update_catalog(batch)
+        update_latest(batch)
+        bump_data_versions(batch)
+        ingest_mode = not signal_mode()
+        if not ingest_mode:
+            # Рассылку выполняют обработчики сигналов (monitoring/signals.py)
+            sensor_data_bulk_saved.send(sender=SensorData, batch=batch)
         
-        # Формат: telemetry/<tag>
-        if parts[0] == 'telemetry' and len(parts) == 2:
-            return parts[1]
-        
-        # Формат: drill/<equipment>/sensor/<sensor_type>
-        if parts[0] == 'drill' and len(parts) == 4 and parts[2] == 'sensor':
-            return f"{parts[1]}_{parts[3]}"
+        if ingest_mode:
+            # Отправляем данные через WebSocket
+            for sensor_data in batch:
+                self.send_sensor_update(sensor_data)
         
-        return None
+        # Проверяем уставки и правила
+        events = evaluate_batch_thresholds(batch)
+        events.extend(evaluate_rules(batch))
+        if ingest_mode:
+            for event, incident in events:
+                self.send_incident_alert(incident, event)
+
+    def start_sweeper(self):
+        """Поток закрытия эпизодов и сводок по таймеру
+
+        Без него эпизоды закрывались бы только с приходом новых пачек, и
+        при остановке приема открытые инциденты так и оставались бы открытыми.
+        """
+        if self._sweeper is not None:
+            return
+        self._sweeping.clear()
+        self._sweeper = threading.Thread(
+            target=self._sweep_loop, name='incident-sweeper', daemon=True
+        )
+        self._sweeper.start()
+
+    def stop_sweeper(self):
+        if self._sweeper is None:
+            return
+        self._sweeping.set()
+        self._sweeper.join()
+        self._sweeper = None
+
+    def _sweep_loop(self):
+        try:
+            while not self._sweeping.wait(settings.INCIDENT_SWEEP_INTERVAL):
+                events = sweep_incidents()
+                if not signal_mode():
+                    for event, incident in events:
+                        self.send_incident_alert(incident, event)
+        finally:
+            connection.close()
+    
+    def extract_tag_from_topic(self, topic):
+        """Извлекает тег из MQTT топика"""
+        return extract_tag_from_topic(topic)
     
     def check_thresholds(self, sensor_data):
         """Проверяет уставки для данных сенсора"""
-        try:
-            threshold = Threshold.objects.filter(tag=sensor_data.tag).first()
-            if not threshold:
-                return None
-            
-            is_violated, violation_type = threshold.is_violated(sensor_data.value)
-            
-            if is_violated:
-                # Создаем инцидент
-                incident = Incident.objects.create(
-                    tag=sensor_data.tag,
-                    value=sensor_data.value,
-                    threshold_min=threshold.min_value,
-                    threshold_max=threshold.max_value,
-                    violation_type=violation_type,
-                    timestamp=sensor_data.timestamp
-                )
-                
-                logger.warning(f"Создан инцидент: {incident}")
-                return incident
-                
-        except Exception as e:
-            logger.error(f"Ошибка проверки уставок: {e}")
-        
-        return None
+        return check_thresholds(sensor_data)
     
     def send_sensor_update(self, sensor_data):
         """Отправляет обновление сенсора через WebSocket"""
-        try:
-            channel_layer = get_channel_layer()
-            async_to_sync(channel_layer.group_send)(
-                f"sensor_{sensor_data.tag}",
-                {
-                    'type': 'sensor_update',
-                    'tag': sensor_data.tag,
-                    'data': {
-                        'timestamp': sensor_data.timestamp.isoformat(),
-                        'value': float(sensor_data.value),
-                        'tag': sensor_data.tag
-                    }
-                }
-            )
-            logger.info(f"Отправлено WebSocket обновление для {sensor_data.tag}")
-        except Exception as e:
-            logger.error(f"Ошибка отправки WebSocket обновления: {e}")
+        if broadcast_sensor_update(sensor_data):
+            ingest_log.broadcast(sensor_data.tag)
     
-    def send_incident_alert(self, incident):
+    def send_incident_alert(self, incident, event=None):
         """Отправляет уведомление об инциденте через WebSocket"""
-        try:
-            channel_layer = get_channel_layer()
-            async_to_sync(channel_layer.group_send)(
-                'incidents',
-                {
-                    'type': 'incident_alert',
-                    'incident': {
-                        'tag': incident.tag,
-                        'value': float(incident.value),
-                        'violation_type': incident.violation_type,
-                        'timestamp': incident.timestamp.isoformat()
-                    }
-                }
-            )
+        if broadcast_incident_alert(incident, event):
             logger.info(f"Отправлено WebSocket уведомление об инциденте {incident.tag}")
-        except Exception as e:
-            logger.error(f"Ошибка отправки WebSocket уведомления об инциденте: {e}")
     
     def connect(self):
         """Подключение к MQTT брокеру"""
         try:
+            threshold_cache.refresh(force=True)
+            incident_engine.load_open(self.owns_tag)
+            start_broadcast_scheduler()
+            self.writer.start()
+            self.start_sweeper()
             self.client.connect(settings.MQTT_BROKER, settings.MQTT_PORT, 60)
             self.client.loop_start()
         except Exception as e:
             logger.error(f"Ошибка подключения к MQTT брокеру: {e}")
     
+    def health(self):
+        """Состояние воркера для сводки supervisor"""
+        return {
+            'pid': os.getpid(),
+            'worker_index': self.worker_index,
+            'engine': 'thread',
+            'connected': self.client.is_connected(),
+            'received': self.received,
+            'written': self.writer.written,
+            'dropped': self.writer.dropped,
+            'queue_depth': self.writer.queue.qsize(),
+            'spool': self.writer.forwarder.stats() if self.writer.forwarder else None,
+            'db_pool': pool_stats(),
+            'broadcast': broadcast_stats.snapshot(),
+        }
+    
+    def report_health(self):
+        """Публикует состояние воркера в общий кеш и выводит сводку ingest"""
+        health = self.health()
+        report_worker_health(self.client_id, health)
+        ingest_log.summary(
+            {name: health[name] for name in ('received', 'written', 'dropped')},
+            queue_depth=health['queue_depth']
+        )
+    
     def disconnect(self):
         """Отключение от MQTT брокера"""
         self.client.loop_stop()
         self.client.disconnect()
+        # Дописываем в БД все, что успело попасть в очередь
+        self.writer.stop(timeout=settings.INGEST_SHUTDOWN_TIMEOUT)
+        self.stop_sweeper()
+        incident_engine.flush()
+        stop_broadcast_scheduler()
+        logger.info(
+            f"Ingest остановлен: записано {self.writer.written}, "
+            f"отброшено {self.writer.dropped}, "
+            f"рассылка: {broadcast_stats.snapshot()}"
+        )
 
 
 # Глобальный экземпляр MQTT клиента
 mqtt_client = None
 
 
-def start_mqtt_client():
+def start_mqtt_client(worker_index=0, workers=1, partition=PARTITION_HASH):
     """Запуск MQTT клиента"""
     global mqtt_client
     if mqtt_client is None:
-        mqtt_client = MQTTClient()
+        mqtt_client = MQTTClient(worker_index, workers, partition)
         mqtt_client.connect()
 
 
+def report_mqtt_health():
+    """Публикация состояния запущенного MQTT клиента"""
+    if mqtt_client:
+        mqtt_client.report_health()
+
+
 def stop_mqtt_client():
     """Остановка MQTT клиента"""
     global mqtt_client
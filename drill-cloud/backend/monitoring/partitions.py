@@ -0,0 +1,238 @@
+import re
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.db import connection, transaction
+
+SENSOR_TABLE = 'sensor_data'
+DEFAULT_PARTITION = f'{SENSOR_TABLE}_default'
+
+INTERVALS = ('day', 'week', 'month')
+VALUE_TYPES = ('real', 'double precision')
+
+_BOUND_RE = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+def is_partitioned(table=SENSOR_TABLE):
+    """Является ли таблица секционированной (time-series режим хранения)"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table p "
+            "JOIN pg_class c ON c.oid = p.partrelid "
+            "WHERE c.relname = %s AND pg_table_is_visible(c.oid)",
+            [table]
+        )
+        return cursor.fetchone() is not None
+
+
+def has_default_partition(table=SENSOR_TABLE):
+    """Есть ли у таблицы секция по умолчанию (DEFAULT)"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table p "
+            "JOIN pg_class c ON c.oid = p.partrelid "
+            "WHERE c.relname = %s AND pg_table_is_visible(c.oid) AND p.partdefid <> 0",
+            [table]
+        )
+        return cursor.fetchone() is not None
+
+
+def check_detach_concurrently(table=SENSOR_TABLE):
+    """ValueError, если DETACH PARTITION CONCURRENTLY сейчас невозможен
+
+    Postgres не выполняет его внутри транзакции и для таблицы с секцией
+    по умолчанию.
+    """
+    if connection.in_atomic_block:
+        raise ValueError('DETACH PARTITION CONCURRENTLY нельзя выполнить внутри транзакции')
+    if has_default_partition(table):
+        raise ValueError(
+            f'DETACH PARTITION CONCURRENTLY невозможен: у {table} есть секция по умолчанию '
+            f'(convert --no-default или DROP TABLE пустой {table}_default)'
+        )
+
+
+def period_start(moment, interval):
+    """Начало периода секции, содержащего момент (UTC)"""
+    moment = moment.astimezone(dt_timezone.utc)
+    start = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    if interval == 'week':
+        start -= timedelta(days=start.weekday())
+    elif interval == 'month':
+        start = start.replace(day=1)
+    return start
+
+
+def next_period(start, interval):
+    """Начало следующего периода"""
+    if interval == 'day':
+        return start + timedelta(days=1)
+    if interval == 'week':
+        return start + timedelta(weeks=1)
+    if start.month == 12:
+        return start.replace(year=start.year + 1, month=1)
+    return start.replace(month=start.month + 1)
+
+
+def partition_name(start, table=SENSOR_TABLE):
+    return f"{table}_p{start:%Y%m%d}"
+
+
+def list_partitions(table=SENSOR_TABLE):
+    """Секции таблицы: [(name, start, end, size_bytes)] по возрастанию start
+
+    Секция по умолчанию (без границ) не включается.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), "
+            "pg_total_relation_size(c.oid) "
+            "FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = %s",
+            [table]
+        )
+        rows = cursor.fetchall()
+
+    partitions = []
+    for name, bound, size in rows:
+        match = _BOUND_RE.search(bound or '')
+        if not match:
+            continue
+        start, end = (datetime.fromisoformat(v) for v in match.groups())
+        partitions.append((name, start, end, size))
+    return sorted(partitions, key=lambda p: p[1])
+
+
+def create_partitions(start, end, interval, table=SENSOR_TABLE):
+    """Создает недостающие секции, покрывающие [start, end). Возвращает имена
+
+    Периоды, пересекающиеся с существующими секциями (например, созданными
+    с другим интервалом), пропускаются. Строки периода, уже попавшие в
+    секцию по умолчанию, переносятся в новую секцию: иначе Postgres не дал
+    бы ее создать.
+    """
+    existing = [(p[1], p[2]) for p in list_partitions(table)]
+    default = has_default_partition(table)
+    created = []
+    period = period_start(start, interval)
+    while period < end:
+        upper = next_period(period, interval)
+        if not any(lower < upper and period < bound for lower, bound in existing):
+            name = partition_name(period, table)
+            with transaction.atomic(), connection.cursor() as cursor:
+                if default and _default_has_rows(cursor, period, upper, table):
+                    _move_from_default(cursor, name, period, upper, table)
+                else:
+                    cursor.execute(
+                        f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{table}" '
+                        f"FOR VALUES FROM (%s) TO (%s)",
+                        [period, upper]
+                    )
+            created.append(name)
+        period = upper
+    return created
+
+
+def _default_has_rows(cursor, start, end, table):
+    cursor.execute(
+        f'SELECT 1 FROM "{table}_default" WHERE timestamp >= %s AND timestamp < %s LIMIT 1',
+        [start, end]
+    )
+    return cursor.fetchone() is not None
+
+
+def _move_from_default(cursor, name, start, end, table):
+    """Создает секцию из строк периода, попавших в секцию по умолчанию
+
+    Таблица заполняется строками, удаленными из секции по умолчанию, и
+    присоединяется к sensor_data (индексы создаются при присоединении).
+    Выполняется в транзакции вызывающего кода.
+    """
+    cursor.execute(f'CREATE TABLE "{name}" (LIKE "{table}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+    cursor.execute(
+        f'WITH moved AS (DELETE FROM "{table}_default" WHERE timestamp >= %s AND timestamp < %s '
+        f'RETURNING *) INSERT INTO "{name}" SELECT * FROM moved',
+        [start, end]
+    )
+    cursor.execute(
+        f'ALTER TABLE "{table}" ATTACH PARTITION "{name}" FOR VALUES FROM (%s) TO (%s)',
+        [start, end]
+    )
+
+
+def detach_partition(name, drop=False, concurrently=False, table=SENSOR_TABLE):
+    """Отсоединяет секцию от таблицы и при необходимости удаляет ее
+
+    CONCURRENTLY не держит блокировку таблицы на время отсоединения, но не
+    может выполняться внутри транзакции и при наличии секции по умолчанию
+    (тогда ValueError, см. check_detach_concurrently).
+    """
+    if concurrently:
+        check_detach_concurrently(table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'ALTER TABLE "{table}" DETACH PARTITION "{name}"'
+            + (' CONCURRENTLY' if concurrently else '')
+        )
+        if drop:
+            cursor.execute(f'DROP TABLE "{name}"')
+
+
+def convert_to_partitioned(interval, value_type='real', ahead=7, keep_legacy=False, default=True):
+    """Переводит sensor_data в секционированную по времени таблицу
+
+    Существующие строки переносятся в новые секции. Одиночный индекс по
+    tag не создается (его покрывает индекс tag+timestamp), индекс по времени
+    заменяется на BRIN. default=False - без секции по умолчанию: строки вне
+    созданных секций отклоняются, зато доступен DETACH PARTITION
+    CONCURRENTLY. Рассчитано на схему из drill-infra/init-db.sql
+    (id SERIAL с последовательностью sensor_data_id_seq). Возвращает
+    количество перенесенных строк.
+    """
+    legacy = f'{SENSOR_TABLE}_legacy'
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'LOCK TABLE "{SENSOR_TABLE}" IN ACCESS EXCLUSIVE MODE')
+        cursor.execute(f'ALTER TABLE "{SENSOR_TABLE}" RENAME TO "{legacy}"')
+        for index in ('idx_sensor_data_timestamp', 'idx_sensor_data_tag', 'idx_sensor_data_tag_timestamp'):
+            cursor.execute(f'DROP INDEX IF EXISTS "{index}"')
+        cursor.execute(
+            f'ALTER TABLE "{legacy}" RENAME CONSTRAINT "{SENSOR_TABLE}_pkey" TO "{legacy}_pkey"'
+        )
+        cursor.execute(f'''
+            CREATE TABLE "{SENSOR_TABLE}" (
+                id BIGINT NOT NULL DEFAULT nextval('sensor_data_id_seq'),
+                timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
+                tag VARCHAR(100) NOT NULL,
+                value {value_type} NOT NULL,
+                created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (id, timestamp)
+            ) PARTITION BY RANGE (timestamp)
+        ''')
+        cursor.execute(
+            f'CREATE INDEX idx_sensor_data_timestamp_brin ON "{SENSOR_TABLE}" USING BRIN (timestamp)'
+        )
+        cursor.execute(
+            f'CREATE INDEX idx_sensor_data_tag_timestamp ON "{SENSOR_TABLE}" (tag, timestamp)'
+        )
+        if default:
+            cursor.execute(f'CREATE TABLE "{DEFAULT_PARTITION}" PARTITION OF "{SENSOR_TABLE}" DEFAULT')
+
+        now = datetime.now(dt_timezone.utc)
+        cursor.execute(f'SELECT min(timestamp), max(timestamp) FROM "{legacy}"')
+        oldest, newest = cursor.fetchone()
+        end = now + timedelta(days=ahead)
+        if newest is not None and newest >= end:
+            end = newest + timedelta(seconds=1)
+        create_partitions(oldest or now, end, interval)
+
+        cursor.execute(
+            f'INSERT INTO "{SENSOR_TABLE}" (id, timestamp, tag, value, created_at) '
+            f'SELECT id, timestamp, tag, value, created_at FROM "{legacy}"'
+        )
+        moved = cursor.rowcount
+        cursor.execute(
+            f'ALTER SEQUENCE sensor_data_id_seq AS BIGINT OWNED BY "{SENSOR_TABLE}".id'
+        )
+        if not keep_legacy:
+            cursor.execute(f'DROP TABLE "{legacy}"')
+    return moved
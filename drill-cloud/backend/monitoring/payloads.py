@@ -0,0 +1,165 @@
+import json
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+import msgpack
+from django.utils import timezone
+from .models import SensorData
+from .ingest_log import ingest_log
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Размер кеша разбора топиков (тег, префикс кадра, шаблон)
+TOPIC_CACHE_SIZE = 65536
+
+# Пределы колонок sensor_data: значения за ними Postgres отклонит
+_value_field = SensorData._meta.get_field('value')
+MAX_ABS_VALUE = Decimal(10) ** (_value_field.max_digits - _value_field.decimal_places)
+MAX_TAG_LENGTH = SensorData._meta.get_field('tag').max_length
+
+
+class PayloadError(ValueError):
+    """Payload не удалось декодировать (ни JSON, ни MessagePack)"""
+
+
+@lru_cache(maxsize=TOPIC_CACHE_SIZE)
+def extract_frame_prefix(topic):
+    """Префикс тегов кадра с несколькими тегами или None, если топик не кадра
+
+    telemetry/frame - имена тегов как есть, drill/<equipment>/frame -
+    <equipment>_<имя>, как у drill/<equipment>/sensor/<sensor_type>.
+    """
+    parts = topic.split('/')
+    if parts[0] == 'telemetry' and len(parts) == 2 and parts[1] == 'frame':
+        return ''
+    if parts[0] == 'drill' and len(parts) == 3 and parts[2] == 'frame':
+        return f"{parts[1]}_"
+    return None
+
+
+def decode_payload(raw_payload):
+    """JSON или MessagePack (определяется по первому байту)
+
+    JSON документ начинается с ASCII символа, а map и array MessagePack -
+    с байта 0x80 и выше. JSON разбирается orjson, если он установлен.
+    Временные метки MessagePack (ext -1) приходят как datetime UTC.
+    """
+    try:
+        if raw_payload[:1] >= b'\x80':
+            return msgpack.unpackb(raw_payload, raw=False, timestamp=3)
+        if orjson is not None:
+            return orjson.loads(raw_payload)
+        return json.loads(raw_payload)
+    except (ValueError, msgpack.UnpackException) as e:
+        raise PayloadError(str(e)) from e
+
+
+def parse_timestamp(value):
+    """Время значения: ISO 8601 (с зоной или без - тогда TIME_ZONE),
+    epoch в миллисекундах или datetime; иначе текущее время"""
+    if isinstance(value, str):
+        if value[-1:] == 'Z':
+            value = value[:-1] + '+00:00'
+        try:
+            timestamp = datetime.fromisoformat(value)
+        except ValueError:
+            ingest_log.warning('bad_timestamp', 'Неверный формат времени: %s', value)
+            return timezone.now()
+        if timestamp.tzinfo is None:
+            return timezone.make_aware(timestamp)
+        return timestamp
+    if type(value) is int or type(value) is float:
+        try:
+            return datetime.fromtimestamp(value / 1000, dt_timezone.utc)
+        except (ValueError, OverflowError, OSError):
+            ingest_log.warning('bad_timestamp', 'Неверный формат времени: %s', value)
+            return timezone.now()
+    if isinstance(value, datetime):
+        return value if value.tzinfo is not None else timezone.make_aware(value)
+    if value:
+        ingest_log.warning('bad_timestamp', 'Неверный формат времени: %s', value)
+    return timezone.now()
+
+
+def make_sample(tag, value, timestamp):
+    """SensorData или None, если значения нет или оно не поместится в
+    sensor_data (NaN, бесконечность, вне DECIMAL, длинный тег); timestamp уже разобран"""
+    if len(tag) > MAX_TAG_LENGTH:
+        ingest_log.warning('bad_tag', 'Тег длиннее %d символов: %s', MAX_TAG_LENGTH, tag)
+        return None
+    if type(value) is int:
+        value = Decimal(value)
+    elif value is None:
+        ingest_log.warning('no_value', 'Отсутствует значение тега %s', tag)
+        return None
+    else:
+        try:
+            value = Decimal(str(value))
+        except InvalidOperation:
+            ingest_log.warning('bad_value', 'Неверное значение тега %s: %s', tag, value)
+            return None
+    if not value.is_finite() or abs(value) >= MAX_ABS_VALUE:
+        ingest_log.warning('bad_value', 'Значение тега %s вне допустимого диапазона: %s', tag, value)
+        return None
+    return SensorData(tag=tag, value=value, timestamp=timestamp)
+
+
+def tag_samples(tag, payload):
+    """Значения тега топика
+
+    Один объект {"value", "timestamp"}, массив таких объектов или массив
+    пар [timestamp, value].
+    """
+    if type(payload) is dict:
+        # Одно значение - самый частый случай
+        sample = make_sample(tag, payload.get('value'), parse_timestamp(payload.get('timestamp')))
+        return [sample] if sample is not None else []
+
+    items = payload if isinstance(payload, list) else [payload]
+    samples = []
+    for item in items:
+        if isinstance(item, dict):
+            sample = make_sample(tag, item.get('value'), parse_timestamp(item.get('timestamp')))
+        elif isinstance(item, (list, tuple)) and len(item) == 2:
+            sample = make_sample(tag, item[1], parse_timestamp(item[0]))
+        else:
+            ingest_log.warning('bad_sample', 'Неверный формат значения тега %s: %s', tag, item)
+            continue
+        if sample is not None:
+            samples.append(sample)
+    return samples
+
+
+def frame_samples(prefix, payload):
+    """Значения кадра {"t": timestamp, "tags": {имя: значение}} или массива кадров"""
+    frames = payload if isinstance(payload, list) else [payload]
+    samples = []
+    for frame in frames:
+        tags = frame.get('tags') if isinstance(frame, dict) else None
+        if not isinstance(tags, dict):
+            ingest_log.warning('bad_sample', 'Неверный формат кадра: %s', frame)
+            continue
+        timestamp = parse_timestamp(frame.get('t', frame.get('timestamp')))
+        for name, value in tags.items():
+            sample = make_sample(f"{prefix}{name}", value, timestamp)
+            if sample is not None:
+                samples.append(sample)
+    return samples
+
+
+def parse_sensor_samples(topic, tag, raw_payload):
+    """Разбирает payload сообщения в список несохраненных SensorData
+
+    tag - тег топика, для топика кадра - None. Значения без value
+    пропускаются. Если payload не декодируется, бросает PayloadError.
+    """
+    payload = decode_payload(raw_payload)
+    ingest_log.message(topic, tag, payload)
+
+    prefix = extract_frame_prefix(topic) if tag is None else None
+    if prefix is not None:
+        return frame_samples(prefix, payload)
+    return tag_samples(tag, payload)
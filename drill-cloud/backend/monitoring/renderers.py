@@ -0,0 +1,40 @@
+import msgpack
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+# Форматы, в которых ряды отдаются в колоночном виде {"tag", "t", "v"}
+COMPACT_FORMATS = ('columnar', 'msgpack')
+
+
+class ColumnarJSONRenderer(JSONRenderer):
+    """JSON с колоночным представлением рядов (?format=columnar)"""
+    media_type = 'application/vnd.drill.columnar+json'
+    format = 'columnar'
+
+
+class MessagePackRenderer(BaseRenderer):
+    """MessagePack с колоночным представлением рядов (?format=msgpack)"""
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, use_bin_type=True)
+
+
+def is_compact(request):
+    """Запрошен ли колоночный формат (content negotiation или ?format=)"""
+    renderer = getattr(request, 'accepted_renderer', None)
+    return renderer is not None and renderer.format in COMPACT_FORMATS
+
+
+def epoch_ms(timestamp):
+    """Время в миллисекундах Unix epoch"""
+    return int(timestamp.timestamp() * 1000)
+
+
+def columnar(tag, timestamps, values, **columns):
+    """Ряд тега в колоночном виде: время в мс epoch, значения float"""
+    return {'tag': tag, 't': timestamps, 'v': values, **columns}
@@ -0,0 +1,149 @@
+import hashlib
+import logging
+import redis
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
+from .latest import get_redis
+from .thresholds import THRESHOLDS_VERSION_KEY
+from .metrics import RESPONSE_CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+# Версии данных: любая запись, запись тега, появление нового тега в каталоге
+DATA_VERSION_KEY = 'monitoring:data:version'
+TAG_VERSION_KEY_PREFIX = 'monitoring:data:version:'
+CATALOG_VERSION_KEY = 'monitoring:catalog:version'
+RESPONSE_KEY_PREFIX = 'monitoring:response:'
+
+# Теги, уже учтенные в версии каталога этим процессом
+_known_tags = set()
+
+
+def thresholds_version_key():
+    """Ключ версии уставок в Redis (счетчик ведется через кеш Django)"""
+    return cache.make_key(THRESHOLDS_VERSION_KEY)
+
+
+def tag_version_key(tag):
+    return TAG_VERSION_KEY_PREFIX + tag
+
+
+def bump_data_versions(batch):
+    """Увеличивает версии данных после записи пачки одним конвейером Redis
+
+    Закешированные ответы со старыми версиями больше не выдаются и
+    удаляются Redis по истечении TTL.
+    """
+    tags = {sensor_data.tag for sensor_data in batch}
+    if not tags:
+        return
+    new_tags = tags - _known_tags
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.incr(DATA_VERSION_KEY)
+        for tag in tags:
+            pipe.incr(tag_version_key(tag))
+        if new_tags:
+            pipe.incr(CATALOG_VERSION_KEY)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.error(f"Ошибка обновления версий данных: {e}")
+        return
+    _known_tags.update(new_tags)
+
+
+def make_etag(content):
+    return f'"{hashlib.blake2b(content, digest_size=16).hexdigest()}"'
+
+
+def etag_matches(request, etag):
+    """Совпадает ли ETag с заголовком If-None-Match запроса"""
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    etags = parse_etags(header)
+    return '*' in etags or etag in etags or f'W/{etag}' in etags
+
+
+class CachedResponseMixin:
+    """Кеш ответов GET в Redis с ETag для ViewSet
+
+    cached_actions - {действие: (имя в метриках, настройка TTL)}. Ключ
+    ответа строится из хоста, пути с параметрами, заголовка Accept и
+    текущих версий из cache_version_keys(): запись уставок или данных тега
+    меняет версию, и следующий запрос идет в БД. Попадание отдается без
+    DRF и без обращения к БД; при совпадении If-None-Match - 304 без тела.
+    Если Redis недоступен, запрос обрабатывается как обычно.
+    """
+
+    cached_actions = {}
+
+    def cache_version_keys(self, action, request):
+        """Ключи версий, от которых зависит ответ действия"""
+        return []
+
+    def dispatch(self, request, *args, **kwargs):
+        action = self.action_map.get(request.method.lower()) if request.method == 'GET' else None
+        options = self.cached_actions.get(action)
+        if options is None or not settings.RESPONSE_CACHE_ENABLED:
+            return super().dispatch(request, *args, **kwargs)
+        endpoint, ttl_setting = options
+
+        try:
+            client = get_redis()
+            version_keys = self.cache_version_keys(action, request)
+            versions = client.mget(version_keys) if version_keys else []
+            key = self.response_cache_key(endpoint, request, versions)
+            entry = client.get(key)
+        except redis.RedisError as e:
+            logger.error(f"Ошибка чтения кеша ответов: {e}")
+            return super().dispatch(request, *args, **kwargs)
+
+        if entry is not None:
+            etag, content_type, content = entry.split(b'\n', 2)
+            etag = etag.decode()
+            if etag_matches(request, etag):
+                RESPONSE_CACHE_REQUESTS.labels(endpoint, 'not_modified').inc()
+                return self.cache_headers(HttpResponseNotModified(), etag, 'HIT')
+            RESPONSE_CACHE_REQUESTS.labels(endpoint, 'hit').inc()
+            response = HttpResponse(content, content_type=content_type.decode())
+            return self.cache_headers(response, etag, 'HIT')
+
+        RESPONSE_CACHE_REQUESTS.labels(endpoint, 'miss').inc()
+        response = super().dispatch(request, *args, **kwargs)
+        if response.status_code != 200 or response.streaming:
+            return response
+        if hasattr(response, 'render'):
+            response.render()
+        etag = make_etag(response.content)
+        content_type = response.get('Content-Type', '')
+        try:
+            client.set(
+                key, b'\n'.join((etag.encode(), content_type.encode(), response.content)),
+                ex=getattr(settings, ttl_setting)
+            )
+        except redis.RedisError as e:
+            logger.error(f"Ошибка записи кеша ответов: {e}")
+        if etag_matches(request, etag):
+            return self.cache_headers(HttpResponseNotModified(), etag, 'MISS')
+        return self.cache_headers(response, etag, 'MISS')
+
+    def response_cache_key(self, endpoint, request, versions):
+        digest = hashlib.blake2b(digest_size=16)
+        for part in (request.get_host(), request.get_full_path(), request.META.get('HTTP_ACCEPT', '')):
+            digest.update(part.encode())
+            digest.update(b'\0')
+        for version in versions:
+            digest.update(version or b'0')
+            digest.update(b'\0')
+        return f'{RESPONSE_KEY_PREFIX}{endpoint}:{digest.hexdigest()}'
+
+    def cache_headers(self, response, etag, result):
+        # no-cache: браузер хранит ответ, но каждый раз сверяет ETag
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        response['Vary'] = 'Accept'
+        response['X-Cache'] = result
+        return response
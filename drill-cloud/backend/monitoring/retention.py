@@ -0,0 +1,251 @@
+import logging
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db import connection, transaction, OperationalError
+from .models import SensorTag
+from .partitions import SENSOR_TABLE, is_partitioned, list_partitions, detach_partition
+
+logger = logging.getLogger(__name__)
+
+MONTH = timedelta(days=30)
+
+# Пачка удаляется по id из подзапроса с LIMIT; внешнее условие повторяет
+# внутреннее, чтобы в секционированной таблице отсекались лишние секции
+_DELETE_SQL = 'DELETE FROM "{table}" WHERE {where} AND id IN (SELECT id FROM "{table}" WHERE {where} LIMIT %s)'
+_COUNT_SQL = 'SELECT count(*) FROM "{table}" WHERE {where}'
+
+# Различные теги таблицы по индексу, начинающемуся с tag: по одному
+# переходу в индексе на тег вместо чтения всех строк (SELECT DISTINCT)
+_DISTINCT_TAGS_SQL = """
+    WITH RECURSIVE tags AS (
+        (SELECT tag FROM "{table}" ORDER BY tag LIMIT 1)
+        UNION ALL
+        SELECT (SELECT tag FROM "{table}" WHERE tag > tags.tag ORDER BY tag LIMIT 1)
+        FROM tags WHERE tags.tag IS NOT NULL
+    )
+    SELECT tag FROM tags WHERE tag IS NOT NULL
+"""
+
+# Средний размер строки с индексами: размер таблицы (и ее секций) на число строк
+_ROW_SIZE_SQL = """
+    SELECT coalesce(sum(pg_total_relation_size(c.oid)), 0), coalesce(sum(greatest(c.reltuples, 0)), 0)
+    FROM pg_class c
+    WHERE c.oid = %s::regclass
+       OR c.oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = %s::regclass)
+"""
+
+
+class RetentionPolicy:
+    """Сроки хранения тега или префикса (pattern вида "pressure_*")"""
+
+    def __init__(self, pattern, raw_days, rollup_months):
+        self.pattern = pattern
+        self.raw_days = raw_days
+        self.rollup_months = rollup_months
+
+    @property
+    def is_prefix(self):
+        return self.pattern.endswith('*')
+
+    def matches(self, tag):
+        if self.is_prefix:
+            return tag.startswith(self.pattern[:-1])
+        return tag == self.pattern
+
+    def __str__(self):
+        return f"{self.pattern}: сырые {self.raw_days} дн., агрегаты {self.rollup_months} мес."
+
+
+def load_policies():
+    """Политики из RETENTION_POLICIES"""
+    policies = []
+    for pattern, days in settings.RETENTION_POLICIES.items():
+        raw_days = days[0]
+        rollup_months = days[1] if len(days) > 1 else settings.RETENTION_ROLLUP_MONTHS
+        policies.append(RetentionPolicy(pattern, raw_days, rollup_months))
+    return policies
+
+
+def default_policy():
+    return RetentionPolicy('*', settings.RETENTION_RAW_DAYS, settings.RETENTION_ROLLUP_MONTHS)
+
+
+class RetentionReport:
+    """Удаленные строки и освобожденный объем по таблицам"""
+
+    def __init__(self):
+        self.tables = {}
+
+    def add(self, table, rows=0, size=0):
+        entry = self.tables.setdefault(table, [0, 0])
+        entry[0] += rows
+        entry[1] += size
+
+    @property
+    def rows(self):
+        return sum(entry[0] for entry in self.tables.values())
+
+    @property
+    def size(self):
+        return sum(entry[1] for entry in self.tables.values())
+
+
+class RetentionManager:
+    """Удаление устаревших сырых данных, агрегатов и инцидентов
+
+    Сырые данные тега хранятся raw_days его политики, агрегаты 1s - столько
+    же, агрегаты 1m и 1h - rollup_months. Если sensor_data секционирована,
+    секции старше самого длинного срока сырых данных отсоединяются и
+    удаляются целиком; остальное удаляется пачками по RETENTION_BATCH_SIZE
+    строк в отдельных коротких транзакциях с паузой между ними. Теги
+    берутся из самих sensor_data и sensor_rollups (и каталога sensor_tags),
+    поэтому устаревают и данные тегов, которых нет в каталоге. Инциденты
+    удаляются только закрытые.
+
+    Освобожденный объем удаленных секций точный, для удаленных строк -
+    оценка по среднему размеру строки: место становится доступным для
+    новых строк после VACUUM (autovacuum), размер файлов не уменьшается.
+    """
+
+    def __init__(self, policies=None, default=None, incident_days=None,
+                 batch_size=None, pause=None, dry_run=False):
+        # Сначала точные теги, затем более длинные префиксы
+        self.policies = sorted(
+            load_policies() if policies is None else policies,
+            key=lambda p: (p.is_prefix, -len(p.pattern))
+        )
+        self.default = default or default_policy()
+        self.incident_days = settings.RETENTION_INCIDENT_DAYS if incident_days is None else incident_days
+        self.batch_size = batch_size or settings.RETENTION_BATCH_SIZE
+        self.pause = settings.RETENTION_BATCH_PAUSE if pause is None else pause
+        self.dry_run = dry_run
+
+    def policy_for(self, tag):
+        for policy in self.policies:
+            if policy.matches(tag):
+                return policy
+        return self.default
+
+    def run(self, now=None):
+        """Применяет политики ко всем таблицам. Возвращает RetentionReport"""
+        now = now or datetime.now(dt_timezone.utc)
+        report = RetentionReport()
+        raw_cutoffs = {}
+        rollup_cutoffs = {}
+        for tag in self.tags():
+            policy = self.policy_for(tag)
+            raw_cutoffs.setdefault(now - timedelta(days=policy.raw_days), []).append(tag)
+            rollup_cutoffs.setdefault(now - MONTH * policy.rollup_months, []).append(tag)
+
+        # Строки удаленных секций уже не нужно перебирать
+        dropped_until = None
+        if is_partitioned():
+            longest = max([self.default] + self.policies, key=lambda p: p.raw_days)
+            dropped_until = self.drop_partitions(now - timedelta(days=longest.raw_days), report)
+        for cutoff, tags in sorted(raw_cutoffs.items()):
+            if dropped_until is None:
+                self.delete(
+                    SENSOR_TABLE, 'tag = ANY(%s) AND timestamp < %s', [tags, cutoff], report
+                )
+            else:
+                self.delete(
+                    SENSOR_TABLE, 'tag = ANY(%s) AND timestamp >= %s AND timestamp < %s',
+                    [tags, dropped_until, cutoff], report
+                )
+            self.delete(
+                'sensor_rollups', "tag = ANY(%s) AND resolution = '1s' AND bucket < %s",
+                [tags, cutoff], report
+            )
+        for cutoff, tags in sorted(rollup_cutoffs.items()):
+            self.delete(
+                'sensor_rollups', "tag = ANY(%s) AND resolution IN ('1m', '1h') AND bucket < %s",
+                [tags, cutoff], report
+            )
+        self.delete(
+            'incidents', "status = 'closed' AND timestamp < %s",
+            [now - timedelta(days=self.incident_days)], report
+        )
+        return report
+
+    def tags(self):
+        """Все теги, у которых есть сырые данные, агрегаты или запись в каталоге"""
+        tags = set(SensorTag.objects.values_list('tag', flat=True))
+        with connection.cursor() as cursor:
+            for table in (SENSOR_TABLE, 'sensor_rollups'):
+                cursor.execute(_DISTINCT_TAGS_SQL.format(table=table))
+                tags.update(row[0] for row in cursor.fetchall())
+        return sorted(tags)
+
+    def drop_partitions(self, cutoff, report):
+        """Отсоединяет и удаляет секции sensor_data, целиком старше cutoff
+
+        Возвращает конец последней удаленной секции или None.
+        """
+        dropped_until = None
+        for name, start, end, size in list_partitions():
+            if end > cutoff:
+                break
+            rows = self.estimate_rows(name)
+            if self.dry_run:
+                report.add(SENSOR_TABLE, rows, size)
+                dropped_until = end
+                continue
+            try:
+                with transaction.atomic(), connection.cursor() as cursor:
+                    cursor.execute(f"SET LOCAL lock_timeout = '{settings.RETENTION_LOCK_TIMEOUT}'")
+                    detach_partition(name, drop=True)
+            except OperationalError as e:
+                # Таблица занята - секция удалится при следующем запуске
+                logger.warning(f"Секция {name} не удалена: {e}")
+                break
+            report.add(SENSOR_TABLE, rows, size)
+            dropped_until = end
+            logger.info(f"Удалена секция {name} ({start:%Y-%m-%d} - {end:%Y-%m-%d})")
+        return dropped_until
+
+    def delete(self, table, where, params, report):
+        """Удаляет строки пачками, каждая пачка - отдельная транзакция"""
+        if self.dry_run:
+            with connection.cursor() as cursor:
+                cursor.execute(_COUNT_SQL.format(table=table, where=where), params)
+                rows = cursor.fetchone()[0]
+            report.add(table, rows, int(rows * self.row_size(table)))
+            return rows
+
+        sql = _DELETE_SQL.format(table=table, where=where)
+        row_size = self.row_size(table)
+        total = 0
+        while True:
+            try:
+                with transaction.atomic(), connection.cursor() as cursor:
+                    cursor.execute(f"SET LOCAL lock_timeout = '{settings.RETENTION_LOCK_TIMEOUT}'")
+                    cursor.execute(sql, params + params + [self.batch_size])
+                    deleted = cursor.rowcount
+            except OperationalError as e:
+                logger.warning(f"Удаление из {table} прервано: {e}")
+                break
+            total += deleted
+            if deleted < self.batch_size:
+                break
+            time.sleep(self.pause)
+        report.add(table, total, int(total * row_size))
+        return total
+
+    def row_size(self, table):
+        with connection.cursor() as cursor:
+            cursor.execute(_ROW_SIZE_SQL, [table, table])
+            size, rows = cursor.fetchone()
+        return size / rows if rows else 0
+
+    def estimate_rows(self, table):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT greatest(reltuples, 0) FROM pg_class WHERE oid = %s::regclass", [table])
+            row = cursor.fetchone()
+        return int(row[0]) if row else 0
+
+    def vacuum(self, tables):
+        """VACUUM ANALYZE таблиц после удаления (вне транзакции)"""
+        with connection.cursor() as cursor:
+            for table in tables:
+                cursor.execute(f'VACUUM (ANALYZE) "{table}"')
@@ -0,0 +1,130 @@
+import logging
+from datetime import timedelta, timezone as dt_timezone
+from psycopg2.extras import execute_values
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+# Разрешения агрегатов от мелкого к крупному: длительность и единица date_trunc
+RESOLUTIONS = {
+    '1s': (timedelta(seconds=1), 'second'),
+    '1m': (timedelta(minutes=1), 'minute'),
+    '1h': (timedelta(hours=1), 'hour'),
+}
+
+_UPSERT_SQL = """
+    INSERT INTO sensor_rollups AS r
+        (tag, resolution, bucket, min_value, max_value, sum_value, count, last_value, last_timestamp)
+    VALUES %s
+    ON CONFLICT (tag, resolution, bucket) DO UPDATE SET
+        min_value = LEAST(r.min_value, EXCLUDED.min_value),
+        max_value = GREATEST(r.max_value, EXCLUDED.max_value),
+        sum_value = r.sum_value + EXCLUDED.sum_value,
+        count = r.count + EXCLUDED.count,
+        last_value = CASE WHEN EXCLUDED.last_timestamp >= r.last_timestamp
+                          THEN EXCLUDED.last_value ELSE r.last_value END,
+        last_timestamp = GREATEST(r.last_timestamp, EXCLUDED.last_timestamp)
+"""
+
+_REBUILD_SQL = """
+    INSERT INTO sensor_rollups
+        (tag, resolution, bucket, min_value, max_value, sum_value, count, last_value, last_timestamp)
+    SELECT tag, %s, date_trunc(%s, timestamp) AS bucket,
+           min(value), max(value), sum(value::double precision), count(*),
+           (array_agg(value ORDER BY timestamp DESC))[1], max(timestamp)
+    FROM sensor_data
+    WHERE timestamp >= %s AND timestamp < %s {tag_filter}
+    GROUP BY tag, bucket
+    ON CONFLICT (tag, resolution, bucket) DO UPDATE SET
+        min_value = EXCLUDED.min_value,
+        max_value = EXCLUDED.max_value,
+        sum_value = EXCLUDED.sum_value,
+        count = EXCLUDED.count,
+        last_value = EXCLUDED.last_value,
+        last_timestamp = EXCLUDED.last_timestamp
+"""
+
+
+def bucket_start(timestamp, resolution):
+    """Начало интервала агрегата, содержащего момент (UTC)"""
+    timestamp = timestamp.astimezone(dt_timezone.utc).replace(microsecond=0)
+    if resolution in ('1m', '1h'):
+        timestamp = timestamp.replace(second=0)
+    if resolution == '1h':
+        timestamp = timestamp.replace(minute=0)
+    return timestamp
+
+
+def aggregate_batch(batch):
+    """Агрегаты пачки SensorData: (tag, resolution, bucket) -> [min, max, sum, count, last, last_ts]"""
+    aggregates = {}
+    for sensor_data in batch:
+        value = float(sensor_data.value)
+        timestamp = sensor_data.timestamp
+        for resolution in RESOLUTIONS:
+            key = (sensor_data.tag, resolution, bucket_start(timestamp, resolution))
+            agg = aggregates.get(key)
+            if agg is None:
+                aggregates[key] = [value, value, value, 1, value, timestamp]
+                continue
+            if value < agg[0]:
+                agg[0] = value
+            if value > agg[1]:
+                agg[1] = value
+            agg[2] += value
+            agg[3] += 1
+            if timestamp >= agg[5]:
+                agg[4] = value
+                agg[5] = timestamp
+    return aggregates
+
+
+def update_rollups(batch):
+    """Добавляет значения записанной пачки в агрегаты всех разрешений"""
+    aggregates = aggregate_batch(batch)
+    if not aggregates:
+        return
+    # Сортировка по ключу - одинаковый порядок блокировок строк у всех воркеров
+    rows = [(*key, *agg) for key, agg in sorted(aggregates.items())]
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            execute_values(cursor.cursor, _UPSERT_SQL, rows)
+    except Exception as e:
+        logger.error(f"Ошибка обновления агрегатов: {e}")
+
+
+def rebuild_rollups(start, end, resolutions=None, tags=None):
+    """Пересчитывает агрегаты за [start, end) из сырых данных
+
+    Интервалы, попавшие в окно целиком, перезаписываются. Возвращает
+    количество записанных строк агрегатов.
+    """
+    written = 0
+    tag_filter = 'AND tag = ANY(%s)' if tags else ''
+    with connection.cursor() as cursor:
+        for resolution in resolutions or RESOLUTIONS:
+            params = [resolution, RESOLUTIONS[resolution][1], start, end]
+            if tags:
+                params.append(list(tags))
+            cursor.execute(_REBUILD_SQL.format(tag_filter=tag_filter), params)
+            written += cursor.rowcount
+    return written
+
+
+def choose_resolution(start, end, points, max_rows=None):
+    """Самое крупное разрешение, дающее не меньше points точек за диапазон
+
+    Разрешение, дающее больше max_rows строк на тег, не выбирается: тогда
+    берется самое мелкое из укладывающихся (крупнейшее 1h - даже если не
+    укладывается). None означает, что нужны сырые данные.
+    """
+    span = end - start
+    allowed = None
+    for resolution in reversed(list(RESOLUTIONS)):
+        rows = span / RESOLUTIONS[resolution][0]
+        if max_rows is not None and rows > max_rows:
+            return allowed or resolution
+        if rows >= points:
+            return resolution
+        allowed = resolution
+    return None
@@ -0,0 +1,216 @@
+import logging
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from .models import Rule
+from .thresholds import threshold_cache
+
+logger = logging.getLogger(__name__)
+
+
+class RuleGroup:
+    """Правила одного типа и окна: порог и count по индексу тега"""
+
+    def __init__(self, rule_type, window, tags_count):
+        self.rule_type = rule_type
+        self.window = window
+        self.limits = np.full(tags_count, np.nan)
+        self.counts = np.zeros(tags_count)
+        self.rules = {}
+
+    def add(self, tag_index, rule):
+        self.limits[tag_index] = rule.limit
+        self.counts[tag_index] = rule.count
+        self.rules[tag_index] = rule
+
+
+class Series:
+    """Значения всех тегов пачки одним массивом
+
+    Для каждого тега подряд идут хвост истории и новые значения; position -
+    номер значения внутри своего тега, по нему отсекаются окна, которые
+    захватили бы значения соседнего тега.
+    """
+
+    def __init__(self, timestamps, values, lengths, history):
+        self.timestamps = timestamps
+        self.values = values
+        self.starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        self.ends = self.starts + lengths
+        self.history = history
+        self.segment = np.repeat(np.arange(len(lengths)), lengths)
+        self.position = np.arange(len(values)) - np.repeat(self.starts, lengths)
+
+
+def rate_of_change(series, limits, counts, window):
+    """|dv/dt| между соседними значениями больше limit (ед./с)"""
+    violated = np.zeros(len(series.values), dtype=bool)
+    dt = np.diff(series.timestamps)
+    dv = np.abs(np.diff(series.values))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rate = np.where(dt > 0, dv / dt, 0.0)
+    violated[1:] = rate > limits[1:]
+    return violated & (series.position >= 1)
+
+
+def rolling_mean(series, limits, counts, window):
+    """Отклонение от среднего window предыдущих значений больше limit"""
+    values = series.values
+    violated = np.zeros(len(values), dtype=bool)
+    if len(values) > window:
+        sums = np.concatenate(([0.0], np.cumsum(values)))
+        means = (sums[window:-1] - sums[:-window - 1]) / window
+        violated[window:] = np.abs(values[window:] - means) > limits[window:]
+    return violated & (series.position >= window)
+
+
+def stuck(series, limits, counts, window):
+    """Размах последних window значений не больше limit (датчик залип)"""
+    values = series.values
+    violated = np.zeros(len(values), dtype=bool)
+    if len(values) >= window:
+        windows = sliding_window_view(values, window)
+        violated[window - 1:] = windows.max(axis=1) - windows.min(axis=1) <= limits[window - 1:]
+    return violated & (series.position >= window - 1)
+
+
+def n_of_m(series, limits, counts, window):
+    """Не меньше count из последних window значений больше limit"""
+    values = series.values
+    violated = np.zeros(len(values), dtype=bool)
+    if len(values) >= window:
+        exceeded = np.concatenate(([0], np.cumsum(values > limits)))
+        violated[window - 1:] = exceeded[window:] - exceeded[:-window] >= counts[window - 1:]
+    return violated & (series.position >= window - 1)
+
+
+RULE_FUNCTIONS = {
+    Rule.RATE_OF_CHANGE: rate_of_change,
+    Rule.ROLLING_MEAN: rolling_mean,
+    Rule.STUCK: stuck,
+    Rule.N_OF_M: n_of_m,
+}
+
+
+def history_size(rule):
+    """Сколько предыдущих значений нужно правилу"""
+    if rule.rule_type == Rule.RATE_OF_CHANGE:
+        return 1
+    if rule.rule_type == Rule.ROLLING_MEAN:
+        return rule.window
+    return rule.window - 1
+
+
+class RuleEngine:
+    """Векторная проверка правил Rule по пачкам значений
+
+    Значения пачки всех тегов с правилами собираются в один массив вместе с
+    хвостами предыдущих значений (фиксированной длины - сколько нужно
+    самому длинному окну тега), и каждая группа правил одного типа и окна
+    считается NumPy за один проход по всем тегам сразу. Правила
+    перечитываются вместе с уставками (threshold_cache). Вызывается из
+    одного потока записи ингеста.
+    """
+
+    def __init__(self):
+        self.rules = {}
+        self.tag_index = {}
+        self.groups = []
+        self.capacity = np.zeros(0, dtype=np.int64)
+        self.histories = []
+
+    def set_rules(self, rules):
+        """Устанавливает правила {tag: [Rule]} с сохранением истории тегов"""
+        old_histories = dict(zip(self.tag_index, self.histories))
+        self.rules = rules
+        self.tag_index = {tag: i for i, tag in enumerate(rules)}
+        groups = {}
+        capacity = np.zeros(len(rules), dtype=np.int64)
+        for tag, index in self.tag_index.items():
+            for rule in rules[tag]:
+                window = max(rule.window, 1)
+                key = (rule.rule_type, window)
+                if key not in groups:
+                    groups[key] = RuleGroup(rule.rule_type, window, len(rules))
+                groups[key].add(index, rule)
+                capacity[index] = max(capacity[index], history_size(rule))
+        self.groups = list(groups.values())
+        self.capacity = capacity
+        empty = (np.empty(0), np.empty(0))
+        self.histories = [old_histories.get(tag, empty) for tag in self.tag_index]
+
+    def refresh(self):
+        rules = threshold_cache.rules()
+        if rules is not self.rules:
+            self.set_rules(rules)
+
+    def evaluate(self, batch):
+        """Проверка пачки: [(rule, samples, violated)]
+
+        samples - значения тега из пачки в порядке поступления, violated -
+        булев массив нарушений правила для каждого из них.
+        """
+        if not self.rules:
+            return []
+        index = self.tag_index
+        grouped = {}
+        for sensor_data in batch:
+            tag_index = index.get(sensor_data.tag)
+            if tag_index is None:
+                continue
+            item = grouped.get(tag_index)
+            if item is None:
+                item = grouped[tag_index] = ([], [], [])
+            item[0].append(sensor_data)
+            item[1].append(sensor_data.timestamp.timestamp())
+            item[2].append(float(sensor_data.value))
+        if not grouped:
+            return []
+
+        tags = np.fromiter(grouped, np.int64, len(grouped))
+        timestamp_parts = []
+        value_parts = []
+        history = np.empty(len(tags), dtype=np.int64)
+        for i, tag_index in enumerate(tags.tolist()):
+            old_timestamps, old_values = self.histories[tag_index]
+            _, timestamps, values = grouped[tag_index]
+            timestamp_parts += [old_timestamps, timestamps]
+            value_parts += [old_values, values]
+            history[i] = len(old_values)
+        lengths = history + np.fromiter((len(grouped[t][0]) for t in tags), np.int64, len(tags))
+        series = Series(
+            np.concatenate(timestamp_parts), np.concatenate(value_parts), lengths, history
+        )
+
+        tag_list = tags.tolist()
+        starts = (series.starts + history).tolist()
+        ends = series.ends.tolist()
+        results = []
+        for group in self.groups:
+            limits = group.limits[tags]
+            present = ~np.isnan(limits)
+            if not present.any():
+                continue
+            try:
+                violated = RULE_FUNCTIONS[group.rule_type](
+                    series, limits[series.segment], group.counts[tags][series.segment], group.window
+                )
+            except Exception as e:
+                logger.error(f"Ошибка проверки правил {group.rule_type}: {e}")
+                continue
+            for i in np.flatnonzero(present).tolist():
+                tag_index = tag_list[i]
+                results.append((
+                    group.rules[tag_index], grouped[tag_index][0], violated[starts[i]:ends[i]]
+                ))
+
+        # Хвосты для следующей пачки
+        first = np.maximum(series.ends - self.capacity[tags], series.starts).tolist()
+        for i, tag_index in enumerate(tag_list):
+            self.histories[tag_index] = (
+                series.timestamps[first[i]:ends[i]], series.values[first[i]:ends[i]]
+            )
+        return results
+
+
+# Глобальный движок правил процесса ingest
+rule_engine = RuleEngine()
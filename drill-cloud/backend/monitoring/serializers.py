@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import SensorData, Threshold, Incident
+from .models import SensorData, SensorRollup, Threshold, Rule, Incident
 
 
 class SensorDataSerializer(serializers.ModelSerializer):
@@ -10,6 +10,28 @@ class SensorDataSerializer(serializers.ModelSerializer):
         fields = ['id', 'timestamp', 'tag', 'value', 'created_at']
 
 
+class SensorRollupSerializer(serializers.ModelSerializer):
+    """Сериализатор для агрегатов данных сенсоров"""
+    timestamp = serializers.DateTimeField(source='bucket')
+    value = serializers.FloatField(source='avg_value')
+    
+    class Meta:
+        model = SensorRollup
+        fields = ['timestamp', 'tag', 'value', 'min_value', 'max_value', 'count', 'last_value']
+
+
+class SensorTagStatsSerializer(serializers.Serializer):
+    """Сериализатор для записи каталога тегов со статистикой"""
+    tag = serializers.CharField()
+    first_seen = serializers.DateTimeField()
+    last_seen = serializers.DateTimeField()
+    last_value = serializers.FloatField()
+    message_count = serializers.IntegerField()
+    # None, если агрегаты выключены (ROLLUPS_ENABLED=False)
+    count_24h = serializers.IntegerField(allow_null=True)
+    rate = serializers.FloatField(allow_null=True)
+
+
 class ThresholdSerializer(serializers.ModelSerializer):
     """Сериализатор для уставок"""
     
@@ -18,13 +40,34 @@ class ThresholdSerializer(serializers.ModelSerializer):
         fields = ['id', 'tag', 'min_value', 'max_value', 'created_at', 'updated_at']
 
 
+class RuleSerializer(serializers.ModelSerializer):
+    """Сериализатор для правил контроля"""
+    
+    class Meta:
+        model = Rule
+        fields = ['id', 'tag', 'rule_type', 'window', 'count', 'limit', 'is_active',
+                  'created_at', 'updated_at']
+        read_only_fields = ['created_at', 'updated_at']
+
+    def validate(self, data):
+        """Валидация параметров правила"""
+        window = data.get('window', getattr(self.instance, 'window', 10))
+        count = data.get('count', getattr(self.instance, 'count', 1))
+        if window < 1:
+            raise serializers.ValidationError("Окно должно содержать хотя бы одно значение")
+        if count > window:
+            raise serializers.ValidationError("count не может быть больше window")
+        return data
+
+
 class IncidentSerializer(serializers.ModelSerializer):
     """Сериализатор для инцидентов"""
     
     class Meta:
         model = Incident
         fields = ['id', 'tag', 'value', 'threshold_min', 'threshold_max', 
-                 'violation_type', 'timestamp', 'created_at']
+                 'violation_type', 'timestamp', 'created_at', 'status',
+                 'peak_value', 'sample_count', 'last_seen', 'ended_at']
 
 
 class ThresholdCreateUpdateSerializer(serializers.ModelSerializer):
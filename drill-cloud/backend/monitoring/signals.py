@@ -1,46 +1,50 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
-from .models import SensorData, Incident
+from .models import SensorData, Threshold, Rule, Incident
+from .thresholds import bump_thresholds_version, threshold_cache
+from .broadcast import (
+    signal_mode, sensor_data_bulk_saved,
+    broadcast_sensor_update, broadcast_incident_alert
+)
+
+# Рассылка через сигналы работает только при BROADCAST_MODE=signal.
+# В режиме ingest (по умолчанию) ее выполняет MQTT клиент после записи пачки,
+# чтобы каждое значение публиковалось в channel layer ровно один раз.
 
 
 @receiver(post_save, sender=SensorData)
 def send_sensor_update(sender, instance, created, **kwargs):
     """Отправка обновления сенсора через WebSocket"""
-    if created:
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            f"sensor_{instance.tag}",
-            {
-                'type': 'sensor_update',
-                'tag': instance.tag,
-                'data': {
-                    'timestamp': instance.timestamp.isoformat(),
-                    'value': float(instance.value),
-                    'tag': instance.tag
-                }
-            }
-        )
+    if created and signal_mode():
+        broadcast_sensor_update(instance)
+
+
+@receiver(sensor_data_bulk_saved)
+def send_sensor_batch_update(sender, batch, **kwargs):
+    """Отправка обновлений для пачки, записанной через bulk_create"""
+    for instance in batch:
+        broadcast_sensor_update(instance)
 
 
 @receiver(post_save, sender=Incident)
 def send_incident_alert(sender, instance, created, **kwargs):
     """Отправка уведомления об инциденте через WebSocket"""
+    if not signal_mode():
+        return
+    # Эпизод: создание - открытие, дальнейшие сохранения - сводка или закрытие
     if created:
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            "incidents",
-            {
-                'type': 'incident_alert',
-                'incident': {
-                    'id': instance.id,
-                    'tag': instance.tag,
-                    'value': float(instance.value),
-                    'threshold_min': float(instance.threshold_min) if instance.threshold_min else None,
-                    'threshold_max': float(instance.threshold_max) if instance.threshold_max else None,
-                    'violation_type': instance.violation_type,
-                    'timestamp': instance.timestamp.isoformat()
-                }
-            }
-        ) 
\ No newline at end of file
+        event = 'open'
+    else:
+        event = 'close' if instance.status == Incident.STATUS_CLOSED else 'update'
+    broadcast_incident_alert(instance, event)
+
+
+@receiver(post_save, sender=Threshold)
+@receiver(post_delete, sender=Threshold)
+@receiver(post_save, sender=Rule)
+@receiver(post_delete, sender=Rule)
+def invalidate_thresholds(sender, instance, **kwargs):
+    """Сброс кеша уставок и правил после изменения"""
+    threshold_cache.invalidate()
+    transaction.on_commit(bump_thresholds_version)
\ No newline at end of file
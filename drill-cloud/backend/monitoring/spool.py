@@ -0,0 +1,404 @@
+import collections
+import fcntl
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from django.conf import settings
+from django.db import InterfaceError, OperationalError, close_old_connections, connection
+from .models import SensorData
+from .metrics import SAMPLES_DROPPED
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+# Как часто простаивающий поток пересылки проверяет журнал и флаг остановки (сек)
+IDLE_POLL_INTERVAL = 0.5
+
+# Ошибки, при которых пачка повторяется: БД недоступна. Остальные ошибки
+# записи (переполнение DECIMAL, длинный тег и т.п.) при повторе не исчезнут
+RETRYABLE_ERRORS = (OperationalError, InterfaceError)
+
+# AUTOINCREMENT: id не переиспользуются после удаления подтвержденных строк,
+# поэтому порядок id - порядок поступления. enqueued_us - время добавления
+# в журнал (timestamp_us - время измерения, оно может быть любым)
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS spool (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        tag TEXT NOT NULL,
+        timestamp_us INTEGER NOT NULL,
+        value TEXT NOT NULL,
+        enqueued_us INTEGER
+    )
+"""
+
+# Значения, которые Postgres отклонил: хранятся для разбора, в БД не пишутся
+_DEAD_LETTER_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS dead_letter (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        tag TEXT NOT NULL,
+        timestamp_us INTEGER NOT NULL,
+        value TEXT NOT NULL,
+        error TEXT NOT NULL,
+        rejected_us INTEGER NOT NULL
+    )
+"""
+
+
+class SpoolLocked(Exception):
+    """Журнал уже открыт другим процессом ingest"""
+
+
+def spool_path(name):
+    """Файл журнала воркера: у каждого процесса ingest свой"""
+    return os.path.join(settings.INGEST_SPOOL_DIR, f'{name}.sqlite3')
+
+
+def open_spool(name):
+    """Журнал воркера name или None, если журнал выключен
+
+    Журнал занимается процессом эксклюзивно: если он уже открыт (например,
+    запущен второй воркер с тем же client id), бросается SpoolLocked.
+    """
+    if not settings.INGEST_SPOOL_ENABLED:
+        return None
+    return IngestSpool(spool_path(name))
+
+
+def epoch_us(moment):
+    delta = moment - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def encode(sensor_data):
+    return sensor_data.tag, epoch_us(sensor_data.timestamp), str(sensor_data.value)
+
+
+def decode(tag, timestamp_us, value):
+    return SensorData(
+        tag=tag, value=Decimal(value), timestamp=EPOCH + timedelta(microseconds=timestamp_us)
+    )
+
+
+class IngestSpool:
+    """Локальный журнал SQLite, в который ingest пишет пачки до Postgres
+
+    Строка удаляется из журнала (подтверждается), только когда она записана
+    в Postgres. Размер журнала ограничен INGEST_SPOOL_MAX_MB: если места нет,
+    новая пачка отклоняется. Режим WAL: журнал переживает падение процесса,
+    с INGEST_SPOOL_SYNCHRONOUS=FULL - и отключение питания.
+
+    Добавляет пачки один поток (поток записи), читает и подтверждает -
+    поток пересылки; у каждого потока свое соединение SQLite. Файл
+    <путь>.lock держит блокировку flock, пока журнал не освобожден
+    (release): два процесса с одним журналом подтверждали бы строки друг
+    друга и теряли неотправленные.
+    """
+
+    def __init__(self, path, max_bytes=None):
+        self.path = path
+        if max_bytes is None:
+            max_bytes = settings.INGEST_SPOOL_MAX_MB * 1024 * 1024
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self.appended = 0
+        self.rejected = 0
+        self.replayed = 0
+        self.dead_lettered = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock_file = open(f'{path}.lock', 'w')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock_file.close()
+            raise SpoolLocked(f"Журнал ingest {path} уже используется другим процессом")
+        db = self._connection()
+        db.execute(_SCHEMA)
+        db.execute(_DEAD_LETTER_SCHEMA)
+        columns = [row[1] for row in db.execute('PRAGMA table_info(spool)')]
+        if 'enqueued_us' not in columns:
+            # Журнал прежней версии: у оставшихся строк времени добавления нет
+            db.execute('ALTER TABLE spool ADD COLUMN enqueued_us INTEGER')
+        row = db.execute(
+            "SELECT coalesce(min(id) - 1, (SELECT seq FROM sqlite_sequence WHERE name = 'spool'), 0), "
+            "count(*) FROM spool"
+        ).fetchone()
+        self.acked_id = row[0]
+        if row[1]:
+            logger.warning(f"В журнале ingest {path} осталось {row[1]} незаписанных значений")
+
+    def _connection(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute(f'PRAGMA synchronous={settings.INGEST_SPOOL_SYNCHRONOUS}')
+            self._local.db = db
+        return db
+
+    def used_bytes(self):
+        """Занятое строками место (свободные страницы после удаления не считаются)"""
+        db = self._connection()
+        pages = db.execute('PRAGMA page_count').fetchone()[0]
+        free = db.execute('PRAGMA freelist_count').fetchone()[0]
+        page_size = db.execute('PRAGMA page_size').fetchone()[0]
+        return (pages - free) * page_size
+
+    def append(self, batch):
+        """Добавляет пачку одной транзакцией: (first_id, last_id) или None, если места нет"""
+        if self.used_bytes() >= self.max_bytes:
+            self.rejected += len(batch)
+            logger.error(
+                f"Журнал ingest заполнен, отброшено {len(batch)} значений "
+                f"(всего отброшено: {self.rejected})"
+            )
+            return None
+        db = self._connection()
+        enqueued_us = epoch_us(datetime.now(dt_timezone.utc))
+        with db:
+            db.execute('BEGIN IMMEDIATE')
+            db.executemany(
+                'INSERT INTO spool (tag, timestamp_us, value, enqueued_us) VALUES (?, ?, ?, ?)',
+                [(*encode(sensor_data), enqueued_us) for sensor_data in batch]
+            )
+            last_id = db.execute('SELECT last_insert_rowid()').fetchone()[0]
+        self.appended += len(batch)
+        return last_id - len(batch) + 1, last_id
+
+    def read(self, after_id, limit):
+        """Следующие limit строк после after_id: (ids, batch)"""
+        rows = self._connection().execute(
+            'SELECT id, tag, timestamp_us, value FROM spool WHERE id > ? ORDER BY id LIMIT ?',
+            (after_id, limit)
+        ).fetchall()
+        self.replayed += len(rows)
+        return [row[0] for row in rows], [decode(*row[1:]) for row in rows]
+
+    def ack(self, last_id):
+        """Подтверждает запись в Postgres всех строк до last_id включительно"""
+        db = self._connection()
+        with db:
+            db.execute('DELETE FROM spool WHERE id <= ?', (last_id,))
+
+    def dead_letter(self, batch, error):
+        """Сохраняет значения, отклоненные БД, в таблицу dead_letter журнала"""
+        rejected_us = epoch_us(datetime.now(dt_timezone.utc))
+        db = self._connection()
+        with db:
+            db.executemany(
+                'INSERT INTO dead_letter (tag, timestamp_us, value, error, rejected_us) '
+                'VALUES (?, ?, ?, ?, ?)',
+                [(*encode(sensor_data), error, rejected_us) for sensor_data in batch]
+            )
+        self.dead_lettered += len(batch)
+
+    def pending(self):
+        """Количество неподтвержденных строк и время добавления самой старой"""
+        db = self._connection()
+        count = db.execute('SELECT count(*) FROM spool').fetchone()[0]
+        row = db.execute('SELECT enqueued_us FROM spool ORDER BY id LIMIT 1').fetchone()
+        oldest = row[0] if row is not None else None
+        return count, (EPOCH + timedelta(microseconds=oldest)) if oldest is not None else None
+
+    def close(self):
+        db = getattr(self._local, 'db', None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+
+    def release(self):
+        """Снимает блокировку журнала: его может открыть другой процесс"""
+        if not self._lock_file.closed:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._lock_file.close()
+
+
+class SpoolForwarder:
+    """Поток пересылки журнала ingest в Postgres
+
+    Пачки, только что добавленные в журнал, передаются и в память
+    (submit), и пока Postgres успевает, пишутся прямо оттуда. Если запись
+    не удалась или очередь в памяти переполнена, пачка остается только в
+    журнале, и поток дочитывает журнал по порядку id пачками по
+    batch_size, повторяя запись раз в INGEST_SPOOL_RETRY_INTERVAL секунд.
+    Порядок значений сохраняется. Пачка, записанная в Postgres перед самым
+    падением процесса, но не успевшая подтвердиться, после перезапуска
+    будет записана повторно.
+
+    Повторяется запись только при недоступности БД (RETRYABLE_ERRORS).
+    Если Postgres отклоняет данные пачки, она делится пополам, пока
+    отклоненные значения не будут найдены; они переносятся в таблицу
+    dead_letter журнала, остальные записываются, и журнал движется дальше.
+    Каждая записанная часть сразу подтверждается, поэтому если БД станет
+    недоступна посреди деления, повтор продолжится с незаписанной части.
+
+    write(batch) пишет пачку в БД и при ошибке бросает исключение,
+    process(batch) - дальнейшая обработка записанной пачки.
+    """
+
+    def __init__(self, spool, write, process=None, batch_size=None,
+                 memory_batches=None, retry_interval=None):
+        self.spool = spool
+        self.write = write
+        self.process = process
+        self.batch_size = batch_size or settings.INGEST_BATCH_SIZE
+        self.memory_batches = memory_batches or settings.INGEST_SPOOL_MEMORY_BATCHES
+        if retry_interval is None:
+            retry_interval = settings.INGEST_SPOOL_RETRY_INTERVAL
+        self.retry_interval = retry_interval
+        self.acked_id = spool.acked_id
+        self.written = 0
+        self.failures = 0
+        self.db_available = True
+        self._pending = collections.deque()
+        self._cond = threading.Condition()
+        self._stopping = threading.Event()
+        self._deadline = None
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='spool-forwarder', daemon=True)
+        self._thread.start()
+
+    def submit(self, first_id, last_id, batch):
+        """Пачка уже в журнале; в памяти - для записи без чтения с диска"""
+        with self._cond:
+            if len(self._pending) < self.memory_batches:
+                self._pending.append((first_id, last_id, batch))
+            self._cond.notify()
+
+    def stop(self, timeout=None):
+        """Остановка с дозаписью; недописанное остается в журнале до следующего запуска"""
+        if self._thread is None:
+            return
+        self._deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._cond:
+            self._stopping.set()
+            self._cond.notify()
+        self._thread.join(timeout)
+        finished = not self._thread.is_alive()
+        self._thread = None
+        count, _ = self.spool.pending()
+        if count:
+            logger.warning(f"В журнале ingest осталось {count} значений, они будут записаны после запуска")
+        if finished:
+            self.spool.release()
+
+    def _run(self):
+        try:
+            while True:
+                if self._deadline is not None and time.monotonic() >= self._deadline:
+                    return
+                ids, batch = self._next_batch()
+                if not batch:
+                    if self._stopping.is_set():
+                        return
+                    with self._cond:
+                        if not self._pending:
+                            self._cond.wait(IDLE_POLL_INTERVAL)
+                    continue
+                if not self._forward(ids, batch) and not self._wait_retry():
+                    return
+        finally:
+            connection.close()
+            self.spool.close()
+
+    def _next_batch(self):
+        """Следующая пачка после acked_id: (ids, batch) из памяти, если она
+        продолжает подтвержденную часть журнала, иначе с диска"""
+        with self._cond:
+            while self._pending and self._pending[0][1] <= self.acked_id:
+                self._pending.popleft()
+            if self._pending and self._pending[0][0] <= self.acked_id + 1:
+                first_id, last_id, batch = self._pending.popleft()
+                skip = self.acked_id + 1 - first_id
+                return range(first_id + skip, last_id + 1), batch[skip:]
+        return self.spool.read(self.acked_id, self.batch_size)
+
+    def _forward(self, ids, batch):
+        try:
+            self._write_valid(ids, batch)
+        except RETRYABLE_ERRORS as e:
+            self.failures += 1
+            if self.db_available:
+                logger.error(f"Ошибка записи в БД, значения копятся в журнале ingest: {e}")
+            self.db_available = False
+            close_old_connections()
+            return False
+
+        if not self.db_available:
+            count, _ = self.spool.pending()
+            logger.info(f"Запись в БД восстановлена, в журнале {count} значений")
+        self.db_available = True
+        return True
+
+    def _write_valid(self, ids, batch):
+        """Записывает пачку (ids - ее строки в журнале), отделяя значения,
+        которые БД отклоняет
+
+        Каждая записанная или отклоненная часть сразу подтверждается в
+        журнале и обрабатывается. Ошибка из RETRYABLE_ERRORS
+        пробрасывается: повтор начнется с первой неподтвержденной строки.
+        """
+        try:
+            self.write(batch)
+        except RETRYABLE_ERRORS:
+            raise
+        except Exception as e:
+            if len(batch) == 1:
+                self._reject(batch, e)
+                self._ack(ids[-1])
+                return
+            middle = len(batch) // 2
+            self._write_valid(ids[:middle], batch[:middle])
+            self._write_valid(ids[middle:], batch[middle:])
+            return
+        self._ack(ids[-1])
+        self.written += len(batch)
+        if self.process:
+            try:
+                self.process(batch)
+            except Exception as e:
+                logger.error(f"Ошибка обработки записанной пачки: {e}")
+
+    def _ack(self, last_id):
+        self.spool.ack(last_id)
+        self.acked_id = last_id
+
+    def _reject(self, batch, error):
+        sensor_data = batch[0]
+        logger.error(
+            f"БД отклонила значение {sensor_data.tag}={sensor_data.value} "
+            f"({sensor_data.timestamp}), оно перенесено в dead_letter: {error}"
+        )
+        self.spool.dead_letter(batch, str(error))
+        SAMPLES_DROPPED.labels('rejected').inc(len(batch))
+
+    def _wait_retry(self):
+        """Пауза перед повтором; False - пора остановиться, журнал допишется после запуска"""
+        if self._stopping.wait(self.retry_interval):
+            return False
+        return True
+
+    def stats(self):
+        """Метрики журнала для состояния воркера"""
+        count, oldest = self.spool.pending()
+        return {
+            'pending': count,
+            'oldest_age': round((datetime.now(dt_timezone.utc) - oldest).total_seconds(), 1) if oldest else 0,
+            'bytes': self.spool.used_bytes(),
+            'appended': self.spool.appended,
+            'replayed': self.spool.replayed,
+            'rejected': self.spool.rejected,
+            'dead_lettered': self.spool.dead_lettered,
+            'written': self.written,
+            'failures': self.failures,
+            'db_available': self.db_available,
+        }
@@ -0,0 +1,105 @@
+import logging
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from .models import Threshold, Rule
+
+logger = logging.getLogger(__name__)
+
+# Счетчик версий уставок, общий для веб-процесса и процесса ingest
+THRESHOLDS_VERSION_KEY = 'monitoring:thresholds:version'
+
+
+def bump_thresholds_version():
+    """Увеличивает версию уставок, чтобы процессы ingest перечитали их"""
+    try:
+        cache.add(THRESHOLDS_VERSION_KEY, 0, timeout=None)
+        cache.incr(THRESHOLDS_VERSION_KEY)
+    except Exception as e:
+        logger.error(f"Ошибка обновления версии уставок: {e}")
+
+
+def get_thresholds_version():
+    """Текущая версия уставок или None, если кеш недоступен"""
+    try:
+        return cache.get(THRESHOLDS_VERSION_KEY, 0)
+    except Exception as e:
+        logger.error(f"Ошибка чтения версии уставок: {e}")
+        return None
+
+
+class ThresholdCache:
+    """Индекс уставок и правил по тегу в памяти процесса ingest
+
+    Уставки читаются из БД целиком при старте и перечитываются только при
+    смене версии в общем кеше (она проверяется не чаще раза в
+    THRESHOLD_CACHE_CHECK_INTERVAL секунд) либо раз в THRESHOLD_CACHE_MAX_AGE
+    секунд на случай недоступности кеша. Проверка значения к БД не обращается.
+    """
+
+    def __init__(self, check_interval=None, max_age=None):
+        if check_interval is None:
+            check_interval = settings.THRESHOLD_CACHE_CHECK_INTERVAL
+        if max_age is None:
+            max_age = settings.THRESHOLD_CACHE_MAX_AGE
+        self.check_interval = check_interval
+        self.max_age = max_age
+        self._index = {}
+        self._rules = {}
+        self._version = None
+        self._loaded_at = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, tag):
+        """Уставка для тега или None"""
+        self.refresh()
+        return self._index.get(tag)
+
+    def rules(self):
+        """Активные правила: {tag: [Rule]}"""
+        self.refresh()
+        return self._rules
+
+    def invalidate(self):
+        """Помечает индекс устаревшим, он будет перечитан при следующем обращении"""
+        self._loaded_at = None
+        self._checked_at = 0.0
+
+    def refresh(self, force=False):
+        """Перечитывает уставки, если изменилась их версия"""
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.check_interval:
+            return
+
+        with self._lock:
+            self._checked_at = now
+            # Версию читаем до загрузки: правка, сделанная во время загрузки,
+            # будет замечена при следующей проверке
+            version = get_thresholds_version()
+            expired = self._loaded_at is None or now - self._loaded_at >= self.max_age
+            if force or expired or version != self._version:
+                self._load(version, now)
+
+    def _load(self, version, now):
+        try:
+            index = {t.tag: t for t in Threshold.objects.all()}
+            rules = {}
+            for rule in Rule.objects.filter(is_active=True):
+                rules.setdefault(rule.tag, []).append(rule)
+        except Exception as e:
+            logger.error(f"Ошибка загрузки уставок: {e}")
+            return
+        self._index = index
+        self._rules = rules
+        self._version = version
+        self._loaded_at = now
+        logger.info(
+            f"Загружено уставок: {len(self._index)}, правил: "
+            f"{sum(len(r) for r in rules.values())} (версия {version})"
+        )
+
+
+# Глобальный индекс уставок процесса
+threshold_cache = ThresholdCache()
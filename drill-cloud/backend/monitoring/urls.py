@@ -1,12 +1,15 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import SensorDataViewSet, ThresholdViewSet, IncidentViewSet
+from .views import SensorDataViewSet, ThresholdViewSet, RuleViewSet, IncidentViewSet, export_data
 
 router = DefaultRouter()
 router.register(r'data', SensorDataViewSet, basename='sensor-data')
 router.register(r'thresholds', ThresholdViewSet, basename='thresholds')
+router.register(r'rules', RuleViewSet, basename='rules')
 router.register(r'incidents', IncidentViewSet, basename='incidents')
 
 urlpatterns = [
+    # До маршрутов router: иначе data/export/ совпадет с data/<pk>/
+    path('data/export/', export_data, name='sensor-data-export'),
     path('', include(router.urls)),
 ] 
\ No newline at end of file
@@ -1,19 +1,156 @@
-from rest_framework import viewsets, status
+from rest_framework import viewsets, status, serializers
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.urls import replace_query_param
 from django.utils import timezone
-from datetime import timedelta
+from django.utils.dateparse import parse_datetime
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db import connection
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.db.models import Q
-from .models import SensorData, Threshold, Incident
+from .models import SensorData, SensorRollup, Threshold, Rule, Incident
 from .serializers import (
-    SensorDataSerializer, ThresholdSerializer, IncidentSerializer,
+    SensorDataSerializer, SensorRollupSerializer, SensorTagStatsSerializer,
+    ThresholdSerializer, RuleSerializer, IncidentSerializer,
     ThresholdCreateUpdateSerializer
 )
+from .rollups import bucket_start, choose_resolution
+from .downsample import METHODS, fetch_series, downsample
+from .thresholds import threshold_cache
+from .catalog import tag_stats
+from .latest import get_latest
+from .metrics import REGISTRY, CONTENT_TYPE
+from .export import (
+    FORMATS, SlotStream, export_filename, export_slots, export_stream, iterate_in_thread, pyarrow
+)
+from .response_cache import (
+    CachedResponseMixin, DATA_VERSION_KEY, CATALOG_VERSION_KEY, tag_version_key, thresholds_version_key
+)
+from .renderers import (
+    ColumnarJSONRenderer, MessagePackRenderer, is_compact, epoch_ms, columnar
+)
+
+# Размер страницы /api/data/ по умолчанию и максимальный (параметр limit)
+DATA_DEFAULT_LIMIT = 200
+DATA_MAX_LIMIT = 1000
+
+SENSOR_DATA_FIELDS = ['id', 'timestamp', 'tag', 'value', 'created_at']
+
+# Поля сортировки и размер списка /api/data/tags/ по умолчанию
+TAG_ORDERING_FIELDS = ('tag', 'first_seen', 'last_seen', 'message_count', 'count_24h', 'rate')
+TAGS_DEFAULT_LIMIT = 20
+
+# Максимум тегов в одном запросе /api/data/batch/ и /api/data/export/
+BATCH_MAX_TAGS = 50
+
+EXPORT_CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+# Последние limit точек каждого тега: для каждого тега отдельный
+# индексный проход (tag, timestamp) в обратном порядке с LIMIT
+_BATCH_SQL = """
+    SELECT t.tag, d.timestamp, d.value
+    FROM unnest(%s::varchar[]) AS t(tag)
+    CROSS JOIN LATERAL (
+        SELECT timestamp, value FROM sensor_data
+        WHERE tag = t.tag AND timestamp < %s {start_filter}
+        ORDER BY timestamp DESC
+        LIMIT %s
+    ) d
+    ORDER BY t.tag, d.timestamp
+"""
+
+
+def group_columnar(rows, extra=()):
+    """Строки (tag, timestamp, value, *extra) в колоночные ряды по тегам"""
+    series = {}
+    for tag, timestamp, value, *values in rows:
+        item = series.get(tag)
+        if item is None:
+            item = series[tag] = columnar(tag, [], [], **{name: [] for name in extra})
+        item['t'].append(epoch_ms(timestamp))
+        item['v'].append(float(value))
+        for name, column_value in zip(extra, values):
+            item[name].append(column_value)
+    return list(series.values())
+
+
+def compact_payload(series, tag, **meta):
+    """Ответ в колоночном формате: один ряд для tag, иначе список series"""
+    if tag:
+        return {**(series[0] if series else columnar(tag, [], [])), **meta}
+    return {'series': series, **meta}
+
+
+def get_range_start(range_param):
+    """Начало временного диапазона по параметру range (1h, 24h, 7d)"""
+    now = timezone.now()
+    if range_param == '24h':
+        return now - timedelta(days=1)
+    if range_param == '7d':
+        return now - timedelta(days=7)
+    # По умолчанию последний час
+    return now - timedelta(hours=1)
+
+
+def parse_datetime_param(value, name):
+    """ISO-время из параметра запроса; время без пояса считается локальным"""
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(f'{name}: ожидается время в формате ISO 8601')
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def get_time_bounds(params):
+    """Границы [from, to) из параметров from/to или range
 
+    Без from начало берется из range (по умолчанию последний час), без to -
+    текущий момент. ValueError при неверном формате.
+    """
+    start = params.get('from', None)
+    end = params.get('to', None)
+    start = parse_datetime_param(start, 'from') if start else get_range_start(params.get('range', None))
+    end = parse_datetime_param(end, 'to') if end else timezone.now()
+    return start, end
 
-class SensorDataViewSet(viewsets.ReadOnlyModelViewSet):
+
+def encode_cursor(timestamp, pk):
+    return urlsafe_b64encode(f'{timestamp.isoformat()}|{pk}'.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Позиция (timestamp, id) из курсора страницы"""
+    try:
+        timestamp, pk = urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(timestamp), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('cursor: неверный курсор')
+
+
+class SensorDataViewSet(CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
     """ViewSet для данных сенсоров"""
     serializer_class = SensorDataSerializer
+    renderer_classes = [JSONRenderer, ColumnarJSONRenderer, MessagePackRenderer]
+    cached_actions = {
+        'list': ('data', 'RESPONSE_CACHE_DATA_TTL'),
+        'tags': ('tags', 'RESPONSE_CACHE_TAGS_TTL'),
+    }
+
+    def cache_version_keys(self, action, request):
+        if action == 'tags':
+            # Статистика каталога обновляется по TTL, новые теги - сразу
+            return [CATALOG_VERSION_KEY]
+        tag = request.GET.get('tag', None)
+        # Прореживание сохраняет выходы за уставки, поэтому и версия уставок
+        return [tag_version_key(tag) if tag else DATA_VERSION_KEY, thresholds_version_key()]
     
     def get_queryset(self):
         queryset = SensorData.objects.all()
@@ -26,50 +163,253 @@ class SensorDataViewSet(viewsets.ReadOnlyModelViewSet):
         # Фильтрация по временному диапазону
         range_param = self.request.query_params.get('range', None)
         if range_param:
-            now = timezone.now()
-            if range_param == '1h':
-                start_time = now - timedelta(hours=1)
-            elif range_param == '24h':
-                start_time = now - timedelta(days=1)
-            elif range_param == '7d':
-                start_time = now - timedelta(days=7)
-            else:
-                # По умолчанию последний час
-                start_time = now - timedelta(hours=1)
-            
-            queryset = queryset.filter(timestamp__gte=start_time)
+            queryset = queryset.filter(timestamp__gte=get_range_start(range_param))
         
-        # Ограничиваем все запросы максимум 200 записями для производительности
-        latest_records = list(queryset.order_by('-timestamp')[:200])
-        latest_records.reverse()  # Разворачиваем для хронологического порядка
-        return SensorData.objects.filter(id__in=[r.id for r in latest_records]).order_by('timestamp')
+        return queryset.order_by('timestamp')
+
+    def list(self, request, *args, **kwargs):
+        """Данные за диапазон; с параметром points - прореженные или из агрегатов"""
+        try:
+            start, end = get_time_bounds(request.query_params)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        points = request.query_params.get('points', None)
+        if not points:
+            return self.keyset_page(request, start, end)
+        try:
+            points = min(max(int(points), 1), settings.DATA_MAX_POINTS)
+        except ValueError:
+            return Response({'error': 'points должен быть числом'}, status=status.HTTP_400_BAD_REQUEST)
+
+        tag = request.query_params.get('tag', None)
+        if not tag:
+            # Без тега объем ответа умножается на число тегов
+            return Response({'error': 'Для points нужен tag'}, status=status.HTTP_400_BAD_REQUEST)
+
+        method = request.query_params.get('method', None)
+        if method:
+            if method not in METHODS:
+                return Response(
+                    {'error': f'method должен быть одним из: {", ".join(METHODS)}'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            return Response(self.downsampled(tag, start, end, points, method))
+
+        resolution = choose_resolution(start, end, points, settings.DATA_MAX_POINTS)
+
+        compact = is_compact(request)
+        if resolution is None:
+            # Диапазон слишком мал для агрегатов - отдаем сырые данные.
+            # При обрезке по DATA_MAX_RAW_ROWS остаются самые новые строки
+            queryset = SensorData.objects.filter(
+                tag=tag, timestamp__gte=start, timestamp__lt=end
+            ).order_by('-timestamp')[:settings.DATA_MAX_RAW_ROWS]
+            if compact:
+                rows = list(queryset.values_list('tag', 'timestamp', 'value'))
+                series = group_columnar(reversed(rows))
+                return Response(compact_payload(series, tag, resolution='raw'))
+            serializer = SensorDataSerializer(list(queryset)[::-1], many=True)
+        else:
+            queryset = SensorRollup.objects.filter(
+                tag=tag, resolution=resolution,
+                bucket__gte=bucket_start(start, resolution), bucket__lt=end
+            ).order_by('bucket')
+            if compact:
+                rows = queryset.values_list(
+                    'tag', 'bucket', 'sum_value', 'count', 'min_value', 'max_value'
+                )
+                series = group_columnar(
+                    ((r_tag, bucket, total / count, min_value, max_value, count)
+                     for r_tag, bucket, total, count, min_value, max_value in rows),
+                    extra=('min', 'max', 'n')
+                )
+                return Response(compact_payload(series, tag, resolution=resolution))
+            serializer = SensorRollupSerializer(queryset, many=True)
+
+        return Response({
+            'resolution': resolution or 'raw',
+            'count': len(serializer.data),
+            'results': serializer.data,
+        })
+
+    def keyset_page(self, request, start, end):
+        """Страница сырых данных одним запросом, от новых к старым
+
+        Пагинация по (timestamp, id) без COUNT(*): next указывает на более
+        старые записи. Внутри страницы записи в хронологическом порядке,
+        строки сериализуются без создания экземпляров модели.
+        """
+        try:
+            limit = min(max(int(request.query_params.get('limit', DATA_DEFAULT_LIMIT)), 1), DATA_MAX_LIMIT)
+        except ValueError:
+            return Response({'error': 'limit должен быть числом'}, status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = SensorData.objects.filter(timestamp__lt=end)
+        # Без from и range - последние записи без нижней границы, как раньше
+        if 'from' in request.query_params or 'range' in request.query_params:
+            queryset = queryset.filter(timestamp__gte=start)
+        tag = request.query_params.get('tag', None)
+        if tag:
+            queryset = queryset.filter(tag=tag)
+        cursor = request.query_params.get('cursor', None)
+        if cursor:
+            try:
+                timestamp, pk = decode_cursor(cursor)
+            except ValueError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            queryset = queryset.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=pk))
+
+        # Лишняя строка показывает, есть ли следующая страница
+        rows = list(
+            queryset.order_by('-timestamp', '-id').values_list(*SENSOR_DATA_FIELDS)[:limit + 1]
+        )
+        next_url = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_url = replace_query_param(
+                request.build_absolute_uri(), 'cursor', encode_cursor(last[1], last[0])
+            )
+        rows.reverse()
+
+        if is_compact(request):
+            series = group_columnar((row[2], row[1], row[3]) for row in rows)
+            return Response(compact_payload(series, tag, next=next_url))
+
+        fields = [SensorDataSerializer().fields[name] for name in SENSOR_DATA_FIELDS]
+        results = [
+            {
+                name: None if value is None else field.to_representation(value)
+                for name, field, value in zip(SENSOR_DATA_FIELDS, fields, row)
+            }
+            for row in rows
+        ]
+        return Response({'next': next_url, 'results': results})
+
+    def downsampled(self, tag, start, end, points, method):
+        """Ряд тега, прореженный до points точек; выходы за уставки сохраняются"""
+        x, y = fetch_series(tag, start, end)
+        threshold = threshold_cache.get(tag)
+        min_value = max_value = None
+        if threshold is not None:
+            min_value = float(threshold.min_value) if threshold.min_value is not None else None
+            max_value = float(threshold.max_value) if threshold.max_value is not None else None
+        x, y = downsample(x, y, points, method, min_value, max_value)
+
+        if is_compact(self.request):
+            timestamps = (x * 1000).astype('int64').tolist()
+            return {'resolution': method, **columnar(tag, timestamps, y.tolist())}
+
+        timestamp_field = serializers.DateTimeField()
+        results = [
+            {
+                'timestamp': timestamp_field.to_representation(
+                    datetime.fromtimestamp(ts, tz=dt_timezone.utc)
+                ),
+                'tag': tag,
+                'value': value,
+            }
+            for ts, value in zip(x.tolist(), y.tolist())
+        ]
+        return {'resolution': method, 'count': len(results), 'results': results}
+
+    @action(detail=False, methods=['get'])
+    def batch(self, request):
+        """Последние точки нескольких тегов одним запросом (tags=a,b,c)"""
+        tags = request.query_params.get('tags', '').split(',') + request.query_params.getlist('tag')
+        tags = list(dict.fromkeys(t for t in tags if t))
+        if not tags:
+            return Response({'error': 'Не указаны теги (tags)'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(tags) > BATCH_MAX_TAGS:
+            return Response(
+                {'error': f'Не более {BATCH_MAX_TAGS} тегов за запрос'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            start, end = get_time_bounds(request.query_params)
+            limit = min(max(int(request.query_params.get('limit', DATA_DEFAULT_LIMIT)), 1), DATA_MAX_LIMIT)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        params = [tags, end]
+        start_filter = ''
+        # Без from и range - без нижней границы, как у /api/data/
+        if 'from' in request.query_params or 'range' in request.query_params:
+            start_filter = 'AND timestamp >= %s'
+            params.append(start)
+        params.append(limit)
+        with connection.cursor() as cursor:
+            cursor.execute(_BATCH_SQL.format(start_filter=start_filter), params)
+            rows = cursor.fetchall()
+
+        if is_compact(request):
+            found = {item['tag']: item for item in group_columnar(rows)}
+            return Response({'series': [found.get(tag) or columnar(tag, [], []) for tag in tags]})
+
+        fields = SensorDataSerializer().fields
+        results = {tag: [] for tag in tags}
+        for tag, timestamp, value in rows:
+            results[tag].append({
+                'timestamp': fields['timestamp'].to_representation(timestamp),
+                'value': fields['value'].to_representation(value),
+            })
+        return Response({'results': results})
+
+    @action(detail=False, methods=['get'])
+    def latest(self, request):
+        """Последние значения всех тегов или выбранных (tags=a,b,c) из кеша ingest"""
+        tags = request.query_params.get('tags', '').split(',') + request.query_params.getlist('tag')
+        tags = list(dict.fromkeys(t for t in tags if t))
+        return Response({'results': get_latest(tags)})
 
     @action(detail=False, methods=['get'])
     def tags(self, request):
-        """Получение списка всех тегов"""
-        # Получаем только теги, которые имеют данные за последние 24 часа
-        from datetime import timedelta
-        from django.db.models import Count
-        
-        recent_time = timezone.now() - timedelta(hours=24)
-        
-        # Используем агрегацию для быстрого подсчета
-        recent_tags = SensorData.objects.filter(
-            timestamp__gte=recent_time
-        ).values('tag').annotate(
-            count=Count('id')
-        ).order_by('-count')[:20]
-        
-        # Извлекаем только названия тегов
-        top_tags = [item['tag'] for item in recent_tags]
-        
-        return Response({'tags': top_tags})
+        """Список тегов из каталога со статистикой
 
+        Параметры: search - подстрока имени, all=true - включая теги без
+        данных за 24 часа, ordering - поле сортировки (с '-' по убыванию),
+        limit - количество (по умолчанию 20).
+        """
+        ordering = request.query_params.get('ordering', '-count_24h')
+        if ordering.lstrip('-') not in TAG_ORDERING_FIELDS:
+            return Response(
+                {'error': f'ordering должен быть одним из: {", ".join(TAG_ORDERING_FIELDS)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            limit = min(max(int(request.query_params.get('limit', TAGS_DEFAULT_LIMIT)), 1), DATA_MAX_LIMIT)
+        except ValueError:
+            return Response({'error': 'limit должен быть числом'}, status=status.HTTP_400_BAD_REQUEST)
+
+        stats = tag_stats(
+            search=request.query_params.get('search', None),
+            active_only=request.query_params.get('all', '').lower() != 'true'
+        )
+        field = ordering.lstrip('-')
+        descending = ordering.startswith('-')
+        # count_24h и rate без агрегатов - None: такие записи идут последними
+        stats.sort(key=lambda item: ((item[field] is None) != descending, item[field]), reverse=descending)
+        stats = stats[:limit]
+
+        return Response({
+            'tags': [item['tag'] for item in stats],
+            'items': SensorTagStatsSerializer(stats, many=True).data,
+        })
 
-class ThresholdViewSet(viewsets.ModelViewSet):
+
+class ThresholdViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     """ViewSet для уставок"""
     queryset = Threshold.objects.all()
     serializer_class = ThresholdSerializer
+    cached_actions = {
+        'list': ('thresholds', 'RESPONSE_CACHE_THRESHOLDS_TTL'),
+        'retrieve': ('thresholds', 'RESPONSE_CACHE_THRESHOLDS_TTL'),
+    }
+
+    def cache_version_keys(self, action, request):
+        # Версию увеличивает сигнал сохранения и удаления уставки
+        return [thresholds_version_key()]
     
     def get_serializer_class(self):
         if self.action in ['create', 'update', 'partial_update']:
@@ -95,6 +435,18 @@ class ThresholdViewSet(viewsets.ModelViewSet):
         return super().create(request, *args, **kwargs)
 
 
+class RuleViewSet(viewsets.ModelViewSet):
+    """ViewSet для правил контроля"""
+    serializer_class = RuleSerializer
+    
+    def get_queryset(self):
+        queryset = Rule.objects.all()
+        tag = self.request.query_params.get('tag', None)
+        if tag:
+            queryset = queryset.filter(tag=tag)
+        return queryset
+
+
 class IncidentViewSet(viewsets.ReadOnlyModelViewSet):
     """ViewSet для инцидентов"""
     serializer_class = IncidentSerializer
@@ -110,16 +462,54 @@ class IncidentViewSet(viewsets.ReadOnlyModelViewSet):
         # Фильтрация по временному диапазону
         range_param = self.request.query_params.get('range', None)
         if range_param:
-            now = timezone.now()
-            if range_param == '1h':
-                start_time = now - timedelta(hours=1)
-            elif range_param == '24h':
-                start_time = now - timedelta(days=1)
-            elif range_param == '7d':
-                start_time = now - timedelta(days=7)
-            else:
-                start_time = now - timedelta(hours=1)
-            
-            queryset = queryset.filter(timestamp__gte=start_time)
+            queryset = queryset.filter(timestamp__gte=get_range_start(range_param))
         
-        return queryset.order_by('-timestamp') 
\ No newline at end of file
+        return queryset.order_by('-timestamp')
+
+
+def metrics(request):
+    """Метрики процесса в текстовом формате Prometheus"""
+    return HttpResponse(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+
+def export_data(request):
+    """Выгрузка истории тегов потоком: CSV или Parquet, опционально gzip
+
+    Параметры: tags (или tag), from/to или range, format=csv|parquet,
+    gzip=true. Память не зависит от объема, скорость чтения ограничена
+    EXPORT_ROWS_PER_SECOND.
+    """
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Метод не поддерживается'}, status=405)
+    params = request.GET
+    tags = params.get('tags', '').split(',') + params.getlist('tag')
+    tags = list(dict.fromkeys(t for t in tags if t))
+    if not tags:
+        return JsonResponse({'error': 'Не указаны теги (tags)'}, status=400)
+    if len(tags) > BATCH_MAX_TAGS:
+        return JsonResponse({'error': f'Не более {BATCH_MAX_TAGS} тегов за запрос'}, status=400)
+    file_format = params.get('format', 'csv')
+    if file_format not in FORMATS:
+        return JsonResponse({'error': f'format должен быть одним из: {", ".join(FORMATS)}'}, status=400)
+    if file_format == 'parquet' and pyarrow is None:
+        return JsonResponse({'error': 'Parquet недоступен: не установлен pyarrow'}, status=400)
+    try:
+        start, end = get_time_bounds(params)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    compress = params.get('gzip', '').lower() == 'true'
+
+    if not export_slots.acquire(blocking=False):
+        return JsonResponse(
+            {'error': 'Слишком много одновременных выгрузок, повторите позже'}, status=429
+        )
+    content = SlotStream(export_stream(tags, start, end, file_format, compress))
+    if isinstance(request, ASGIRequest):
+        content = iterate_in_thread(content)
+    content_type = EXPORT_CONTENT_TYPES[file_format]
+    if compress and file_format == 'csv':
+        content_type = 'application/gzip'
+    response = StreamingHttpResponse(content, content_type=content_type)
+    filename = export_filename(start, end, file_format, compress)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
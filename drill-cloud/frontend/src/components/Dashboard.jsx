@@ -60,22 +60,22 @@ function Dashboard() {
       
       setLoading(true)
       try {
-        const promises = selectedTags.map(tag =>
-          axios.get(`/api/data/?tag=${tag}`)
-        )
-        const responses = await Promise.all(promises)
+        // Все выбранные теги одним запросом, ряды в колоночном виде
+        const response = await axios.get('/api/data/batch/', {
+          params: { tags: selectedTags.join(','), format: 'columnar' }
+        })
         
         const newData = {}
-        responses.forEach((response, index) => {
-          const rawData = response.data.results.map(item => ({
-            timestamp: new Date(item.timestamp).toLocaleTimeString(),
-            value: parseFloat(item.value)
+        response.data.series.forEach(series => {
+          const rawData = series.t.map((t, index) => ({
+            timestamp: new Date(t).toLocaleTimeString(),
+            value: series.v[index]
           }))
           
           // Ограничиваем количество точек для производительности
           const maxPoints = 100
           const step = Math.max(1, Math.floor(rawData.length / maxPoints))
-          newData[selectedTags[index]] = rawData.filter((_, index) => index % step === 0)
+          newData[series.tag] = rawData.filter((_, index) => index % step === 0)
         })
         setSensorData(newData)
       } catch (err) {
@@ -115,7 +115,9 @@ function Dashboard() {
       selectedTags.forEach(tag => {
         sendMessage({
           type: 'subscribe_sensor',
-          tag: tag
+          tag: tag,
+          batch: true, // Получаем пачки sensor_batch вместо отдельных обновлений
+          interval_ms: 500
         })
       })
     }
@@ -138,8 +140,20 @@ function Dashboard() {
               value: data.data.value
             }].slice(-20) // Ограничиваем до 20 последних точек
           }))
+        } else if (data.type === 'sensor_batch') {
+          setSensorData(prev => ({
+            ...prev,
+            [data.tag]: [...(prev[data.tag] || []), ...data.points.map(point => ({
+              timestamp: new Date(point.timestamp).toLocaleTimeString(),
+              value: point.value
+            }))].slice(-20) // Ограничиваем до 20 последних точек
+          }))
         } else if (data.type === 'incident_alert') {
-          setIncidents(prev => [data.incident, ...prev.slice(0, 5)]) // Ограничиваем до 5 инцидентов
+          // Сводка и закрытие эпизода обновляют уже показанный инцидент
+          setIncidents(prev => [
+            data.incident,
+            ...prev.filter(incident => incident.id !== data.incident.id)
+          ].slice(0, 6)) // Ограничиваем до 6 инцидентов
         }
       } catch (err) {
         console.error('Ошибка обработки WebSocket сообщения:', err)
@@ -279,8 +293,8 @@ function Dashboard() {
             {incidents.map((incident, index) => (
               <Chip
                 key={index}
-                label={`${incident.tag}: ${incident.value} (${incident.violation_type})`}
-                color="error"
+                label={`${incident.tag}: ${incident.peak_value ?? incident.value} (${incident.violation_type}${incident.sample_count > 1 ? `, ×${incident.sample_count}` : ''})`}
+                color={incident.status === 'closed' ? 'default' : 'error'}
                 variant="outlined"
                 size="small"
               />
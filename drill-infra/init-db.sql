@@ -9,6 +9,30 @@ CREATE TABLE IF NOT EXISTS sensor_data (
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Создание таблицы агрегатов данных сенсоров (1 с, 1 мин, 1 ч)
+CREATE TABLE IF NOT EXISTS sensor_rollups (
+    id BIGSERIAL PRIMARY KEY,
+    tag VARCHAR(100) NOT NULL,
+    resolution VARCHAR(4) NOT NULL, -- '1s', '1m' или '1h'
+    bucket TIMESTAMP WITH TIME ZONE NOT NULL,
+    min_value DOUBLE PRECISION NOT NULL,
+    max_value DOUBLE PRECISION NOT NULL,
+    sum_value DOUBLE PRECISION NOT NULL,
+    count INTEGER NOT NULL,
+    last_value DOUBLE PRECISION NOT NULL,
+    last_timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
+    CONSTRAINT sensor_rollups_tag_resolution_bucket_key UNIQUE (tag, resolution, bucket)
+);
+
+-- Каталог тегов: ведется ingest после записи каждой пачки
+CREATE TABLE IF NOT EXISTS sensor_tags (
+    tag VARCHAR(100) PRIMARY KEY,
+    first_seen TIMESTAMP WITH TIME ZONE NOT NULL,
+    last_seen TIMESTAMP WITH TIME ZONE NOT NULL,
+    last_value DOUBLE PRECISION NOT NULL,
+    message_count BIGINT NOT NULL DEFAULT 0
+);
+
 -- Создание таблицы для хранения уставок
 CREATE TABLE IF NOT EXISTS thresholds (
     id SERIAL PRIMARY KEY,
@@ -19,6 +43,20 @@ CREATE TABLE IF NOT EXISTS thresholds (
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Правила контроля параметров помимо уставок min/max
+CREATE TABLE IF NOT EXISTS rules (
+    id SERIAL PRIMARY KEY,
+    tag VARCHAR(100) NOT NULL,
+    rule_type VARCHAR(20) NOT NULL, -- 'rate_of_change', 'rolling_mean', 'stuck' или 'n_of_m'
+    "window" INTEGER NOT NULL DEFAULT 10,
+    count INTEGER NOT NULL DEFAULT 1,
+    "limit" DOUBLE PRECISION NOT NULL,
+    is_active BOOLEAN NOT NULL DEFAULT TRUE,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT rules_tag_rule_type_key UNIQUE (tag, rule_type)
+);
+
 -- Создание таблицы для хранения инцидентов
 CREATE TABLE IF NOT EXISTS incidents (
     id SERIAL PRIMARY KEY,
@@ -31,9 +69,19 @@ CREATE TABLE IF NOT EXISTS incidents (
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Эпизоды инцидентов: одна запись на период нарушения.
+-- Скрипт выполняется только при создании тома Postgres: существующие базы
+-- (новые таблицы выше и эти колонки) обновляет manage.py upgrade_schema
+ALTER TABLE incidents ADD COLUMN IF NOT EXISTS peak_value DECIMAL(10, 3);
+ALTER TABLE incidents ADD COLUMN IF NOT EXISTS sample_count INTEGER NOT NULL DEFAULT 1;
+ALTER TABLE incidents ADD COLUMN IF NOT EXISTS last_seen TIMESTAMP WITH TIME ZONE;
+ALTER TABLE incidents ADD COLUMN IF NOT EXISTS ended_at TIMESTAMP WITH TIME ZONE;
+ALTER TABLE incidents ADD COLUMN IF NOT EXISTS status VARCHAR(10) NOT NULL DEFAULT 'closed'; -- 'open' или 'closed'
+
 -- Создание индексов для оптимизации запросов
+-- (отдельный индекс по tag не нужен: его покрывает индекс tag+timestamp;
+-- секционированная схема с BRIN: manage.py sensor_partitions convert)
 CREATE INDEX IF NOT EXISTS idx_sensor_data_timestamp ON sensor_data(timestamp);
-CREATE INDEX IF NOT EXISTS idx_sensor_data_tag ON sensor_data(tag);
 CREATE INDEX IF NOT EXISTS idx_sensor_data_tag_timestamp ON sensor_data(tag, timestamp);
 CREATE INDEX IF NOT EXISTS idx_incidents_timestamp ON incidents(timestamp);
 CREATE INDEX IF NOT EXISTS idx_incidents_tag ON incidents(tag);